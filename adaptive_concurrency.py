@@ -0,0 +1,210 @@
+"""自适应并发模块 - 按AIMD调整飞书写入的并发请求数，收敛到多维表格可持续的写入速率"""
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 飞书频率限制错误码：99991400 应用/租户请求频率超限，1254290 多维表格请求过于频繁
+FEISHU_RATE_LIMIT_CODES = frozenset({99991400, 1254290})
+
+
+def is_feishu_rate_limited(error: Exception) -> bool:
+    """
+    判断飞书接口错误是否为频率限制
+
+    Args:
+        error: 接口调用抛出的异常
+
+    Returns:
+        HTTP 429 或频率限制错误码时返回True
+    """
+    response = getattr(error, 'response', None)
+    status_code = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if status_code == 429:
+        return True
+    code = getattr(error, 'code', None)
+    if code is not None:
+        try:
+            return int(code) in FEISHU_RATE_LIMIT_CODES
+        except (TypeError, ValueError):
+            pass
+    message = str(error).lower()
+    return any(str(code) in message for code in FEISHU_RATE_LIMIT_CODES) or 'frequency limit' in message
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD并发限制器
+
+    并发窗口内的请求直接执行，超出时等待。窗口占满、请求成功且延迟不超过基线的
+    latency_tolerance 倍时，窗口每轮（约一个窗口的请求数）加1；遇到频率限制时窗口乘以 decrease_factor，
+    同一轮内的多次限流只减一次。
+    """
+
+    def __init__(self, initial_limit: float = 2, min_limit: int = 1, max_limit: int = 16,
+                 decrease_factor: float = 0.5, latency_tolerance: float = 2.0,
+                 is_rate_limited: Callable[[Exception], bool] = is_feishu_rate_limited):
+        """
+        初始化并发限制器
+
+        Args:
+            initial_limit: 初始并发窗口
+            min_limit: 最小并发窗口
+            max_limit: 最大并发窗口
+            decrease_factor: 限流时窗口的缩小倍数
+            latency_tolerance: 延迟超过基线的倍数时停止增大窗口
+            is_rate_limited: 判断异常是否为频率限制的函数
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.is_rate_limited = is_rate_limited
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._latency: Optional[float] = None  # 延迟的指数移动平均
+        self._baseline: Optional[float] = None  # 观察到的较低平均延迟
+        self._decreased_at = 0.0
+        self._saturated_at = -1.0
+        self._stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'decreases': 0, 'peak': 0}
+
+    def acquire(self) -> float:
+        """
+        等待并占用一个并发名额
+
+        Returns:
+            开始时间（传给 release）
+        """
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+            self._stats['peak'] = max(self._stats['peak'], self._in_flight)
+            started = time.monotonic()
+            if self._in_flight >= int(self.limit):
+                self._saturated_at = started
+        return started
+
+    def release(self, started: float, outcome: str = 'success'):
+        """
+        释放并发名额，并按结果调整窗口
+
+        Args:
+            started: acquire 返回的开始时间
+            outcome: success/rate_limited/error
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._cond:
+            # 请求期间窗口被占满过才说明并发不足，否则不增大窗口
+            saturated = self._saturated_at >= started
+            self._in_flight -= 1
+            self._stats['requests'] += 1
+            if outcome == 'rate_limited':
+                self._stats['rate_limited'] += 1
+                # 限流前已发出的请求也会陆续被限流，间隔一个平均延迟内只减一次
+                if now - self._decreased_at >= (self._latency or latency):
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                    self._decreased_at = now
+                    self._stats['decreases'] += 1
+                    logger.debug(f"飞书写入限流，并发窗口降至 {self.limit:.1f}")
+            elif outcome == 'error':
+                self._stats['errors'] += 1
+            else:
+                self._latency = latency if self._latency is None else self._latency * 0.8 + latency * 0.2
+                # 基线缓慢上浮，飞书整体变慢后仍能恢复增长
+                self._baseline = self._latency if self._baseline is None else min(self._baseline * 1.002, self._latency)
+                if saturated and self._latency <= self._baseline * self.latency_tolerance:
+                    self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        在并发窗口内调用函数
+
+        Args:
+            func: 要调用的函数
+            *args, **kwargs: 调用参数
+
+        Returns:
+            函数返回值
+        """
+        started = self.acquire()
+        outcome = 'success'
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            outcome = 'rate_limited' if self.is_rate_limited(e) else 'error'
+            raise
+        finally:
+            self.release(started, outcome)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取并发统计
+
+        Returns:
+            当前窗口、并发中请求数、峰值并发、请求/限流/错误次数和平均延迟（毫秒）
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['window'] = round(self.limit, 1)
+            stats['in_flight'] = self._in_flight
+            stats['latency_ms'] = round(self._latency * 1000) if self._latency is not None else None
+        return stats
+
+
+class AdaptiveBitableClient:
+    """
+    带自适应并发控制的多维表格客户端
+
+    写入方法经并发限制器执行，遇到频率限制时按指数退避重试；其他方法直接调用原客户端。
+    """
+
+    WRITE_METHODS = frozenset({'batch_create_records', 'batch_update_records', 'upsert_record',
+                               'create_record', 'update_record'})
+
+    def __init__(self, bitable, limiter: AdaptiveConcurrencyLimiter,
+                 rate_limit_retries: int = 3, retry_delay: float = 0.5):
+        """
+        初始化客户端
+
+        Args:
+            bitable: 飞书多维表格客户端（BitableClient）
+            limiter: 并发限制器
+            rate_limit_retries: 频率限制时的最大重试次数
+            retry_delay: 重试基础等待时间（秒，按次数翻倍并加随机抖动）
+        """
+        self.bitable = bitable
+        self.limiter = limiter
+        self.rate_limit_retries = rate_limit_retries
+        self.retry_delay = retry_delay
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.bitable, name)
+        if name not in self.WRITE_METHODS:
+            return attr
+
+        def limited(*args, **kwargs):
+            return self._call(attr, *args, **kwargs)
+        return limited
+
+    def _call(self, func: Callable, *args, **kwargs) -> Any:
+        """在并发窗口内调用写入方法，频率限制时退避重试"""
+        attempt = 0
+        while True:
+            try:
+                return self.limiter.call(func, *args, **kwargs)
+            except Exception as e:
+                if attempt >= self.rate_limit_retries or not self.limiter.is_rate_limited(e):
+                    raise
+                delay = self.retry_delay * 2 ** attempt * random.uniform(0.5, 1.0)
+                attempt += 1
+                logger.warning(f"飞书写入触发频率限制，{delay:.1f}秒后重试（第{attempt}次）: {e}")
+                time.sleep(delay)
@@ -0,0 +1,179 @@
+"""钉钉异步客户端模块 - 在同一个事件循环中并发数百个详情请求，令牌、限流、重试和缓存与同步客户端共用"""
+import asyncio
+from typing import Dict, Optional
+
+import json_codec
+from dingtalk_client import DingTalkClient
+from logger import setup_logger
+from retry_policy import DingTalkAPIError
+
+try:
+    import aiohttp
+except ImportError:  # 可选依赖，使用异步详情拉取时需安装 aiohttp
+    aiohttp = None
+
+logger = setup_logger(__name__)
+
+
+class AsyncDingTalkClient:
+    """
+    钉钉异步客户端
+
+    不单独维护令牌和策略，而是包装一个 DingTalkClient：访问令牌、令牌文件缓存、限流器、
+    重试策略（含熔断器）和详情缓存都使用同步客户端的实例，线程和协程看到的是同一个令牌。
+    令牌刷新在协程间单飞：多个协程同时遇到令牌过期（40014）时只有一个执行刷新，
+    其余协程等待后直接使用新令牌；刷新本身复用同步客户端的跨线程、跨进程单飞逻辑。
+    事件循环中不做文件读写，令牌缓存、共享限流状态和详情缓存的读写在线程中执行。
+    """
+
+    def __init__(self, client: DingTalkClient, limit: int = 100, keep_alive: bool = True, gzip: bool = True):
+        """
+        初始化异步客户端
+
+        Args:
+            client: 同步客户端（提供令牌、限流器、重试策略和缓存）
+            limit: 连接池最大连接数
+            keep_alive: 是否保持长连接
+            gzip: 是否协商gzip压缩
+        """
+        if aiohttp is None:
+            raise Exception("异步详情拉取需要安装 aiohttp")
+        self.client = client
+        self.limit = max(1, limit)
+        self.headers = {
+            'Connection': 'keep-alive' if keep_alive else 'close',
+            'Accept-Encoding': 'gzip, deflate' if gzip else 'identity'
+        }
+        # 会话和锁绑定创建它们的事件循环，每次流水线运行使用新的事件循环
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional['aiohttp.ClientSession'] = None
+        self._token_lock: Optional[asyncio.Lock] = None
+
+    def _bind_loop(self):
+        """当前事件循环与已创建的会话不一致时重新创建会话和令牌锁"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._session is not None and not self._session.closed:
+            return
+        self._loop = loop
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limit, force_close=self.headers['Connection'] == 'close'),
+            headers=self.headers
+        )
+        self._token_lock = asyncio.Lock()
+
+    async def close(self):
+        """关闭HTTP会话，释放连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def get_access_token(self) -> str:
+        """
+        获取访问令牌（协程间单飞刷新）
+
+        Returns:
+            访问令牌
+        """
+        client = self.client
+        margin = client.TOKEN_SAFETY_MARGIN
+        if client._token_remaining() > margin:
+            return client._access_token
+        self._bind_loop()
+        async with self._token_lock:
+            # 等待锁期间其他协程可能已完成刷新
+            if client._token_remaining() > margin:
+                return client._access_token
+            return await asyncio.to_thread(client._refresh_access_token, margin)
+
+    async def _throttle(self, endpoint: str):
+        """
+        按接口限流，在发送请求前调用
+
+        Args:
+            endpoint: 接口名（list/detail/user）
+        """
+        limiter = self.client.rate_limiter
+        bucket = limiter.buckets.get(endpoint) if limiter else None
+        if bucket is None:
+            return
+        # 跨进程共享的令牌桶在文件锁内读写状态文件
+        delay = await asyncio.to_thread(bucket.reserve) if bucket.state_file else bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _request(self, method: str, path: str, endpoint: str, description: str,
+                       params: Optional[Dict] = None, body: Optional[Dict] = None,
+                       timeout: float = 30, decode=json_codec.loads) -> Dict:
+        """
+        发送带令牌的请求，按同步客户端的重试策略处理令牌过期、限流和临时错误
+
+        Args:
+            method: HTTP方法
+            path: 接口路径
+            endpoint: 接口名（用于限流）
+            description: 接口描述（用于日志）
+            params: 查询参数（不含access_token）
+            body: JSON请求体
+            timeout: 超时时间（秒）
+            decode: 响应体解码函数
+
+        Returns:
+            errcode为0的响应数据
+        """
+        url = f"{self.client.base_url}{path}"
+
+        async def _attempt() -> Dict:
+            access_token = await self.get_access_token()
+            query = dict(params or {}, access_token=access_token)
+            await self._throttle(endpoint)
+            self._bind_loop()
+            try:
+                async with self._session.request(method, url, params=query, json=body,
+                                                 timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    content = await response.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # 与 requests 的连接错误、超时一样按临时错误重试
+                raise ConnectionError(f"{description}请求失败: {e!r}") from e
+            if response.status >= 400:
+                raise DingTalkAPIError(description, None, response.reason, access_token, response.status)
+            data = decode(content)
+            if data.get('errcode') != 0:
+                raise DingTalkAPIError(description, data.get('errcode'), data.get('errmsg', '未知错误'), access_token)
+            return data
+
+        async def _on_token_expired(error: DingTalkAPIError):
+            await asyncio.to_thread(self.client._invalidate_token, error.access_token)
+
+        return await self.client.retry_policy.acall(_attempt, description, _on_token_expired)
+
+    async def get_process_instance_detail(self, process_instance_id: str) -> Dict:
+        """
+        获取审批实例详情（终态详情读写同步客户端的详情缓存）
+
+        Args:
+            process_instance_id: 审批实例ID
+
+        Returns:
+            审批实例详情数据
+        """
+        detail_cache = self.client.detail_cache
+        if detail_cache:
+            cached = await asyncio.to_thread(detail_cache.get, process_instance_id)
+            if cached is not None:
+                return cached
+
+        try:
+            data = await self._request(
+                'GET', '/topapi/processinstance/get', 'detail', "获取审批实例详情",
+                params={"process_instance_id": process_instance_id},
+                decode=json_codec.decode_detail_response
+            )
+        except Exception as e:
+            logger.error(f"获取审批实例详情失败: {e}")
+            raise
+
+        result = data.get('process_instance', {})
+        if detail_cache:
+            await asyncio.to_thread(detail_cache.put, process_instance_id, result)
+        return result
@@ -0,0 +1,124 @@
+"""审批详情JSON解码基准测试
+
+对比标准库 json 完整解码与快速后端（orjson/msgspec）+ 字段裁剪的耗时，
+并包含 DataProcessor 转换的耗时。
+
+用法:
+    python benchmarks/bench_json.py                      # 使用合成的大详情
+    python benchmarks/bench_json.py --sample detail.json # 使用抓取的真实 /processinstance/get 响应
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import json_codec
+from data_processor import DataProcessor
+
+
+def _text(n: int) -> str:
+    return ''.join(random.choice(string.ascii_letters + '审批报销出差采购') for _ in range(n))
+
+
+def make_detail_response(tasks: int, forms: int) -> bytes:
+    """生成包含大量任务和表单组件的审批详情响应"""
+    base = 1705285800000
+    detail = {
+        "process_instance_id": "bench-001",
+        "title": _text(30),
+        "status": "FINISHED",
+        "result": "agree",
+        "business_id": "202401150001",
+        "process_code": "PROC-BENCH",
+        "originator_userid": "user0",
+        "originator_user_name": "发起人",
+        "originator_dept_id": "1001",
+        "originator_dept_name": "技术部",
+        "create_time": base,
+        "finish_time": base + 86400000,
+        "cc_userid_list": [f"user{i}" for i in range(50)],
+        "attached_process_instance_ids": [],
+        "operation_records": [
+            {"userid": f"user{i}", "date": base + i, "type": "EXECUTE_TASK_NORMAL",
+             "result": "AGREE", "remark": _text(200), "attachments": []}
+            for i in range(tasks)
+        ],
+        "tasks": [
+            {"task_id": i, "task_name": f"节点{i}", "userid": f"user{i}", "user_name": f"审批人{i}",
+             "status": "COMPLETED", "task_result": "AGREE", "action_type": "EXECUTE_TASK_NORMAL",
+             "create_time": base + i * 1000, "finish_time": base + i * 1000 + 500,
+             "comment": _text(100), "url": "https://aflow.dingtalk.com/" + _text(60)}
+            for i in range(tasks)
+        ],
+        "form_component_values": [
+            {"id": f"field{i}", "name": "金额" if i == 0 else f"字段{i}", "component_type": "TextField",
+             "value": "12,345.67" if i == 0 else _text(300), "ext_value": json.dumps({"detail": _text(200)})}
+            for i in range(forms)
+        ],
+    }
+    return json.dumps({"errcode": 0, "errmsg": "ok", "process_instance": detail,
+                       "request_id": "bench"}, ensure_ascii=False).encode('utf-8')
+
+
+def bench(label: str, func, payload: bytes, rounds: int) -> float:
+    func(payload)  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(payload)
+    per_call = (time.perf_counter() - start) / rounds * 1000
+    print(f"{label:<40} {per_call:8.3f} ms/次")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description='审批详情JSON解码基准测试')
+    parser.add_argument('--sample', help='真实审批详情响应JSON文件')
+    parser.add_argument('--tasks', type=int, default=200, help='合成详情的任务数')
+    parser.add_argument('--forms', type=int, default=150, help='合成详情的表单组件数')
+    parser.add_argument('--rounds', type=int, default=200, help='每项重复次数')
+    args = parser.parse_args()
+
+    if args.sample:
+        with open(args.sample, 'rb') as f:
+            payload = f.read()
+    else:
+        payload = make_detail_response(args.tasks, args.forms)
+    print(f"响应大小: {len(payload) / 1024:.1f} KB")
+
+    def baseline(data):
+        detail = json.loads(data)['process_instance']
+        DataProcessor.process_instance_main(detail)
+        DataProcessor.process_instance_actions(detail)
+
+    results = {'json 完整解码 + 转换（改造前）': bench('json 完整解码 + 转换（改造前）', baseline, payload, args.rounds)}
+
+    for backend in json_codec.BACKENDS:
+        if backend != 'json' and not {'orjson': json_codec.orjson, 'msgspec': json_codec.msgspec}[backend]:
+            print(f"{backend:<40} 未安装，跳过")
+            continue
+        for project in (False, True):
+            json_codec.configure(backend=backend, project_detail=project)
+
+            def candidate(data):
+                detail = json_codec.decode_detail_response(data)['process_instance']
+                DataProcessor.process_instance_main(detail)
+                DataProcessor.process_instance_actions(detail)
+
+            if project:
+                label = f"{backend} + {'按字段类型化解码' if backend == 'msgspec' else '字段裁剪'} + 转换"
+            else:
+                label = f"{backend} 完整解码 + 转换"
+            results[label] = bench(label, candidate, payload, args.rounds)
+
+    base = next(iter(results.values()))
+    best_label, best = min(results.items(), key=lambda item: item[1])
+    print(f"\n最快: {best_label}，相对改造前提速 {base / best:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
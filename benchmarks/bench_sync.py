@@ -0,0 +1,151 @@
+"""端到端同步吞吐基准测试
+
+启动本地钉钉/飞书模拟服务（benchmarks/fake_servers.py），用临时配置运行 SyncManager.run，
+输出每秒同步的审批实例数和两端的请求统计。
+
+用法:
+    python benchmarks/bench_sync.py                                   # 1000 条实例，无延迟
+    python benchmarks/bench_sync.py --instances 5000 --dingtalk-latency 0.05 --feishu-latency 0.1
+    python benchmarks/bench_sync.py --dingtalk-qps list=10,detail=20 --token-expire-rate 0.01
+    python benchmarks/bench_sync.py --set sync.concurrency=32 --set dingtalk.detail_cache_dir='"state/detail_cache"' --runs 2
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.fake_servers import FakeDingTalkServer, FakeFeishuServer
+
+APP_TOKEN = 'bench_app'
+MAIN_TABLE = 'tbl_main'
+ACTION_TABLE = 'tbl_action'
+
+
+def parse_qps(value: str) -> Dict[str, float]:
+    """解析 list=10,detail=20 形式的QPS限制"""
+    limits = {}
+    for item in filter(None, value.split(',')):
+        name, _, qps = item.partition('=')
+        limits[name.strip()] = float(qps)
+    return limits
+
+
+def apply_override(config: Dict, override: str):
+    """应用 a.b.c=JSON值 形式的配置覆盖（值不是合法JSON时按字符串处理）"""
+    path, _, raw = override.partition('=')
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError:
+        value = raw
+    node = config
+    keys = path.split('.')
+    for key in keys[:-1]:
+        node = node.setdefault(key, {})
+    node[keys[-1]] = value
+
+
+def build_config(dingtalk_url: str, feishu_url: str, overrides) -> Dict:
+    config = {
+        'dingtalk': {
+            'app_key': 'bench_key',
+            'app_secret': 'bench_secret',
+            'base_url': dingtalk_url,
+        },
+        'feishu': {
+            'app_id': 'bench_app_id',
+            'app_secret': 'bench_app_secret',
+            'base_url': feishu_url,
+            'app_token': APP_TOKEN,
+            'tables': {'main': MAIN_TABLE, 'action': ACTION_TABLE},
+        },
+        'sync': {
+            'checkpoint_file': 'state/checkpoint.json',
+        },
+        'notification': {'enabled': False},
+    }
+    for override in overrides:
+        apply_override(config, override)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端同步吞吐基准测试')
+    parser.add_argument('--instances', type=int, default=1000, help='合成审批实例数')
+    parser.add_argument('--days', type=float, default=1, help='实例分布的天数（即同步的时间范围）')
+    parser.add_argument('--templates', type=int, default=1, help='审批模板数（大于1时按多模板同步）')
+    parser.add_argument('--tasks', type=int, default=3, help='每个实例的审批任务数')
+    parser.add_argument('--dingtalk-latency', type=float, default=0.0, help='钉钉接口延迟（秒）')
+    parser.add_argument('--feishu-latency', type=float, default=0.0, help='飞书接口延迟（秒）')
+    parser.add_argument('--dingtalk-qps', default='', help='钉钉接口QPS限制，如 list=10,detail=20')
+    parser.add_argument('--feishu-qps', default='', help='飞书接口QPS限制，如 create=50,search=50')
+    parser.add_argument('--token-expire-rate', type=float, default=0.0, help='钉钉返回40014的概率')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='钉钉返回90018的概率')
+    parser.add_argument('--feishu-rate-limit-rate', type=float, default=0.0, help='飞书返回限流的概率')
+    parser.add_argument('--runs', type=int, default=1, help='重复运行次数（同一状态目录，可观察缓存效果）')
+    parser.add_argument('--set', dest='overrides', action='append', default=[],
+                        help='配置覆盖，如 sync.concurrency=32（可多次指定）')
+    args = parser.parse_args()
+
+    end_time = datetime.now().replace(microsecond=0)
+    start_time = end_time - timedelta(days=args.days)
+    process_codes = tuple(f"PROC-BENCH-{i + 1}" for i in range(args.templates))
+
+    dingtalk = FakeDingTalkServer(
+        instances=args.instances, start_time=start_time, span=end_time - start_time,
+        process_codes=process_codes, tasks_per_instance=args.tasks,
+        token_expire_rate=args.token_expire_rate, rate_limit_rate=args.rate_limit_rate,
+        latency=args.dingtalk_latency, qps=parse_qps(args.dingtalk_qps)
+    )
+    feishu = FakeFeishuServer(
+        rate_limit_rate=args.feishu_rate_limit_rate,
+        latency=args.feishu_latency, qps=parse_qps(args.feishu_qps)
+    )
+
+    with dingtalk, feishu, tempfile.TemporaryDirectory(prefix='bench_sync_') as work_dir:
+        overrides = list(args.overrides)
+        if args.templates > 1:
+            overrides.append('sync.templates=' + json.dumps(list(process_codes)))
+        config = build_config(dingtalk.url, feishu.url, overrides)
+        config_path = os.path.join(work_dir, 'config.yaml')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True)
+
+        # 状态文件使用相对路径，全部落在临时目录
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            from sync import SyncManager
+            manager = SyncManager(config_path)
+
+            print(f"实例数: {args.instances}，时间范围: {args.days} 天，模板数: {args.templates}")
+            for run in range(1, args.runs + 1):
+                dingtalk.counts.clear()
+                feishu.counts.clear()
+                started = time.perf_counter()
+                try:
+                    manager.run(start_time=start_time, end_time=end_time)
+                except SystemExit:
+                    print(f"第 {run} 次运行失败（详见日志）")
+                elapsed = time.perf_counter() - started
+
+                synced = len({record['fields'].get('instance_id')
+                              for record in feishu.records(APP_TOKEN, MAIN_TABLE)})
+                print(f"\n第 {run} 次运行: 耗时 {elapsed:.2f} 秒，主表 {synced} 条，"
+                      f"吞吐 {args.instances / elapsed:.1f} 实例/秒")
+                print(f"  钉钉请求: {dict(sorted(dingtalk.counts.items()))}")
+                print(f"  飞书请求: {dict(sorted(feishu.counts.items()))}")
+            manager.dingtalk_client.close()
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
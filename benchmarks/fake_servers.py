@@ -0,0 +1,461 @@
+"""钉钉/飞书本地模拟服务
+
+用于在不访问线上接口的情况下测量同步吞吐，支持：
+- 可配置的接口延迟
+- 按接口的QPS限制（超限返回钉钉 90018 / 飞书 99991400）
+- 按比例注入钉钉 40014 令牌过期和限流错误
+- 按数量生成合成审批实例
+
+用法:
+    from benchmarks.fake_servers import FakeDingTalkServer, FakeFeishuServer
+
+    with FakeDingTalkServer(instances=1000, latency=0.02) as dingtalk, FakeFeishuServer() as feishu:
+        ...  # dingtalk.url / feishu.url 作为 base_url
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+class _QPSWindow:
+    """按接口的1秒滑动窗口计数"""
+
+    def __init__(self, limits: Optional[Dict[str, float]]):
+        self.limits = limits or {}
+        self._lock = threading.Lock()
+        self._hits: Dict[str, deque] = defaultdict(deque)
+
+    def allow(self, endpoint: str) -> bool:
+        limit = self.limits.get(endpoint)
+        if not limit:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits[endpoint]
+            while hits and hits[0] <= now - 1:
+                hits.popleft()
+            if len(hits) >= limit:
+                return False
+            hits.append(now)
+            return True
+
+
+class _FakeServer:
+    """模拟服务基类：在后台线程中运行 ThreadingHTTPServer"""
+
+    def __init__(self, latency: float = 0.0, qps: Optional[Dict[str, float]] = None, seed: Optional[int] = None):
+        """
+        Args:
+            latency: 每个请求的固定延迟（秒）
+            qps: 接口名到每秒请求上限的映射
+            seed: 随机种子（故障注入和数据生成可复现）
+        """
+        self.latency = latency
+        self.qps = _QPSWindow(qps)
+        self.random = random.Random(seed)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self._counts_lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _dispatch(self, method: str):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                body = json.loads(raw) if raw else {}
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                if server.latency:
+                    time.sleep(server.latency)
+                status, payload = server.handle(method, parsed.path, query, body, self.headers)
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def count(self, name: str):
+        with self._counts_lock:
+            self.counts[name] += 1
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: Dict,
+               headers) -> Tuple[int, Dict]:
+        raise NotImplementedError
+
+
+class FakeDingTalkServer(_FakeServer):
+    """
+    钉钉模拟服务：/gettoken、/topapi/processinstance/list、/topapi/processinstance/get、
+    /topapi/v2/user/get、/topapi/v2/department/get
+
+    QPS限制的接口名与客户端限流配置一致：gettoken/list/detail/user/department。
+    """
+
+    def __init__(self, instances: int = 1000, start_time: Optional[datetime] = None,
+                 span: timedelta = timedelta(days=1), process_codes: Tuple[str, ...] = ('PROC-BENCH',),
+                 tasks_per_instance: int = 3, running_ratio: float = 0.2,
+                 token_expire_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 latency: float = 0.0, qps: Optional[Dict[str, float]] = None, seed: Optional[int] = 0):
+        """
+        Args:
+            instances: 合成审批实例数（均匀分布在 start_time 起的 span 内）
+            start_time: 实例创建时间的起点（默认当天零点）
+            span: 实例创建时间的跨度
+            process_codes: 审批模板代码（实例按顺序轮流分配）
+            tasks_per_instance: 每个实例的审批任务数
+            running_ratio: 审批中实例的比例
+            token_expire_rate: 请求返回 40014 的概率（同时作废该令牌）
+            rate_limit_rate: 请求返回 90018 的概率
+            latency: 每个请求的固定延迟（秒）
+            qps: 接口名到每秒请求上限的映射
+            seed: 随机种子
+        """
+        super().__init__(latency, qps, seed)
+        self.token_expire_rate = token_expire_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._tokens_lock = threading.Lock()
+        self._tokens: Dict[str, bool] = {}
+        self._token_seq = 0
+
+        start_time = start_time or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start_ms = int(start_time.timestamp() * 1000)
+        step = int(span.total_seconds() * 1000) // max(instances, 1)
+        self.instances: List[Dict[str, Any]] = []
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        for i in range(instances):
+            create_time = start_ms + i * step
+            running = self.random.random() < running_ratio
+            detail = self._make_detail(i, process_codes[i % len(process_codes)], create_time,
+                                       tasks_per_instance, running)
+            self.instances.append(detail)
+            self._by_id[detail['process_instance_id']] = detail
+
+    def _make_detail(self, index: int, process_code: str, create_time: int, tasks: int,
+                     running: bool) -> Dict[str, Any]:
+        task_list = []
+        for t in range(tasks):
+            task_running = running and t == tasks - 1
+            task = {
+                'task_id': index * 100 + t,
+                'task_name': f"审批节点{t + 1}",
+                'userid': f"user{(index + t) % 50}",
+                'user_name': f"审批人{(index + t) % 50}",
+                'status': 'RUNNING' if task_running else 'COMPLETED',
+                'action_type': 'EXECUTE_TASK_NORMAL',
+                'create_time': create_time + t * 60000,
+            }
+            if not task_running:
+                # 未完成的任务没有 finish_time 字段
+                task['finish_time'] = create_time + t * 60000 + 30000
+                task['comment'] = '同意'
+            task_list.append(task)
+        detail = {
+            'process_instance_id': f"bench-{index:08d}",
+            'title': f"报销申请-{index}",
+            'status': 'RUNNING' if running else 'FINISHED',
+            'result': '' if running else 'agree',
+            'business_id': f"{index:012d}",
+            'process_code': process_code,
+            'originator_userid': f"user{index % 50}",
+            'originator_user_name': f"员工{index % 50}",
+            'originator_dept_id': str(1000 + index % 10),
+            'originator_dept_name': f"部门{index % 10}",
+            'create_time': create_time,
+            'current_approvers': [task_list[-1]['userid']] if running and task_list else [],
+            'tasks': task_list,
+            'form_component_values': [
+                {'name': '金额', 'component_name': 'MoneyField', 'value': f"{(index % 997) * 10.5:.2f}"},
+                {'name': '事由', 'component_name': 'TextareaField', 'value': f"合成数据 {index}"},
+            ],
+        }
+        if not running:
+            detail['finish_time'] = create_time + tasks * 60000
+        return detail
+
+    def _check_token(self, query: Dict[str, str]) -> Optional[Dict]:
+        """校验令牌并按比例注入故障，返回错误响应或None"""
+        token = query.get('access_token')
+        with self._tokens_lock:
+            valid = self._tokens.get(token, False)
+            if valid and self.token_expire_rate and self.random.random() < self.token_expire_rate:
+                self._tokens[token] = False
+                valid = False
+        if not valid:
+            self.count('errors.40014')
+            return {'errcode': 40014, 'errmsg': '不合法的access_token'}
+        if self.rate_limit_rate and self.random.random() < self.rate_limit_rate:
+            self.count('errors.90018')
+            return {'errcode': 90018, 'errmsg': '当前请求被限流'}
+        return None
+
+    def handle(self, method, path, query, body, headers):
+        endpoint = {
+            '/gettoken': 'gettoken',
+            '/topapi/processinstance/list': 'list',
+            '/topapi/processinstance/get': 'detail',
+            '/topapi/v2/user/get': 'user',
+            '/topapi/v2/department/get': 'department',
+        }.get(path)
+        if endpoint is None:
+            return 404, {'errcode': 404, 'errmsg': 'not found'}
+        self.count(endpoint)
+        if not self.qps.allow(endpoint):
+            self.count('errors.90018')
+            return 200, {'errcode': 90018, 'errmsg': '当前企业调用该接口超过限制'}
+
+        if endpoint == 'gettoken':
+            with self._tokens_lock:
+                self._token_seq += 1
+                token = f"fake-token-{self._token_seq}"
+                self._tokens[token] = True
+            return 200, {'errcode': 0, 'errmsg': 'ok', 'access_token': token, 'expires_in': 7200}
+
+        error = self._check_token(query)
+        if error:
+            return 200, error
+
+        if endpoint == 'list':
+            return 200, {'errcode': 0, 'errmsg': 'ok', 'result': self._list(body)}
+        if endpoint == 'detail':
+            detail = self._by_id.get(query.get('process_instance_id'))
+            if detail is None:
+                return 200, {'errcode': 88, 'errmsg': '审批实例不存在'}
+            return 200, {'errcode': 0, 'errmsg': 'ok', 'process_instance': detail}
+        if endpoint == 'user':
+            userid = body.get('userid', '')
+            return 200, {'errcode': 0, 'errmsg': 'ok', 'result': {'userid': userid, 'name': f"用户{userid}"}}
+        dept_id = body.get('dept_id')
+        return 200, {'errcode': 0, 'errmsg': 'ok', 'result': {'dept_id': dept_id, 'name': f"部门{dept_id}"}}
+
+    def _list(self, body: Dict) -> Dict:
+        start, end = int(body['start_time']), int(body['end_time'])
+        process_code = body.get('process_code')
+        statuses = set(body.get('statuses') or [])
+        selected = [
+            item for item in self.instances
+            if start <= item['create_time'] < end
+            and (not process_code or item['process_code'] == process_code)
+            and (not statuses or item['status'] in statuses)
+        ]
+        cursor, size = int(body.get('cursor', 0)), int(body.get('size', 20))
+        page = selected[cursor:cursor + size]
+        result = {'list': [{'process_instance_id': item['process_instance_id'],
+                            'status': item['status'], 'create_time': item['create_time']} for item in page]}
+        if cursor + size < len(selected):
+            result['has_more'] = True
+            result['next_cursor'] = cursor + size
+        return result
+
+
+class FakeFeishuServer(_FakeServer):
+    """
+    飞书多维表格模拟服务：租户令牌、记录列表/查询/检索，以及单条和批量新增、更新
+
+    QPS限制的接口名：token/list/search/get/create/update/batch_create/batch_update。
+    """
+
+    RECORDS_PATH = re.compile(r'^/open-apis/bitable/v1/apps/([^/]+)/tables/([^/]+)/records(?:/([^/]+))?$')
+    FILTER_FORMULA = re.compile(r'CurrentValue\.\[(.+?)\]\s*=\s*"(.*?)"')
+
+    def __init__(self, rate_limit_rate: float = 0.0, latency: float = 0.0,
+                 qps: Optional[Dict[str, float]] = None, seed: Optional[int] = 0):
+        """
+        Args:
+            rate_limit_rate: 请求返回 99991400 限流的概率
+            latency: 每个请求的固定延迟（秒）
+            qps: 接口名到每秒请求上限的映射
+            seed: 随机种子
+        """
+        super().__init__(latency, qps, seed)
+        self.rate_limit_rate = rate_limit_rate
+        self._lock = threading.Lock()
+        self.tables: Dict[Tuple[str, str], Dict[str, Dict]] = defaultdict(dict)
+        # (表, 字段名) -> 字段值 -> 记录ID列表，按需建立，避免按字段查找时全表扫描
+        self._indexes: Dict[Tuple[Tuple[str, str], str], Dict[str, List[str]]] = {}
+        self._record_seq = 0
+
+    def records(self, app_token: str, table_id: str) -> List[Dict]:
+        """返回表中全部记录（用于校验同步结果）"""
+        with self._lock:
+            return [dict(record) for record in self.tables[(app_token, table_id)].values()]
+
+    def _new_record(self, key: Tuple[str, str], fields: Dict) -> Dict:
+        self._record_seq += 1
+        record = {'record_id': f"rec{self._record_seq:010d}", 'fields': dict(fields)}
+        self.tables[key][record['record_id']] = record
+        self._index_record(key, record)
+        return record
+
+    def _update_record(self, key: Tuple[str, str], record: Dict, fields: Dict):
+        for (table_key, name), index in self._indexes.items():
+            if table_key == key and name in fields:
+                ids = index.get(str(record['fields'].get(name)), [])
+                if record['record_id'] in ids:
+                    ids.remove(record['record_id'])
+        record['fields'].update(fields)
+        self._index_record(key, record)
+
+    def _index_record(self, key: Tuple[str, str], record: Dict):
+        for (table_key, name), index in self._indexes.items():
+            if table_key == key:
+                ids = index.setdefault(str(record['fields'].get(name)), [])
+                if record['record_id'] not in ids:
+                    ids.append(record['record_id'])
+
+    def _lookup(self, key: Tuple[str, str], name: str, value: Any) -> List[str]:
+        index = self._indexes.get((key, name))
+        if index is None:
+            index = self._indexes[(key, name)] = {}
+            for record in self.tables[key].values():
+                index.setdefault(str(record['fields'].get(name)), []).append(record['record_id'])
+        return index.get(str(value), [])
+
+    def _candidates(self, key: Tuple[str, str], conditions, conjunction: str) -> List[Dict]:
+        table = self.tables[key]
+        if not conditions:
+            return list(table.values())
+        if conjunction == 'or':
+            record_ids = {record_id for name, value in conditions for record_id in self._lookup(key, name, value)}
+            return [record for record_id, record in table.items() if record_id in record_ids]
+        return [table[record_id] for record_id in self._lookup(key, *conditions[0])]
+
+    @staticmethod
+    def _ok(data: Dict) -> Tuple[int, Dict]:
+        return 200, {'code': 0, 'msg': 'success', 'data': data}
+
+    @staticmethod
+    def _match(record: Dict, conditions: List[Tuple[str, Any]], conjunction: str = 'and') -> bool:
+        fields = record['fields']
+        matches = (str(fields.get(name)) == str(value) for name, value in conditions)
+        return any(matches) if conjunction == 'or' else all(matches)
+
+    def _page(self, key: Tuple[str, str], conditions, page_token: Optional[str], page_size: int,
+              conjunction: str = 'and') -> Dict:
+        matched = [record for record in self._candidates(key, conditions, conjunction)
+                   if self._match(record, conditions, conjunction)]
+        offset = int(page_token or 0)
+        items = matched[offset:offset + page_size]
+        has_more = offset + page_size < len(matched)
+        return {'items': items, 'total': len(matched), 'has_more': has_more,
+                'page_token': str(offset + page_size) if has_more else None}
+
+    def handle(self, method, path, query, body, headers):
+        if path == '/open-apis/auth/v3/tenant_access_token/internal':
+            self.count('token')
+            return 200, {'code': 0, 'msg': 'ok', 'tenant_access_token': 't-fake', 'expire': 7200}
+
+        match = self.RECORDS_PATH.match(path)
+        if not match:
+            return 404, {'code': 404, 'msg': 'not found'}
+        app_token, table_id, tail = match.groups()
+
+        if method == 'GET':
+            endpoint = 'get' if tail else 'list'
+        elif method == 'PUT':
+            endpoint = 'update'
+        else:
+            endpoint = {None: 'create', 'search': 'search', 'batch_create': 'batch_create',
+                        'batch_update': 'batch_update'}.get(tail, 'unknown')
+        self.count(endpoint)
+
+        if not self.qps.allow(endpoint) or (self.rate_limit_rate and self.random.random() < self.rate_limit_rate):
+            self.count('errors.99991400')
+            return 429, {'code': 99991400, 'msg': 'request trigger frequency limit'}
+
+        with self._lock:
+            key = (app_token, table_id)
+            table = self.tables[key]
+            page_size = int(query.get('page_size', 20))
+
+            if endpoint == 'list':
+                formula = query.get('filter', '')
+                conditions = self.FILTER_FORMULA.findall(formula)
+                conjunction = 'or' if formula.startswith('OR(') else 'and'
+                return self._ok(self._page(key, conditions, query.get('page_token'), page_size, conjunction))
+            if endpoint == 'search':
+                search_filter = body.get('filter') or {}
+                conditions = [(item['field_name'], (item.get('value') or [''])[0])
+                              for item in search_filter.get('conditions', [])]
+                return self._ok(self._page(key, conditions, query.get('page_token'), page_size,
+                                           search_filter.get('conjunction', 'and')))
+            if endpoint == 'get':
+                record = table.get(tail)
+                if record is None:
+                    return 200, {'code': 1254043, 'msg': 'RecordIdNotFound'}
+                return self._ok({'record': record})
+            if endpoint == 'create':
+                return self._ok({'record': self._new_record(key, body.get('fields', {}))})
+            if endpoint == 'update':
+                record = table.get(tail)
+                if record is None:
+                    return 200, {'code': 1254043, 'msg': 'RecordIdNotFound'}
+                self._update_record(key, record, body.get('fields', {}))
+                return self._ok({'record': record})
+            if endpoint == 'batch_create':
+                records = body.get('records', [])
+                if len(records) > 500:
+                    return 200, {'code': 1254104, 'msg': 'RecordsExceedLimit'}
+                return self._ok({'records': [self._new_record(key, item.get('fields', {}))
+                                             for item in records]})
+            if endpoint == 'batch_update':
+                records = body.get('records', [])
+                if len(records) > 500:
+                    return 200, {'code': 1254104, 'msg': 'RecordsExceedLimit'}
+                missing = [item.get('record_id') for item in records if item.get('record_id') not in table]
+                if missing:
+                    return 200, {'code': 1254043, 'msg': f"RecordIdNotFound: {missing[0]}"}
+                updated = []
+                for item in records:
+                    record = table[item['record_id']]
+                    self._update_record(key, record, item.get('fields', {}))
+                    updated.append(record)
+                return self._ok({'records': updated})
+        return 404, {'code': 404, 'msg': 'not found'}
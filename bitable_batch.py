@@ -0,0 +1,399 @@
+"""飞书多维表格批量写入模块 - 明细记录跨审批实例合并写入，主表记录按新增/更新分组批量写入"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from adaptive_concurrency import is_feishu_rate_limited
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 多维表格批量新增/更新接口单次最多500条
+BITABLE_BATCH_LIMIT = 500
+
+# 与具体记录无关的多维表格错误码：写冲突、数据未就绪、内部错误、服务端超时
+FEISHU_TRANSIENT_CODES = frozenset({1254291, 1254607, 1255001, 1255002, 1255040})
+
+
+def field_text(value: Any) -> Any:
+    """
+    取多维表格字段的文本值（文本字段在列表接口中可能返回为富文本片段列表）
+
+    Args:
+        value: 字段值
+
+    Returns:
+        文本值，非富文本时原样返回
+    """
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return ''.join(str(item.get('text', '')) for item in value)
+    return value
+
+
+def is_batch_error(error: Exception) -> bool:
+    """
+    判断写入错误是否与具体记录无关（频率限制、服务端错误、网络错误）
+
+    这类错误拆批或逐条重写只会把一次失败放大成成百上千次失败请求，应整批失败，
+    由写入日志或下次同步重试；字段校验等其他错误才需要拆批定位出错的记录。
+
+    Args:
+        error: 写入接口抛出的异常
+
+    Returns:
+        整批性错误时返回True
+    """
+    if is_feishu_rate_limited(error):
+        return True
+    response = getattr(error, 'response', None)
+    status_code = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code >= 500
+    code = getattr(error, 'code', None)
+    if code is not None:
+        try:
+            return int(code) in FEISHU_TRANSIENT_CODES
+        except (TypeError, ValueError):
+            pass
+    message = str(error)
+    if any(str(code) in message for code in FEISHU_TRANSIENT_CODES):
+        return True
+    # requests 的连接错误、超时均为 OSError 子类（带状态码的 HTTPError 已在上面按状态码判断）
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+
+def record_ids_of(response: Any) -> List[Optional[str]]:
+    """
+    从新增接口的返回中按顺序取出记录ID
+
+    Args:
+        response: 记录、记录列表，或包含 record/records 的字典
+
+    Returns:
+        记录ID列表
+    """
+    if isinstance(response, dict):
+        if 'records' in response:
+            response = response['records']
+        elif 'record' in response:
+            response = [response['record']]
+        else:
+            response = [response]
+    if not isinstance(response, list):
+        return []
+    return [item.get('record_id') if isinstance(item, dict) else None for item in response]
+
+
+class ActionRecordBatcher:
+    """
+    明细记录批量写入器
+
+    多个审批实例的明细记录先进入缓冲区（新增和更新分开缓冲），攒满一批或调用 flush 时
+    通过 batch_create_records / batch_update_records 写入；整批因记录内容出错时逐条重写，定位并记录
+    失败的记录，因限流、服务端或网络错误失败时整批记为失败，交给 on_failed（记入写入日志，下次运行重写）。
+    写入结果计入记录所属的统计字典。
+    """
+
+    def __init__(self, bitable, app_token: str, table_id: str, batch_size: int = BITABLE_BATCH_LIMIT,
+                 on_written: Optional[Callable[[str, str, str, Dict[str, Any]], None]] = None,
+                 on_failed: Optional[Callable[[str, Optional[str], Optional[Dict[str, Any]]], None]] = None):
+        """
+        初始化批量写入器
+
+        Args:
+            bitable: 飞书多维表格客户端（BitableClient）
+            app_token: 多维表格 app_token
+            table_id: 明细表ID
+            batch_size: 每批记录数（不超过500）
+            on_written: 带指纹的记录写入成功后的回调（审批实例ID, 指纹, record_id, 字段）
+            on_failed: 记录写入失败后的回调（审批实例ID, 指纹, 字段）；带指纹的记录新增成功但未返回
+                记录ID时也会回调，字段为None（只需释放指纹）
+        """
+        self.bitable = bitable
+        self.app_token = app_token
+        self.table_id = table_id
+        self.batch_size = max(1, min(batch_size, BITABLE_BATCH_LIMIT))
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # (审批实例ID, 字段, 结果计入的统计字典, 任务指纹, 已有记录ID)
+        self._creates: List[Tuple[str, Dict[str, Any], Optional[Dict[str, int]], Optional[str], Optional[str]]] = []
+        self._updates: List[Tuple[str, Dict[str, Any], Optional[Dict[str, int]], Optional[str], Optional[str]]] = []
+
+    def add(self, instance_id: str, records: List[Dict[str, Any]], stats: Optional[Dict[str, int]] = None,
+            fingerprints: Optional[List[str]] = None, record_ids: Optional[List[Optional[str]]] = None) -> int:
+        """
+        加入一个审批实例的明细记录，缓冲区攒满一批时立即写入
+
+        Args:
+            instance_id: 审批实例ID
+            records: 明细记录字段列表
+            stats: 写入结果计入的统计字典（action_inserted/action_updated/action_failed）
+            fingerprints: 与 records 对应的任务指纹（可选，写入成功后传给 on_written）
+            record_ids: 与 records 对应的已有记录ID（可选，有记录ID的按记录ID更新）
+
+        Returns:
+            加入的记录数
+        """
+        items = []
+        for position, record in enumerate(records):
+            fields = {key: value for key, value in record.items() if value is not None}
+            fingerprint = fingerprints[position] if fingerprints else None
+            record_id = record_ids[position] if record_ids else None
+            items.append((instance_id, fields, stats, fingerprint, record_id))
+        if not items:
+            return 0
+
+        batches = []
+        with self._lock:
+            for item in items:
+                (self._updates if item[4] else self._creates).append(item)
+            for update, buffer in ((False, self._creates), (True, self._updates)):
+                while len(buffer) >= self.batch_size:
+                    batches.append((update, buffer[:self.batch_size]))
+                    del buffer[:self.batch_size]
+        for update, batch in batches:
+            self._write_batch(batch, update)
+        return len(items)
+
+    def record_skipped(self, stats: Optional[Dict[str, int]], count: int):
+        """
+        统计内容未变化、无需写入的明细记录
+
+        Args:
+            stats: 统计字典
+            count: 跳过的记录数
+        """
+        if stats is None or not count:
+            return
+        with self._stats_lock:
+            stats['action_skipped'] = stats.get('action_skipped', 0) + count
+
+    def flush(self):
+        """写入缓冲区中剩余的记录"""
+        with self._lock:
+            creates, self._creates = self._creates, []
+            updates, self._updates = self._updates, []
+        for update, pending in ((False, creates), (True, updates)):
+            for start in range(0, len(pending), self.batch_size):
+                self._write_batch(pending[start:start + self.batch_size], update)
+
+    def pending_count(self) -> int:
+        """缓冲区中待写入的记录数"""
+        with self._lock:
+            return len(self._creates) + len(self._updates)
+
+    def _write_batch(self, batch, update: bool = False):
+        """
+        写入一批记录，整批因记录内容出错时逐条重写
+
+        Args:
+            batch: 待写入的记录
+            update: 是否为按记录ID更新
+        """
+        kind = '更新' if update else '写入'
+        try:
+            if update:
+                self.bitable.batch_update_records(
+                    self.app_token,
+                    self.table_id,
+                    [{"record_id": record_id, "fields": fields} for _, fields, _, _, record_id in batch]
+                )
+                record_ids = [item[4] for item in batch]
+            else:
+                response = self.bitable.batch_create_records(
+                    self.app_token,
+                    self.table_id,
+                    [{"fields": fields} for _, fields, _, _, _ in batch]
+                )
+                # 批量新增按请求顺序返回记录
+                record_ids = record_ids_of(response)
+            self._record(batch, record_ids, 'action_updated' if update else 'action_inserted')
+            logger.debug(f"批量{kind}明细记录 {len(batch)} 条")
+            return
+        except Exception as e:
+            if is_batch_error(e):
+                logger.error(f"批量{kind}明细记录失败（{len(batch)} 条），整批记为失败: {e}")
+                self._record(batch, [None] * len(batch), 'action_failed')
+                return
+            logger.warning(f"批量{kind}明细记录失败（{len(batch)} 条），改为逐条{kind}: {e}")
+
+        for item in batch:
+            instance_id, fields, _, _, record_id = item
+            try:
+                result = self.bitable.upsert_record(self.app_token, self.table_id, record_id, fields)
+                written_id = record_id or next(iter(record_ids_of(result)), None)
+                self._record([item], [written_id], 'action_updated' if update else 'action_inserted')
+            except Exception as e:
+                logger.warning(f"{kind}动作记录失败 {instance_id}: {e}")
+                self._record([item], [None], 'action_failed')
+
+    def _record(self, items, record_ids: List[Optional[str]], key: str):
+        with self._stats_lock:
+            for _, _, stats, _, _ in items:
+                if stats is not None:
+                    stats[key] = stats.get(key, 0) + 1
+        for (instance_id, fields, _, fingerprint, _), record_id in zip(items, record_ids):
+            if key == 'action_failed':
+                if self.on_failed:
+                    self.on_failed(instance_id, fingerprint, fields)
+            elif not fingerprint:
+                continue
+            elif record_id:
+                if self.on_written:
+                    self.on_written(instance_id, fingerprint, record_id, fields)
+            elif self.on_failed:
+                self.on_failed(instance_id, fingerprint, None)
+
+
+class MainRecordBatcher:
+    """
+    主表记录批量新增或更新
+
+    一批记录先一次性解析哪些已存在，再分为批量更新和批量新增两组请求；
+    失败时整批重试，重试仍因记录内容出错时二分拆批，定位并剔除出错的记录；
+    限流、服务端或网络错误不拆批，整批返回失败（由写入日志或下次同步重试）。
+    频率限制只由 AdaptiveBitableClient 退避重试，这里遇到即整批失败，避免两层重试次数相乘。
+    """
+
+    def __init__(self, bitable, app_token: str, table_id: str,
+                 resolver: Callable[[List[str]], Dict[str, str]],
+                 key_field: str = 'instance_id', max_retries: int = 3, retry_delay: float = 1.0,
+                 on_created: Optional[Callable[[str, str], None]] = None):
+        """
+        初始化批量写入器
+
+        Args:
+            bitable: 飞书多维表格客户端（BitableClient）
+            app_token: 多维表格 app_token
+            table_id: 主表ID
+            resolver: 根据键值列表查询已存在记录的函数，返回键值到 record_id 的映射
+            key_field: 唯一键字段名
+            max_retries: 整批请求的最大尝试次数
+            retry_delay: 重试基础等待时间（秒，按次数翻倍）
+            on_created: 新增记录成功后的回调（键值, record_id），用于更新本地索引
+        """
+        self.bitable = bitable
+        self.app_token = app_token
+        self.table_id = table_id
+        self.resolver = resolver
+        self.key_field = key_field
+        self.max_retries = max(1, max_retries)
+        self.retry_delay = retry_delay
+        self.on_created = on_created
+
+    def upsert(self, rows: List[Dict[str, Any]],
+               changes: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Optional[str]]:
+        """
+        批量新增或更新主表记录
+
+        Args:
+            rows: 主表数据列表（同一键值出现多次时以最后一条为准）
+            changes: 键值到变化字段的映射（可选），已存在的记录只更新其中的字段，新增记录仍写入全部字段
+
+        Returns:
+            键值到错误信息的映射，写入成功时为None
+        """
+        latest: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            latest[row[self.key_field]] = {key: value for key, value in row.items() if value is not None}
+        if not latest:
+            return {}
+
+        results: Dict[str, Optional[str]] = {}
+        try:
+            existing = self.resolver(list(latest))
+        except Exception as e:
+            logger.error(f"查询主表已有记录失败: {e}")
+            return {key: f"查询主表已有记录失败: {e}" for key in latest}
+
+        changes = changes or {}
+        updates = [(key, {"record_id": existing[key], "fields": changes.get(key, fields)})
+                   for key, fields in latest.items() if existing.get(key)]
+        creates = [(key, {"fields": fields})
+                   for key, fields in latest.items() if not existing.get(key)]
+
+        for start in range(0, len(updates), BITABLE_BATCH_LIMIT):
+            results.update(self._write('update', updates[start:start + BITABLE_BATCH_LIMIT]))
+        for start in range(0, len(creates), BITABLE_BATCH_LIMIT):
+            results.update(self._write('create', creates[start:start + BITABLE_BATCH_LIMIT]))
+        logger.debug(f"主表批量写入: 更新 {len(updates)} 条，新增 {len(creates)} 条")
+        return results
+
+    def _send(self, kind: str, items: List[Tuple[str, Dict[str, Any]]]):
+        records = [record for _, record in items]
+        if kind == 'update':
+            self.bitable.batch_update_records(self.app_token, self.table_id, records)
+            return
+        response = self.bitable.batch_create_records(self.app_token, self.table_id, records)
+        if self.on_created:
+            # 批量新增按请求顺序返回记录
+            for (key, _), record_id in zip(items, record_ids_of(response)):
+                if record_id:
+                    self.on_created(key, record_id)
+
+    def _write(self, kind: str, items: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Optional[str]]:
+        """
+        写入一批记录：整批重试（频率限制不重试），仍因记录内容出错时二分拆批
+
+        Args:
+            kind: update/create
+            items: (键值, 请求记录) 列表
+
+        Returns:
+            键值到错误信息的映射
+        """
+        error = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self._send(kind, items)
+                return {key: None for key, _ in items}
+            except Exception as e:
+                error = e
+                if is_feishu_rate_limited(e):
+                    # 频率限制由 AdaptiveBitableClient 退避重试，这里再重试会把重试次数相乘
+                    break
+                if attempt < self.max_retries:
+                    logger.warning(f"主表批量{'更新' if kind == 'update' else '新增'}失败（{len(items)} 条），"
+                                   f"{self.retry_delay * 2 ** (attempt - 1):.1f}秒后重试: {e}")
+                    time.sleep(self.retry_delay * 2 ** (attempt - 1))
+        if is_batch_error(error):
+            return self._fail_all(kind, items, error)
+        return self._bisect(kind, items, error)
+
+    def _fail_all(self, kind: str, items: List[Tuple[str, Dict[str, Any]]],
+                  error: Exception) -> Dict[str, Optional[str]]:
+        """整批记为失败（错误与具体记录无关，拆批只会放大请求量）"""
+        logger.error(f"主表批量{'更新' if kind == 'update' else '新增'}失败（{len(items)} 条），不拆批: {error}")
+        return {key: str(error) for key, _ in items}
+
+    def _bisect(self, kind: str, items: List[Tuple[str, Dict[str, Any]]], error: Exception) -> Dict[str, Optional[str]]:
+        """
+        二分拆批定位出错的记录（整批重试已用尽，拆出的子批各尝试一次；
+        子批遇到限流、服务端或网络错误时停止拆分，该子批整体失败）
+
+        Args:
+            kind: update/create
+            items: (键值, 请求记录) 列表
+            error: 整批的错误
+
+        Returns:
+            键值到错误信息的映射
+        """
+        if len(items) == 1:
+            logger.error(f"主表记录写入失败 {items[0][0]}: {error}")
+            return {items[0][0]: str(error)}
+
+        results: Dict[str, Optional[str]] = {}
+        middle = len(items) // 2
+        for half in (items[:middle], items[middle:]):
+            try:
+                self._send(kind, half)
+                results.update({key: None for key, _ in half})
+            except Exception as e:
+                if is_batch_error(e):
+                    results.update(self._fail_all(kind, half, e))
+                else:
+                    results.update(self._bisect(kind, half, e))
+        return results
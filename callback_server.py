@@ -0,0 +1,533 @@
+"""审批事件回调模块 - 接收钉钉审批实例/任务变更事件，按审批实例去重后及时单条同步"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from logger import setup_logger
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # 可选依赖，使用回调时需安装 cryptography
+    Cipher = None
+
+logger = setup_logger(__name__)
+
+# 触发同步的事件：审批实例开始/结束/撤销，审批任务开始/结束/转交
+INSTANCE_EVENTS = frozenset({'bpms_instance_change', 'bpms_task_change'})
+# 钉钉注册回调地址时发送的校验事件
+CHECK_URL_EVENT = 'check_url'
+
+
+class DingTalkCallbackCrypto:
+    """
+    钉钉事件回调加解密
+
+    签名为 token、时间戳、随机串、密文排序拼接后的 SHA1；消息体为 AES-256-CBC 加密的
+    16字节随机串 + 4字节消息长度 + 消息 + 应用标识（AppKey 或 CorpId），密钥由 aes_key 补 "=" 后
+    Base64 解码得到，IV 为密钥前16字节，按32字节块 PKCS#7 填充。
+    """
+
+    BLOCK_SIZE = 32
+
+    def __init__(self, token: str, aes_key: str, owner_key: str):
+        """
+        初始化加解密
+
+        Args:
+            token: 回调签名 token
+            aes_key: 回调加密 aes_key（43位）
+            owner_key: 应用标识（企业内部应用为 AppKey，第三方应用为 SuiteKey）
+        """
+        if Cipher is None:
+            raise Exception("钉钉回调解密需要安装 cryptography: pip install cryptography")
+        self.token = token
+        self.key = base64.b64decode(aes_key + '=')
+        if len(self.key) != 32:
+            raise Exception("回调 aes_key 无效，应为43位字符")
+        self.owner_key = owner_key
+
+    def signature(self, timestamp: str, nonce: str, encrypt: str) -> str:
+        """计算签名"""
+        return hashlib.sha1(''.join(sorted([self.token, timestamp, nonce, encrypt])).encode('utf-8')).hexdigest()
+
+    def verify(self, signature: str, timestamp: str, nonce: str, encrypt: str) -> bool:
+        """
+        校验签名
+
+        Args:
+            signature: 请求中的签名
+            timestamp: 时间戳
+            nonce: 随机串
+            encrypt: 密文
+
+        Returns:
+            签名是否正确
+        """
+        return hmac.compare_digest(self.signature(timestamp, nonce, encrypt), signature or '')
+
+    def decrypt(self, encrypt: str) -> str:
+        """
+        解密消息
+
+        Args:
+            encrypt: Base64 密文
+
+        Returns:
+            消息明文
+        """
+        decryptor = Cipher(algorithms.AES(self.key), modes.CBC(self.key[:16])).decryptor()
+        plain = decryptor.update(base64.b64decode(encrypt)) + decryptor.finalize()
+        pad = plain[-1]
+        if not 1 <= pad <= self.BLOCK_SIZE:
+            raise Exception("回调消息填充无效")
+        content = plain[16:-pad]
+        length = struct.unpack('!I', content[:4])[0]
+        message = content[4:4 + length]
+        if content[4 + length:].decode('utf-8') != self.owner_key:
+            raise Exception("回调消息的应用标识不匹配")
+        return message.decode('utf-8')
+
+    def encrypt(self, message: str) -> str:
+        """
+        加密消息
+
+        Args:
+            message: 消息明文
+
+        Returns:
+            Base64 密文
+        """
+        body = message.encode('utf-8')
+        plain = os.urandom(16) + struct.pack('!I', len(body)) + body + self.owner_key.encode('utf-8')
+        pad = self.BLOCK_SIZE - len(plain) % self.BLOCK_SIZE
+        plain += bytes([pad]) * pad
+        encryptor = Cipher(algorithms.AES(self.key), modes.CBC(self.key[:16])).encryptor()
+        return base64.b64encode(encryptor.update(plain) + encryptor.finalize()).decode('ascii')
+
+    def encrypted_reply(self, message: str = 'success', timestamp: Optional[str] = None,
+                        nonce: Optional[str] = None) -> Dict[str, str]:
+        """
+        生成加密响应（回调处理成功时返回加密的 success）
+
+        Args:
+            message: 响应消息
+            timestamp: 时间戳（默认当前毫秒时间）
+            nonce: 随机串（默认随机生成）
+
+        Returns:
+            包含 msg_signature、timeStamp、nonce、encrypt 的字典
+        """
+        timestamp = timestamp or str(int(time.time() * 1000))
+        nonce = nonce or base64.b32encode(os.urandom(5)).decode('ascii').lower()
+        encrypt = self.encrypt(message)
+        return {
+            'msg_signature': self.signature(timestamp, nonce, encrypt),
+            'timeStamp': timestamp,
+            'nonce': nonce,
+            'encrypt': encrypt
+        }
+
+
+class InstanceWorkQueue:
+    """
+    审批实例去重工作队列
+
+    同一审批实例在等待期间（debounce 秒）的多次事件只同步一次；正在同步的实例再次收到事件时，
+    本次同步结束后重新排队，保证最终同步到最新状态。后台线程每次取出到期的一批实例调用 sync_func。
+    sync_func 抛出异常时整批、返回失败的审批实例ID时这些实例按指数退避重新排队，超过重试次数后
+    交给 on_give_up（如加入活跃实例集合）。
+    """
+
+    def __init__(self, sync_func: Callable[[List[str]], Any], debounce: float = 1.0, batch_size: int = 100,
+                 max_retries: int = 3, retry_delay: float = 5.0,
+                 on_give_up: Optional[Callable[[List[str]], Any]] = None):
+        """
+        初始化工作队列
+
+        Args:
+            sync_func: 同步一批审批实例的函数（审批实例ID列表），可返回同步失败的审批实例ID列表
+            debounce: 事件到达后等待的时间（秒），合并同一实例的连续事件
+            batch_size: 每次同步的最大实例数
+            max_retries: 同步失败后的最大重试次数
+            retry_delay: 首次重试的等待时间（秒），之后每次翻倍
+            on_give_up: 重试次数用尽后处理这些审批实例ID的函数（可选）
+        """
+        self.sync_func = sync_func
+        self.debounce = debounce
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max(0, max_retries)
+        self.retry_delay = retry_delay
+        self.on_give_up = on_give_up
+        self._cond = threading.Condition()
+        # 审批实例ID -> 到期时间，按加入顺序排列
+        self._pending: Dict[str, float] = {}
+        self._in_flight: Set[str] = set()
+        self._dirty: Set[str] = set()
+        # 审批实例ID -> 已失败次数
+        self._attempts: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {'received': 0, 'deduplicated': 0, 'synced': 0, 'retried': 0, 'failed': 0}
+
+    def add(self, instance_id: str) -> bool:
+        """
+        加入审批实例
+
+        Args:
+            instance_id: 审批实例ID
+
+        Returns:
+            是否新加入（已在队列中时返回False）
+        """
+        with self._cond:
+            self._stats['received'] += 1
+            if instance_id in self._pending or instance_id in self._dirty:
+                self._stats['deduplicated'] += 1
+                return False
+            if instance_id in self._in_flight:
+                # 同步开始后才发生的变更，结束后再同步一次
+                self._dirty.add(instance_id)
+                return True
+            self._pending[instance_id] = time.monotonic() + self.debounce
+            self._cond.notify_all()
+            return True
+
+    def start(self):
+        """启动后台同步线程"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name='callback-sync', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """同步完队列中剩余的实例后停止"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread:
+            thread.join()
+        self._thread = None
+
+    def pending_count(self) -> int:
+        """等待同步和正在同步的实例数"""
+        with self._cond:
+            return len(self._pending) + len(self._in_flight) + len(self._dirty)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取队列统计
+
+        Returns:
+            收到事件数、去重合并数、已同步实例数、重试实例数、放弃重试实例数、当前待同步数
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending) + len(self._in_flight) + len(self._dirty)
+        return stats
+
+    def _take_batch(self) -> List[str]:
+        """等待并取出一批到期的实例，关闭且队列为空时返回空列表"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due = [instance_id for instance_id, due_at in self._pending.items()
+                       if due_at <= now or self._closed][:self.batch_size]
+                if due:
+                    for instance_id in due:
+                        del self._pending[instance_id]
+                        self._in_flight.add(instance_id)
+                    return due
+                if self._closed and not self._pending:
+                    return []
+                timeout = min(self._pending.values()) - now if self._pending else None
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            try:
+                failed_ids = set(self.sync_func(batch) or [])
+            except Exception as e:
+                failed_ids = set(batch)
+                logger.error(f"回调同步审批实例失败（{len(batch)} 条）: {e}")
+            given_up = []
+            with self._cond:
+                now = time.monotonic()
+                for instance_id in batch:
+                    self._in_flight.discard(instance_id)
+                    dirty = instance_id in self._dirty
+                    self._dirty.discard(instance_id)
+                    if instance_id not in failed_ids:
+                        self._stats['synced'] += 1
+                        self._attempts.pop(instance_id, None)
+                        if dirty:
+                            self._pending[instance_id] = now + self.debounce
+                        continue
+                    attempts = self._attempts.get(instance_id, 0) + 1
+                    if attempts > self.max_retries:
+                        self._stats['failed'] += 1
+                        self._attempts.pop(instance_id, None)
+                        given_up.append(instance_id)
+                        continue
+                    self._stats['retried'] += 1
+                    self._attempts[instance_id] = attempts
+                    # 期间收到的新事件随重试一起同步
+                    self._pending[instance_id] = now + max(self.debounce,
+                                                           self.retry_delay * 2 ** (attempts - 1))
+                self._cond.notify_all()
+            if given_up:
+                logger.error(f"回调同步重试 {self.max_retries} 次仍失败，放弃 {len(given_up)} 条审批实例")
+                if self.on_give_up:
+                    try:
+                        self.on_give_up(given_up)
+                    except Exception as e:
+                        logger.error(f"处理放弃同步的审批实例失败: {e}")
+
+
+class CallbackServer:
+    """
+    钉钉事件回调 HTTP 服务
+
+    校验签名并解密事件，审批实例/任务变更事件中的审批实例ID加入工作队列后立即返回加密的 success，
+    同步在后台进行，不阻塞钉钉的推送请求。时间戳与本机时间相差超过 max_clock_skew 的请求视为重放拒绝，
+    请求体超过 max_body_size 时不读取，直接返回413。
+    """
+
+    def __init__(self, crypto: DingTalkCallbackCrypto, work_queue: InstanceWorkQueue,
+                 host: str = '0.0.0.0', port: int = 8080, path: str = '/dingtalk/callback',
+                 process_codes: Optional[Set[str]] = None, max_clock_skew: float = 300,
+                 max_body_size: int = 64 * 1024):
+        """
+        初始化回调服务
+
+        Args:
+            crypto: 回调加解密
+            work_queue: 审批实例工作队列
+            host: 监听地址
+            port: 监听端口（0表示随机端口）
+            path: 回调路径
+            process_codes: 只同步这些审批模板的事件（可选）
+            max_clock_skew: 请求时间戳与本机时间允许的最大偏差（秒）
+            max_body_size: 请求体最大字节数
+        """
+        self.crypto = crypto
+        self.max_clock_skew = max_clock_skew
+        self.max_body_size = max_body_size
+        self.work_queue = work_queue
+        self.path = path
+        self.process_codes = set(process_codes) if process_codes else None
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def handle(self, query: Dict[str, str], body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        处理一次回调请求
+
+        Args:
+            query: 查询参数（msg_signature/signature、timestamp、nonce）
+            body: 请求体（包含 encrypt）
+
+        Returns:
+            (HTTP状态码, 响应体)
+        """
+        encrypt = body.get('encrypt', '')
+        signature = query.get('msg_signature') or query.get('signature', '')
+        timestamp = query.get('timestamp', '')
+        nonce = query.get('nonce', '')
+        if not encrypt or not self.crypto.verify(signature, timestamp, nonce, encrypt):
+            logger.warning("钉钉回调签名校验失败")
+            return 403, {'error': 'invalid signature'}
+        if not self.is_fresh(timestamp):
+            logger.warning(f"钉钉回调时间戳超出允许范围: {timestamp}")
+            return 403, {'error': 'expired timestamp'}
+        try:
+            event = json.loads(self.crypto.decrypt(encrypt))
+        except Exception as e:
+            logger.warning(f"钉钉回调解密失败: {e}")
+            return 400, {'error': 'invalid message'}
+
+        self.dispatch(event)
+        return 200, self.crypto.encrypted_reply('success')
+
+    def is_fresh(self, timestamp: str) -> bool:
+        """
+        判断请求时间戳（毫秒）是否在允许的偏差内
+
+        Args:
+            timestamp: 请求中的时间戳
+
+        Returns:
+            时间戳有效且未过期时返回True
+        """
+        try:
+            sent_at = int(timestamp) / 1000
+        except (TypeError, ValueError):
+            return False
+        return abs(time.time() - sent_at) <= self.max_clock_skew
+
+    def dispatch(self, event: Dict[str, Any]) -> bool:
+        """
+        将审批事件中的审批实例加入工作队列
+
+        Args:
+            event: 解密后的事件
+
+        Returns:
+            是否加入了工作队列
+        """
+        event_type = event.get('EventType')
+        if event_type == CHECK_URL_EVENT or event_type not in INSTANCE_EVENTS:
+            return False
+        instance_id = event.get('processInstanceId')
+        if not instance_id:
+            return False
+        if self.process_codes and event.get('processCode') not in self.process_codes:
+            return False
+        logger.debug(f"收到审批事件 {event_type}: {instance_id} ({event.get('type')})")
+        return self.work_queue.add(instance_id)
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='callback-server', daemon=True)
+        self._thread.start()
+        logger.info(f"钉钉事件回调服务已启动: http://{self.httpd.server_address[0]}:{self.port}{self.path}")
+
+    def shutdown(self):
+        """停止接收回调"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path != server.path:
+                    self._reply(404, {'error': 'not found'})
+                    return
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0 or length > server.max_body_size:
+                    # 未读取的请求体留在连接中，回复后关闭连接
+                    self.close_connection = True
+                    self._reply(413 if length > 0 else 400, {'error': 'invalid body size'})
+                    return
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except (ValueError, json.JSONDecodeError):
+                    self._reply(400, {'error': 'invalid body'})
+                    return
+                self._reply(*server.handle(query, body if isinstance(body, dict) else {}))
+
+            def _reply(self, status: int, payload: Dict[str, Any]):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(f"回调请求 {self.address_string()} {format % args}")
+
+        return Handler
+
+
+def build_event_request(crypto: DingTalkCallbackCrypto, event: Dict[str, Any],
+                        timestamp: Optional[str] = None, nonce: Optional[str] = None) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    按钉钉推送格式生成加密事件请求（本地事件生成器，用于联调和测试）
+
+    Args:
+        crypto: 回调加解密
+        event: 事件内容
+        timestamp: 时间戳（可选）
+        nonce: 随机串（可选）
+
+    Returns:
+        (查询参数, 请求体)
+    """
+    reply = crypto.encrypted_reply(json.dumps(event, ensure_ascii=False), timestamp, nonce)
+    query = {'msg_signature': reply['msg_signature'], 'timestamp': reply['timeStamp'], 'nonce': reply['nonce']}
+    return query, {'encrypt': reply['encrypt']}
+
+
+def instance_event(instance_id: str, event_type: str = 'bpms_instance_change', change_type: str = 'finish',
+                   process_code: Optional[str] = None) -> Dict[str, Any]:
+    """
+    构造审批事件内容
+
+    Args:
+        instance_id: 审批实例ID
+        event_type: bpms_instance_change 或 bpms_task_change
+        change_type: 变更类型（start/finish/terminate 等）
+        process_code: 审批模板代码（可选）
+
+    Returns:
+        事件内容
+    """
+    event = {
+        'EventType': event_type,
+        'processInstanceId': instance_id,
+        'type': change_type,
+        'finishTime': int(time.time() * 1000)
+    }
+    if process_code:
+        event['processCode'] = process_code
+    return event
+
+
+def main():
+    """本地事件生成器：向回调服务发送加密的审批事件"""
+    import requests
+    import yaml
+
+    parser = argparse.ArgumentParser(description='向本地回调服务发送钉钉审批事件')
+    parser.add_argument('instance_ids', nargs='+', help='审批实例ID')
+    parser.add_argument('--config', '-c', default='config.yaml', help='配置文件路径')
+    parser.add_argument('--url', help='回调地址（默认按配置的端口和路径访问本机）')
+    parser.add_argument('--event', default='bpms_instance_change', choices=sorted(INSTANCE_EVENTS), help='事件类型')
+    parser.add_argument('--type', default='finish', help='变更类型')
+    parser.add_argument('--process-code', help='审批模板代码')
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    callback_config = config.get('callback', {})
+    crypto = DingTalkCallbackCrypto(callback_config['token'], callback_config['aes_key'],
+                                    callback_config.get('owner_key') or config['dingtalk']['app_key'])
+    url = args.url or f"http://127.0.0.1:{callback_config.get('port', 8080)}{callback_config.get('path', '/dingtalk/callback')}"
+    for instance_id in args.instance_ids:
+        query, body = build_event_request(crypto, instance_event(instance_id, args.event, args.type, args.process_code))
+        response = requests.post(url, params=query, json=body, timeout=10)
+        logger.info(f"发送事件 {instance_id}: HTTP {response.status_code} {response.text}")
+
+
+if __name__ == '__main__':
+    main()
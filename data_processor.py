@@ -1,4 +1,5 @@
 """数据处理模块 - 数据清洗和转换"""
+import hashlib
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from logger import setup_logger
@@ -18,6 +19,9 @@ class DataProcessor:
         "CANCELED": "已取消"
     }
     
+    # 终态审批状态（详情不再变化）
+    TERMINAL_STATUSES = frozenset({"FINISHED", "TERMINATED", "REVOKED", "CANCELED"})
+    
     # 审批动作映射
     ACTION_MAP = {
         "EXECUTE_TASK_NORMAL": "同意",
@@ -210,6 +214,50 @@ class DataProcessor:
         
         return action_records
     
+    @staticmethod
+    def task_fingerprint(instance_id: str, task: Dict) -> str:
+        """
+        计算审批任务的指纹（审批实例、节点、审批人、动作类型、创建时间）
+        
+        Args:
+            instance_id: 审批实例ID
+            task: 审批任务
+            
+        Returns:
+            16位十六进制指纹
+        """
+        parts = [
+            instance_id,
+            task.get('task_name', ''),
+            task.get('userid') or task.get('user_name', ''),
+            task.get('action_type', ''),
+            task.get('create_time', '')
+        ]
+        data = '\x1f'.join('' if part is None else str(part) for part in parts)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+    
+    @classmethod
+    def action_fingerprints(cls, instance_detail: Dict) -> List[str]:
+        """
+        计算审批动作明细的任务指纹，与 process_instance_actions 返回的记录一一对应
+        
+        Args:
+            instance_detail: 钉钉审批实例详情数据
+            
+        Returns:
+            指纹列表（同一实例内指纹重复的任务按出现次序加后缀区分）
+        """
+        instance_id = instance_detail.get('process_instance_id', '')
+        fingerprints = []
+        occurrences: Dict[str, int] = {}
+        for task in instance_detail.get('tasks', []):
+            fingerprint = cls.task_fingerprint(instance_id, task)
+            occurrences[fingerprint] = occurrences.get(fingerprint, 0) + 1
+            if occurrences[fingerprint] > 1:
+                fingerprint = f"{fingerprint}#{occurrences[fingerprint]}"
+            fingerprints.append(fingerprint)
+        return fingerprints
+    
     @staticmethod
     def normalize_field_value(value: Any, field_type: str = "text") -> Any:
         """
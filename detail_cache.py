@@ -0,0 +1,178 @@
+"""审批详情缓存模块 - 已结束的审批实例详情不再变化，缓存到本地磁盘"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+import json_codec
+from data_processor import DataProcessor
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class DetailCache:
+    """
+    磁盘详情缓存：按 process_instance_id 存储终态实例详情，按最近使用淘汰
+
+    缓存的是裁剪后的详情，缓存键包含当前的字段集标识（json_codec.detail_schema），
+    修改 project_detail_fields 或升级字段列表后旧条目不再命中，由淘汰机制清理。
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = 50000, max_bytes: int = 512 * 1024 * 1024):
+        """
+        初始化详情缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_entries: 最多缓存的实例数
+            max_bytes: 缓存占用的最大字节数
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # 文件名 -> 字节数，按最近使用排序
+        self._total_bytes = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """按修改时间重建索引（命中时会更新修改时间）"""
+        entries = []
+        for path in self.cache_dir.glob('*.json'):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def _file_name(instance_id: str) -> str:
+        # 实例ID可能包含不适合作为文件名的字符，取哈希
+        key = f"{json_codec.detail_schema()}\x1f{instance_id}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+
+    @staticmethod
+    def is_terminal(detail: Dict) -> bool:
+        """
+        判断详情是否为终态（内容不再变化）
+
+        Args:
+            detail: 审批实例详情
+
+        Returns:
+            是否为终态
+        """
+        return detail.get('status') in DataProcessor.TERMINAL_STATUSES
+
+    def get(self, instance_id: str) -> Optional[Dict]:
+        """
+        读取缓存的详情
+
+        Args:
+            instance_id: 审批实例ID
+
+        Returns:
+            详情数据，未命中时返回None
+        """
+        name = self._file_name(instance_id)
+        with self._lock:
+            if name not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(name)
+
+        path = self.cache_dir / name
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                detail = json.load(f)
+            os.utime(path)
+        except (IOError, OSError, json.JSONDecodeError) as e:
+            logger.warning(f"读取详情缓存失败 {instance_id}: {e}")
+            self._discard(name)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return detail
+
+    def put(self, instance_id: str, detail: Dict) -> bool:
+        """
+        缓存详情（仅缓存终态实例）
+
+        Args:
+            instance_id: 审批实例ID
+            detail: 审批实例详情
+
+        Returns:
+            是否已缓存
+        """
+        if not instance_id or not self.is_terminal(detail):
+            return False
+
+        name = self._file_name(instance_id)
+        path = self.cache_dir / name
+        tmp_path = self.cache_dir / f"{name}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(detail, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+        except (IOError, OSError) as e:
+            logger.warning(f"写入详情缓存失败 {instance_id}: {e}")
+            return False
+
+        with self._lock:
+            self._total_bytes += size - self._index.pop(name, 0)
+            self._index[name] = size
+            evicted = self._pop_evictions()
+
+        for old_name in evicted:
+            try:
+                os.remove(self.cache_dir / old_name)
+            except OSError:
+                pass
+        return True
+
+    def _pop_evictions(self):
+        """超出数量或容量上限时弹出最久未使用的条目（调用方持有锁）"""
+        evicted = []
+        while self._index and (len(self._index) > self.max_entries or self._total_bytes > self.max_bytes):
+            old_name, old_size = self._index.popitem(last=False)
+            self._total_bytes -= old_size
+            evicted.append(old_name)
+        return evicted
+
+    def _discard(self, name: str):
+        with self._lock:
+            self._total_bytes -= self._index.pop(name, 0)
+        try:
+            os.remove(self.cache_dir / name)
+        except OSError:
+            pass
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取缓存统计
+
+        Returns:
+            包含 hits/misses/entries/bytes 的字典
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._index),
+                'bytes': self._total_bytes
+            }
@@ -1,18 +1,93 @@
 """钉钉API客户端"""
+import queue
+import threading
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-from tenacity import retry, stop_after_attempt, wait_exponential
+from typing import List, Dict, Iterator, Optional
+from requests.adapters import HTTPAdapter
+import json_codec
 from logger import setup_logger
+from rate_limiter import RateLimiter
+from token_cache import TokenCache
+from detail_cache import DetailCache
+from lookup_cache import TTLCache
+from retry_policy import RetryPolicy, DingTalkAPIError, CircuitOpenError
 
 logger = setup_logger(__name__)
 
 
+class ConnectionStats:
+    """连接复用统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_open(self):
+        with self._lock:
+            self.opened += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        """
+        获取统计快照
+
+        Returns:
+            包含 requests/opened/reused 的字典
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'opened': self.opened,
+                'reused': max(self.requests - self.opened, 0)
+            }
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """带连接计数的连接池适配器"""
+
+    def __init__(self, *args, **kwargs):
+        self.connection_stats = ConnectionStats()
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.connection_stats
+        pool_classes = {}
+        for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items():
+            def _new_conn(pool, _base=pool_cls):
+                # urllib3 只在连接池中没有可复用连接时才新建连接
+                stats.record_open()
+                return _base._new_conn(pool)
+            pool_classes[scheme] = type(pool_cls.__name__, (pool_cls,), {'_new_conn': _new_conn})
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+    def send(self, request, *args, **kwargs):
+        self.connection_stats.record_request()
+        return super().send(request, *args, **kwargs)
+
+
 class DingTalkClient:
     """钉钉API客户端"""
     
-    def __init__(self, app_key: str, app_secret: str, base_url: str = "https://oapi.dingtalk.com"):
+    # 令牌剩余有效期低于该值（秒）时刷新
+    TOKEN_SAFETY_MARGIN = 300
+    
+    def __init__(self, app_key: str, app_secret: str, base_url: str = "https://oapi.dingtalk.com",
+                 pool_connections: int = 4, pool_maxsize: int = 16, pool_block: bool = False,
+                 keep_alive: bool = True, gzip: bool = True,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 token_cache: Optional[TokenCache] = None,
+                 detail_cache: Optional[DetailCache] = None,
+                 user_cache: Optional[TTLCache] = None,
+                 dept_cache: Optional[TTLCache] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
         """
         初始化钉钉客户端
         
@@ -20,25 +95,152 @@ class DingTalkClient:
             app_key: 应用Key
             app_secret: 应用Secret
             base_url: API基础地址
+            pool_connections: 连接池数量（按主机划分）
+            pool_maxsize: 每个主机的最大连接数
+            pool_block: 连接数达到上限时是否阻塞等待
+            keep_alive: 是否保持长连接
+            gzip: 是否协商gzip压缩
+            rate_limiter: 按接口限流器（可选）
+            token_cache: 令牌文件缓存（可选，跨运行和进程复用令牌）
+            detail_cache: 终态审批详情磁盘缓存（可选）
+            user_cache: 用户信息缓存（可选）
+            dept_cache: 部门信息缓存（可选）
+            retry_policy: 重试策略（可选，默认最多尝试3次、不熔断）
         """
         self.app_key = app_key
         self.app_secret = app_secret
         self.base_url = base_url.rstrip('/')
         self._access_token = None
         self._token_expires_at = None
+        self._token_lock = threading.Lock()
+        self._refresher_thread: Optional[threading.Thread] = None
+        self._refresher_stop = threading.Event()
+        self.token_cache = token_cache
+        self.detail_cache = detail_cache
+        self.user_cache = user_cache
+        self.dept_cache = dept_cache
+        self.session = self._build_session(pool_connections, pool_maxsize, pool_block, keep_alive, gzip)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+    
+    def _build_session(self, pool_connections: int, pool_maxsize: int, pool_block: bool,
+                       keep_alive: bool, gzip: bool) -> requests.Session:
+        """
+        创建复用连接的HTTP会话
+        
+        Returns:
+            requests会话
+        """
+        session = requests.Session()
+        self._adapter = PooledHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+        session.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+        return session
+    
+    def get_connection_stats(self) -> Dict[str, int]:
+        """
+        获取连接复用统计
+        
+        Returns:
+            包含 requests（请求数）、opened（新建连接数）、reused（复用连接数）的字典
+        """
+        return self._adapter.connection_stats.snapshot()
+    
+    def close(self):
+        """停止后台刷新并关闭HTTP会话，释放连接池"""
+        self.stop_token_refresher()
+        self.session.close()
+    
+    def _throttle(self, endpoint: str):
+        """
+        按接口限流，在发送请求前调用
+        
+        Args:
+            endpoint: 接口名（gettoken/list/detail/user）
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire(endpoint)
+    
+    def _token_remaining(self) -> float:
+        """当前内存中令牌的剩余有效秒数"""
+        if not self._access_token or not self._token_expires_at:
+            return 0.0
+        return self._token_expires_at - time.time()
     
     def get_access_token(self) -> str:
         """
-        获取访问令牌（带缓存和自动刷新）
+        获取访问令牌（带缓存和自动刷新，并发调用只触发一次刷新）
         
         Returns:
             访问令牌
         """
         # 如果token有效，直接返回
-        if self._access_token and self._token_expires_at:
-            if time.time() < self._token_expires_at - 300:  # 提前5分钟刷新
+        if self._token_remaining() > self.TOKEN_SAFETY_MARGIN:  # 提前5分钟刷新
+            return self._access_token
+        return self._refresh_access_token(self.TOKEN_SAFETY_MARGIN)
+    
+    def _refresh_access_token(self, min_remaining: float) -> str:
+        """
+        单飞刷新令牌：剩余有效期不足 min_remaining 秒时才请求新令牌
+        
+        依次检查内存、本地缓存文件（其他进程可能已刷新），
+        仍不满足时在跨进程锁内请求 /gettoken。
+        
+        Args:
+            min_remaining: 令牌至少需要的剩余有效秒数
+            
+        Returns:
+            访问令牌
+        """
+        with self._token_lock:
+            if self._token_remaining() > min_remaining:
                 return self._access_token
+            if self._adopt_cached_token(min_remaining):
+                return self._access_token
+            
+            if not self.token_cache:
+                return self._fetch_access_token()
+            
+            with self.token_cache.refresh_lock():
+                # 等待锁期间同机其他进程可能已完成刷新
+                if self._adopt_cached_token(min_remaining):
+                    return self._access_token
+                access_token = self._fetch_access_token()
+                self.token_cache.save(access_token, self._token_expires_at)
+                return access_token
+    
+    def _adopt_cached_token(self, min_remaining: float) -> bool:
+        """
+        从本地缓存文件加载令牌
+        
+        Args:
+            min_remaining: 令牌至少需要的剩余有效秒数
+            
+        Returns:
+            是否加载到满足要求的令牌
+        """
+        if not self.token_cache:
+            return False
+        cached = self.token_cache.load()
+        if not cached or cached[1] - time.time() <= min_remaining:
+            return False
+        self._access_token, self._token_expires_at = cached
+        logger.debug("使用本地缓存的钉钉访问令牌")
+        return True
+    
+    def _fetch_access_token(self) -> str:
+        """
+        请求新的访问令牌
         
+        Returns:
+            访问令牌
+        """
         url = f"{self.base_url}/gettoken"
         params = {
             "appkey": self.app_key,
@@ -46,16 +248,17 @@ class DingTalkClient:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=10)
+            self._throttle('gettoken')
+            response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
-            data = response.json()
+            data = json_codec.loads(response.content)
             
             if data.get('errcode') != 0:
-                raise Exception(f"获取token失败: {data.get('errmsg')}")
+                raise DingTalkAPIError("获取token", data.get('errcode'), data.get('errmsg', ''))
             
             self._access_token = data.get('access_token')
-            # 默认token有效期为7200秒，这里设置为7100秒过期
-            self._token_expires_at = time.time() + 7100
+            # 默认token有效期为7200秒，这里提前100秒视为过期
+            self._token_expires_at = time.time() + data.get('expires_in', 7200) - 100
             
             logger.info("成功获取钉钉访问令牌")
             return self._access_token
@@ -64,12 +267,97 @@ class DingTalkClient:
             logger.error(f"获取钉钉访问令牌失败: {e}")
             raise
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    def _invalidate_token(self, stale_token: str):
+        """
+        使过期token失效（仅当其仍是当前token时，避免并发请求重复刷新）
+        
+        Args:
+            stale_token: 请求时使用的token
+        """
+        with self._token_lock:
+            if self._access_token == stale_token:
+                self._access_token = None
+            if self.token_cache:
+                self.token_cache.invalidate(stale_token)
+    
+    def start_token_refresher(self, lead_seconds: float = 300, check_interval: float = 60):
+        """
+        启动后台令牌刷新线程，在5分钟安全边界之前提前续期，请求无需等待刷新
+        
+        Args:
+            lead_seconds: 在安全边界之前多少秒续期
+            check_interval: 检查间隔（秒）
+        """
+        if self._refresher_thread and self._refresher_thread.is_alive():
+            return
+        self._refresher_stop.clear()
+        threshold = self.TOKEN_SAFETY_MARGIN + lead_seconds
+        
+        def _loop():
+            while not self._refresher_stop.is_set():
+                try:
+                    self._refresh_access_token(threshold)
+                except Exception as e:
+                    logger.warning(f"后台刷新钉钉访问令牌失败: {e}")
+                wait = max(min(self._token_remaining() - threshold, check_interval), 1)
+                self._refresher_stop.wait(wait)
+        
+        self._refresher_thread = threading.Thread(target=_loop, name='dingtalk-token-refresher', daemon=True)
+        self._refresher_thread.start()
+        logger.info("已启动钉钉访问令牌后台刷新")
+    
+    def stop_token_refresher(self):
+        """停止后台令牌刷新线程"""
+        self._refresher_stop.set()
+        if self._refresher_thread:
+            self._refresher_thread.join(timeout=5)
+            self._refresher_thread = None
+    
+    def _request(self, method: str, path: str, endpoint: str, description: str,
+                 params: Optional[Dict] = None, body: Optional[Dict] = None,
+                 timeout: float = 30, decode=json_codec.loads) -> Dict:
+        """
+        发送带令牌的请求，按重试策略处理令牌过期、限流和临时错误
+        
+        令牌过期、限流和网络错误共用同一份重试预算，不会相互叠加。
+        
+        Args:
+            method: HTTP方法
+            path: 接口路径
+            endpoint: 接口名（用于限流）
+            description: 接口描述（用于日志）
+            params: 查询参数（不含access_token）
+            body: JSON请求体
+            timeout: 超时时间（秒）
+            decode: 响应体解码函数
+            
+        Returns:
+            errcode为0的响应数据
+        """
+        url = f"{self.base_url}{path}"
+        
+        def _attempt() -> Dict:
+            access_token = self.get_access_token()
+            query = dict(params or {}, access_token=access_token)
+            self._throttle(endpoint)
+            response = self.session.request(method, url, params=query, json=body, timeout=timeout)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise DingTalkAPIError(description, None, response.reason, access_token, response.status_code)
+            response.raise_for_status()
+            data = decode(response.content)
+            if data.get('errcode') != 0:
+                raise DingTalkAPIError(description, data.get('errcode'), data.get('errmsg', '未知错误'), access_token)
+            return data
+        
+        def _on_token_expired(error: DingTalkAPIError):
+            self._invalidate_token(error.access_token)
+        
+        return self.retry_policy.call(_attempt, description, _on_token_expired)
+    
     def get_process_instances(self, start_time: str, end_time: str,
                             process_code: Optional[str] = None,
                             statuses: Optional[List[str]] = None,
-                            cursor: int = 0, size: int = 20,
-                            _retry_count: int = 0) -> Dict:
+                            cursor: int = 0, size: int = 20) -> Dict:
         """
         获取审批实例列表
 
@@ -80,15 +368,10 @@ class DingTalkClient:
             statuses: 审批状态列表（RUNNING/FINISHED/TERMINATED/REVOKED）
             cursor: 分页游标
             size: 每页大小
-            _retry_count: 内部重试计数器（用户不应手动设置）
 
         Returns:
             审批实例列表数据
         """
-        url = f"{self.base_url}/topapi/processinstance/list"
-
-        access_token = self.get_access_token()
-
         body = {
             "start_time": start_time,
             "end_time": end_time,
@@ -102,77 +385,136 @@ class DingTalkClient:
         if statuses:
             body["statuses"] = statuses
 
-        params = {"access_token": access_token}
-
         try:
-            response = requests.post(url, json=body, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get('errcode') != 0:
-                error_msg = data.get('errmsg', '未知错误')
-                if data.get('errcode') == 40014:  # token过期，重新获取
-                    if _retry_count >= 3:
-                        raise Exception(f"Token刷新重试次数超限: {error_msg}")
-                    self._access_token = None
-                    logger.warning(f"Token过期，正在重试 (第{_retry_count + 1}次)")
-                    return self.get_process_instances(start_time, end_time, process_code, statuses, cursor, size, _retry_count + 1)
-                raise Exception(f"获取审批实例列表失败: {error_msg}")
-
-            result = data.get('result', {})
-            logger.debug(f"获取到 {len(result.get('list', []))} 条审批实例")
-            return result
-
+            data = self._request('POST', '/topapi/processinstance/list', 'list', "获取审批实例列表", body=body)
         except Exception as e:
             logger.error(f"获取审批实例列表失败: {e}")
             raise
+
+        result = data.get('result', {})
+        logger.debug(f"获取到 {len(result.get('list', []))} 条审批实例")
+        return result
+    
+    def iter_process_instances(self, start_time: str, end_time: str,
+                               process_code: Optional[str] = None,
+                               statuses: Optional[List[str]] = None,
+                               size: int = 20, prefetch: int = 1) -> Iterator[List[Dict]]:
+        """
+        按页遍历审批实例列表（后台线程预取后续页）
+        
+        列表请求在后台线程中沿 next_cursor 提前获取最多 prefetch 页，
+        与调用方处理当前页的耗时重叠；预取队列有界，内存占用受预取深度约束。
+        
+        Args:
+            start_time: 开始时间（毫秒时间戳）
+            end_time: 结束时间（毫秒时间戳）
+            process_code: 审批流程code（可选）
+            statuses: 审批状态列表（RUNNING/FINISHED/TERMINATED/REVOKED）
+            size: 每页大小
+            prefetch: 预取页数（0表示不预取，按需请求）
+            
+        Yields:
+            每页的审批实例列表
+        """
+        def _pages() -> Iterator[List[Dict]]:
+            cursor = 0
+            while True:
+                result = self.get_process_instances(
+                    start_time=start_time,
+                    end_time=end_time,
+                    process_code=process_code,
+                    statuses=statuses,
+                    cursor=cursor,
+                    size=size
+                )
+                instances = result.get('list', [])
+                if not instances:
+                    return
+                yield instances
+                
+                # 检查是否有下一页
+                if not result.get('has_more', False):
+                    return
+                cursor = result.get('next_cursor', 0)
+                if cursor == 0:
+                    return
+        
+        if prefetch <= 0:
+            yield from _pages()
+            return
+        
+        page_queue: queue.Queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        
+        def _put(item) -> bool:
+            # 队列已满时阻塞等待，调用方提前结束遍历时退出
+            while not stop.is_set():
+                try:
+                    page_queue.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def _producer():
+            try:
+                for page in _pages():
+                    if not _put(('page', page)):
+                        return
+            except Exception as e:
+                _put(('error', e))
+                return
+            _put(('done', None))
+        
+        worker = threading.Thread(target=_producer, name='dingtalk-list-prefetch', daemon=True)
+        worker.start()
+        try:
+            while True:
+                kind, payload = page_queue.get()
+                if kind == 'page':
+                    yield payload
+                elif kind == 'error':
+                    raise payload
+                else:
+                    return
+        finally:
+            stop.set()
+            worker.join(timeout=1)
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-    def get_process_instance_detail(self, process_instance_id: str, _retry_count: int = 0) -> Dict:
+    def get_process_instance_detail(self, process_instance_id: str) -> Dict:
         """
         获取审批实例详情
 
         Args:
             process_instance_id: 审批实例ID
-            _retry_count: 内部重试计数器（用户不应手动设置）
 
         Returns:
             审批实例详情数据
         """
-        url = f"{self.base_url}/topapi/processinstance/get"
-
-        access_token = self.get_access_token()
-
-        params = {
-            "access_token": access_token,
-            "process_instance_id": process_instance_id
-        }
+        # 终态实例详情不再变化，命中缓存时无需请求
+        if self.detail_cache:
+            cached = self.detail_cache.get(process_instance_id)
+            if cached is not None:
+                return cached
 
         try:
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get('errcode') != 0:
-                error_msg = data.get('errmsg', '未知错误')
-                if data.get('errcode') == 40014:  # token过期
-                    if _retry_count >= 3:
-                        raise Exception(f"Token刷新重试次数超限: {error_msg}")
-                    self._access_token = None
-                    logger.warning(f"Token过期，正在重试 (第{_retry_count + 1}次)")
-                    return self.get_process_instance_detail(process_instance_id, _retry_count + 1)
-                raise Exception(f"获取审批实例详情失败: {error_msg}")
-
-            result = data.get('process_instance', {})
-            return result
-
+            data = self._request(
+                'GET', '/topapi/processinstance/get', 'detail', "获取审批实例详情",
+                params={"process_instance_id": process_instance_id},
+                decode=json_codec.decode_detail_response
+            )
         except Exception as e:
             logger.error(f"获取审批实例详情失败: {e}")
             raise
+
+        result = data.get('process_instance', {})
+        if self.detail_cache:
+            self.detail_cache.put(process_instance_id, result)
+        return result
     
     def get_user_info(self, userid: str) -> Optional[Dict]:
         """
-        获取用户信息
+        获取用户信息（启用缓存时优先读缓存，失败结果也会短期缓存）
         
         Args:
             userid: 用户ID
@@ -180,27 +522,80 @@ class DingTalkClient:
         Returns:
             用户信息
         """
-        url = f"{self.base_url}/topapi/v2/user/get"
-        
-        access_token = self.get_access_token()
+        if self.user_cache:
+            hit, value = self.user_cache.lookup(userid)
+            if hit:
+                return value
         
-        params = {"access_token": access_token}
-        body = {"userid": userid}
+        result = self._post_lookup("/topapi/v2/user/get", 'user', {"userid": userid}, "获取用户信息")
+        if self.user_cache:
+            self.user_cache.set(userid, result)
+        return result
+    
+    def get_department_info(self, dept_id: int) -> Optional[Dict]:
+        """
+        获取部门信息（启用缓存时优先读缓存，失败结果也会短期缓存）
         
-        try:
-            response = requests.post(url, json=body, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+        Args:
+            dept_id: 部门ID
             
-            if data.get('errcode') != 0:
-                logger.warning(f"获取用户信息失败: {data.get('errmsg')}")
-                return None
+        Returns:
+            部门信息
+        """
+        key = str(dept_id)
+        if self.dept_cache:
+            hit, value = self.dept_cache.lookup(key)
+            if hit:
+                return value
+        
+        result = self._post_lookup("/topapi/v2/department/get", 'department', {"dept_id": dept_id}, "获取部门信息")
+        if self.dept_cache:
+            self.dept_cache.set(key, result)
+        return result
+    
+    def warm_user_cache(self, userids: List[str], max_workers: int = 8) -> int:
+        """
+        批量预热用户缓存（并发查询尚未缓存的用户）
+        
+        Args:
+            userids: 用户ID列表
+            max_workers: 并发查询数
             
-            return data.get('result', {})
+        Returns:
+            本次查询的用户数
+        """
+        if not self.user_cache:
+            return 0
+        missing = list({uid for uid in userids if uid and not self.user_cache.contains(uid)})
+        if not missing:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing)), thread_name_prefix='user-warmup') as executor:
+            list(executor.map(self.get_user_info, missing))
+        logger.debug(f"预热用户缓存 {len(missing)} 个")
+        return len(missing)
+    
+    def _post_lookup(self, path: str, endpoint: str, body: Dict, description: str) -> Optional[Dict]:
+        """
+        调用查询类接口，失败时返回None
+        
+        Args:
+            path: 接口路径
+            endpoint: 接口名（用于限流）
+            body: 请求体
+            description: 接口描述（用于日志）
             
+        Returns:
+            查询结果
+        """
+        try:
+            data = self._request('POST', path, endpoint, description, body=body, timeout=10)
+        except CircuitOpenError:
+            raise
         except Exception as e:
-            logger.warning(f"获取用户信息失败: {e}")
+            logger.warning(f"{description}失败: {e}")
             return None
+        
+        return data.get('result', {})
     
     @staticmethod
     def datetime_to_timestamp(dt: datetime) -> int:
@@ -0,0 +1,407 @@
+"""飞书写入模块 - 写后缓冲：拉取线程只负责提交转换好的数据，由后台线程批量写入飞书"""
+import json
+import os
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def _merge_items(previous: Tuple, item: Tuple) -> Tuple:
+    """
+    合并同一审批实例的两份待写入数据
+
+    新数据带主表数据时以新数据为准（其明细记录是审批实例的全部任务）；只有明细记录时
+    保留旧数据的主表数据，追加旧数据中没有的明细记录。
+
+    Args:
+        previous: 旧的待写入数据
+        item: 新的待写入数据
+
+    Returns:
+        合并后的待写入数据
+    """
+    if item[1] is not None:
+        return item
+    if previous[1] is not None:
+        # 完整数据已包含该审批实例的全部明细记录
+        return previous
+    records, fingerprints = list(previous[2]), list(previous[3])
+    for record, fingerprint in zip(item[2], item[3]):
+        if fingerprint is not None and fingerprint in fingerprints:
+            continue
+        records.append(record)
+        fingerprints.append(fingerprint)
+    return item[0], None, records, fingerprints
+
+
+class WriteBehindWriter:
+    """
+    写后缓冲写入器
+
+    审批实例转换后的数据（主表数据、明细记录、任务指纹）提交到缓冲区后立即返回，
+    后台线程在攒满一批或超过刷新间隔时调用 write_func 批量写入主表；主表写入成功的
+    明细记录进入明细表的批量缓冲，由 flush_func 按同样的刷新间隔写出。同一审批实例在
+    缓冲区中多次提交时只保留最后一次，正在写入的实例不会被另一个线程同时写入；
+    缓冲区满时提交方阻塞等待（反压）。
+
+    写入失败或关闭时仍未写出的数据保存到日志文件，下次运行通过 replay 重新提交；主表已写入、
+    明细记录写入失败的审批实例通过 journal_actions 记入日志（主表数据为None，重放时只重写明细记录）。
+    每次写入的结果记在单独的计数字典中，提交方调用 drain 时再合并到自己的统计字典，
+    避免跨线程修改统计。
+    """
+
+    def __init__(self, write_func: Callable[[List[Tuple], Dict[str, int]], List[str]],
+                 flush_func: Optional[Callable[[], None]] = None,
+                 batch_size: int = 500, flush_interval: float = 1.0, max_pending: int = 2000,
+                 workers: int = 4, journal_file: Optional[str] = None):
+        """
+        初始化写入器
+
+        Args:
+            write_func: 批量写入函数（待写入数据列表, 计数字典），返回写入失败的审批实例ID列表
+            flush_func: 写出下游缓冲的函数（明细表批量缓冲）
+            batch_size: 每批写入的审批实例数
+            flush_interval: 缓冲区未攒满时的最长等待时间（秒）
+            max_pending: 缓冲区容量，超过时提交方阻塞
+            workers: 写入线程数
+            journal_file: 未写出数据的日志文件路径（可选）
+        """
+        self.write_func = write_func
+        self.flush_func = flush_func
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max(self.batch_size, max_pending)
+        self.workers = max(1, workers)
+        self.journal_file = journal_file
+
+        self._cond = threading.Condition()
+        # 审批实例ID -> (待写入数据, 统计字典)，按提交顺序排列
+        self._buffer: Dict[str, Tuple[Tuple, Optional[Dict[str, int]]]] = {}
+        self._in_flight: set = set()
+        # id(统计字典) -> 缓冲中和正在写入的审批实例数
+        self._pending: Dict[int, int] = {}
+        # id(统计字典) -> (统计字典, 计数字典列表)，drain 时合并
+        self._results: Dict[int, Tuple[Dict[str, int], List[Counter]]] = {}
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+        self._draining = 0
+        # 下游缓冲按顺序写出：请求的、已开始的、已完成的写出序号
+        self._flush_wanted = 0
+        self._flush_started = 0
+        self._flush_completed = 0
+        self._flushing = False
+        self._flushed_at = time.monotonic()
+        self._journal: Dict[str, Tuple] = self._load_journal()
+        self._journal_dirty = False
+        self._stats = {'batches': 0, 'busy_seconds': 0.0, 'peak_pending': 0}
+
+    def submit(self, item: Tuple, stats: Optional[Dict[str, int]] = None):
+        """
+        提交一个审批实例的待写入数据，缓冲区满时阻塞
+
+        Args:
+            item: (审批实例ID, 主表数据, 明细表数据列表, 任务指纹列表)，主表数据为None时只写明细记录
+            stats: 写入结果计入的统计字典（drain 时合并）
+        """
+        instance_id = item[0]
+        with self._cond:
+            if self._closed:
+                raise Exception("飞书写入器已关闭")
+            self._ensure_threads()
+            while len(self._buffer) >= self.max_pending and instance_id not in self._buffer:
+                self._cond.wait()
+            previous = self._buffer.pop(instance_id, None)
+            if previous is not None:
+                item = _merge_items(previous[0], item)
+                # 被合并的旧数据由新数据一并写入
+                previous_stats = previous[1]
+                self._add_pending(previous_stats, -1)
+                if previous_stats is not None:
+                    self._results_of(previous_stats).append(Counter(coalesced=1, success=1))
+            self._buffer[instance_id] = (item, stats)
+            self._add_pending(stats, 1)
+            self._stats['peak_pending'] = max(self._stats['peak_pending'], len(self._buffer))
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+
+    def drain(self, stats: Optional[Dict[str, int]] = None):
+        """
+        等待数据写出（含明细表缓冲），再将写入结果合并到统计字典
+
+        Args:
+            stats: 只等待计入该统计字典的数据并合并结果；为None时等待全部数据
+        """
+        with self._cond:
+            self._draining += 1
+            self._cond.notify_all()
+            try:
+                if stats is None:
+                    while self._buffer or self._in_flight:
+                        self._cond.wait()
+                else:
+                    while self._pending.get(id(stats)):
+                        self._cond.wait()
+                # 主表写完后再写出一次下游缓冲，使明细记录的结果也计入统计
+                wanted = self._flush_started + 1
+                self._flush_wanted = max(self._flush_wanted, wanted)
+                self._cond.notify_all()
+                while self._flush_completed < wanted:
+                    if not any(thread.is_alive() for thread in self._threads):
+                        self._run_flush()
+                        continue
+                    self._cond.wait()
+            finally:
+                self._draining -= 1
+            if stats is None:
+                return
+            _, counters = self._results.pop(id(stats), (stats, []))
+        for counts in counters:
+            for key, value in counts.items():
+                stats[key] = stats.get(key, 0) + value
+
+    def replay(self, stats: Optional[Dict[str, int]] = None) -> int:
+        """
+        重新提交日志中上次未写出的数据
+
+        Args:
+            stats: 写入结果计入的统计字典
+
+        Returns:
+            重新提交的审批实例数
+        """
+        with self._cond:
+            items = list(self._journal.values())
+        for item in items:
+            self.submit(item, stats)
+        if items:
+            logger.info(f"重新提交上次未写出的审批实例 {len(items)} 条")
+        return len(items)
+
+    def journal_actions(self, instance_id: str, records: List[Dict], fingerprints: List[Optional[str]]):
+        """
+        记录写入失败的明细记录（主表已写入），下次 replay 时重写
+
+        Args:
+            instance_id: 审批实例ID
+            records: 明细记录字段列表
+            fingerprints: 与 records 对应的任务指纹（未启用任务写入状态时为None）
+        """
+        with self._cond:
+            entry = self._journal.get(instance_id, (instance_id, None, [], []))
+            self._journal[instance_id] = _merge_items(entry, (instance_id, None, records, fingerprints))
+            self._journal_dirty = True
+
+    def pending_count(self) -> int:
+        """缓冲区中待写入的审批实例数（含正在写入的）"""
+        with self._cond:
+            return len(self._buffer) + len(self._in_flight)
+
+    def journal_size(self) -> int:
+        """日志中未写出的审批实例数"""
+        with self._cond:
+            return len(self._journal)
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        获取写入统计
+
+        Returns:
+            写入线程数、写入批次数、写入累计耗时（秒）、当前和峰值缓冲数、缓冲区容量
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._buffer) + len(self._in_flight)
+        stats['workers'] = self.workers
+        stats['max_pending'] = self.max_pending
+        stats['busy_seconds'] = round(stats['busy_seconds'], 2)
+        return stats
+
+    def close(self):
+        """写出剩余数据后停止后台线程，并保存日志"""
+        self.drain()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+        self.save_journal()
+
+    def save_journal(self):
+        """日志有变化时保存（没有未写出的数据时删除日志文件）"""
+        if not self.journal_file:
+            return
+        with self._cond:
+            if not self._journal_dirty:
+                return
+            entries = [list(item) for item in self._journal.values()]
+            self._journal_dirty = False
+
+        try:
+            if not entries:
+                if os.path.exists(self.journal_file):
+                    os.remove(self.journal_file)
+                return
+            Path(self.journal_file).parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = f"{self.journal_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_file, self.journal_file)
+        except IOError as e:
+            logger.warning(f"保存写入日志失败: {e}")
+
+    def _load_journal(self) -> Dict[str, Tuple]:
+        """加载上次未写出的数据"""
+        if not self.journal_file or not os.path.exists(self.journal_file):
+            return {}
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f"加载写入日志失败: {e}")
+            return {}
+        return {entry[0]: tuple(entry) for entry in entries}
+
+    def _ensure_threads(self):
+        """启动后台写入线程（调用方持有锁）"""
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f'feishu-writer-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _add_pending(self, stats: Optional[Dict[str, int]], delta: int):
+        """调整统计字典对应的待写入数（调用方持有锁）"""
+        key = id(stats)
+        count = self._pending.get(key, 0) + delta
+        if count > 0:
+            self._pending[key] = count
+        else:
+            self._pending.pop(key, None)
+
+    def _results_of(self, stats: Dict[str, int]) -> List[Counter]:
+        """统计字典对应的计数字典列表（调用方持有锁）"""
+        return self._results.setdefault(id(stats), (stats, []))[1]
+
+    def _take_batch(self, force: bool) -> List[Tuple[str, Tuple, Optional[Dict[str, int]]]]:
+        """
+        取出下一批可写入的数据（跳过正在写入的审批实例，调用方持有锁）
+
+        Args:
+            force: 未攒满一批时是否也取出
+
+        Returns:
+            (审批实例ID, 待写入数据, 统计字典) 列表，没有可写入的数据时为空
+        """
+        ready = [instance_id for instance_id in self._buffer if instance_id not in self._in_flight]
+        if not ready or (len(ready) < self.batch_size and not force):
+            return []
+        batch = []
+        for instance_id in ready[:self.batch_size]:
+            item, stats = self._buffer.pop(instance_id)
+            self._in_flight.add(instance_id)
+            batch.append((instance_id, item, stats))
+        # 缓冲区有空位，唤醒被反压阻塞的提交方
+        self._cond.notify_all()
+        return batch
+
+    def _next_task(self) -> Tuple[str, List[Tuple[str, Tuple, Optional[Dict[str, int]]]]]:
+        """
+        等待下一项工作
+
+        Returns:
+            ('write', 一批数据)、('flush', []) 或 ('stop', [])
+        """
+        with self._cond:
+            while True:
+                expired = time.monotonic() - self._flushed_at >= self.flush_interval
+                batch = self._take_batch(force=bool(self._draining) or self._closed or expired)
+                if batch:
+                    return 'write', batch
+                if not self._flushing and (self._flush_wanted > self._flush_started or expired):
+                    return 'flush', []
+                if self._closed and not self._buffer and not self._in_flight:
+                    return 'stop', []
+                self._cond.wait(max(0.0, self._flushed_at + self.flush_interval - time.monotonic()) or None)
+
+    def _run(self):
+        """后台写入线程"""
+        while True:
+            task, batch = self._next_task()
+            if task == 'stop':
+                return
+            if task == 'flush':
+                self._run_flush()
+                continue
+            started = time.monotonic()
+            try:
+                self._write(batch)
+            finally:
+                with self._cond:
+                    self._stats['batches'] += 1
+                    self._stats['busy_seconds'] += time.monotonic() - started
+                    for instance_id, _, stats in batch:
+                        self._in_flight.discard(instance_id)
+                        self._add_pending(stats, -1)
+                    self._cond.notify_all()
+
+    def _run_flush(self):
+        """写出下游缓冲并保存日志（同一时间只有一个线程写出，序号按顺序完成）"""
+        with self._cond:
+            if self._flushing:
+                return
+            self._flushing = True
+            self._flush_started += 1
+            sequence = self._flush_started
+            self._flushed_at = time.monotonic()
+        try:
+            if self.flush_func:
+                self.flush_func()
+        except Exception as e:
+            logger.error(f"写出明细记录缓冲失败: {e}")
+        finally:
+            self.save_journal()
+            with self._cond:
+                self._flushing = False
+                self._flush_completed = sequence
+                self._cond.notify_all()
+
+    def _write(self, batch: List[Tuple[str, Tuple, Optional[Dict[str, int]]]]):
+        """
+        写入一批数据：计入同一统计字典的数据一起写入，失败的数据记入日志
+
+        Args:
+            batch: (审批实例ID, 待写入数据, 统计字典) 列表
+        """
+        groups: Dict[int, Tuple[Optional[Dict[str, int]], List[Tuple]]] = {}
+        for _, item, stats in batch:
+            groups.setdefault(id(stats), (stats, []))[1].append(item)
+
+        for stats, items in groups.values():
+            counts = Counter()
+            with self._cond:
+                if stats is not None:
+                    self._results_of(stats).append(counts)
+                # 写入期间明细记录失败会新增日志条目，写入成功时只移除写入前的条目
+                journaled = {item[0]: self._journal.get(item[0]) for item in items}
+            try:
+                failed = set(self.write_func(items, counts) or [])
+            except Exception as e:
+                logger.error(f"批量写入飞书失败（{len(items)} 条），已记入写入日志: {e}")
+                counts['failed'] += len(items)
+                failed = {item[0] for item in items}
+
+            with self._cond:
+                for item in items:
+                    if item[0] in failed:
+                        self._journal[item[0]] = item
+                        self._journal_dirty = True
+                    elif journaled[item[0]] is not None and self._journal.get(item[0]) is journaled[item[0]]:
+                        del self._journal[item[0]]
+                        self._journal_dirty = True
@@ -0,0 +1,170 @@
+"""JSON解码模块 - 可插拔的解码后端，审批详情只解码数据转换需要的字段"""
+import hashlib
+import json
+from typing import Any, Dict, Optional, Union
+
+from logger import setup_logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+logger = setup_logger(__name__)
+
+# 审批详情中数据转换（DataProcessor）、用户补全和缓存判断会读取的字段
+DETAIL_FIELDS = (
+    'process_instance_id', 'title', 'status', 'result', 'business_id', 'process_code',
+    'originator_userid', 'originator_user_name', 'originator_dept_id', 'originator_dept_name',
+    'create_time', 'finish_time', 'current_approvers',
+)
+TASK_FIELDS = (
+    'task_id', 'task_name', 'userid', 'user_name', 'status', 'action_type',
+    'create_time', 'finish_time', 'comment', 'task_comment',
+)
+FORM_FIELDS = ('name', 'component_name', 'value')
+
+BACKENDS = ('msgspec', 'orjson', 'json')
+
+_backend = 'json'
+_project_detail = True
+_detail_decoder = None
+
+
+def _build_detail_decoder():
+    """构建 msgspec 类型化解码器：未声明的字段直接跳过，不创建Python对象"""
+    def _struct(name, fields, extra=()):
+        return msgspec.defstruct(
+            name,
+            [(field, Any, msgspec.UNSET) for field in fields] + list(extra),
+            omit_defaults=True
+        )
+
+    task = _struct('Task', TASK_FIELDS)
+    form_value = _struct('FormValue', FORM_FIELDS)
+    detail = _struct('Detail', DETAIL_FIELDS, [
+        ('tasks', list[task], msgspec.UNSET),
+        ('form_component_values', list[form_value], msgspec.UNSET),
+    ])
+    response = msgspec.defstruct('DetailResponse', [
+        ('errcode', Any, msgspec.UNSET),
+        ('errmsg', Any, msgspec.UNSET),
+        ('process_instance', detail, msgspec.UNSET),
+    ], omit_defaults=True)
+    return msgspec.json.Decoder(response)
+
+
+def configure(backend: str = 'auto', project_detail: bool = True):
+    """
+    选择解码后端
+
+    Args:
+        backend: auto/msgspec/orjson/json，auto 时按 msgspec > orjson > json 选择已安装的库
+        project_detail: 审批详情是否只保留转换需要的字段
+    """
+    global _backend, _project_detail, _detail_decoder
+
+    available = {'orjson': orjson is not None, 'msgspec': msgspec is not None, 'json': True}
+    if backend == 'auto':
+        backend = next(name for name in BACKENDS if available[name])
+    elif backend not in available:
+        raise ValueError(f"不支持的JSON后端: {backend}")
+    elif not available[backend]:
+        logger.warning(f"JSON后端 {backend} 未安装，使用标准库 json")
+        backend = 'json'
+
+    _backend = backend
+    _project_detail = project_detail
+    _detail_decoder = _build_detail_decoder() if backend == 'msgspec' and project_detail else None
+    logger.debug(f"JSON后端: {_backend}, 详情字段裁剪: {_project_detail}")
+
+
+def get_backend() -> str:
+    """当前使用的解码后端"""
+    return _backend
+
+
+def detail_schema() -> str:
+    """
+    当前审批详情的字段集标识（详情缓存键的一部分，裁剪设置或字段列表变化后不再命中旧的缓存）
+
+    Returns:
+        不裁剪时为 full，否则为字段列表的哈希
+    """
+    if not _project_detail:
+        return 'full'
+    fields = '\x1f'.join(','.join(group) for group in (DETAIL_FIELDS, TASK_FIELDS, FORM_FIELDS))
+    return hashlib.sha1(fields.encode('utf-8')).hexdigest()[:8]
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    解码JSON
+
+    Args:
+        data: JSON字节串或字符串
+
+    Returns:
+        解码结果
+    """
+    if _backend == 'orjson':
+        return orjson.loads(data)
+    if _backend == 'msgspec':
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def _project(obj: Optional[Dict], fields) -> Dict:
+    return {key: obj[key] for key in fields if key in obj} if isinstance(obj, dict) else {}
+
+
+def project_detail(detail: Dict) -> Dict:
+    """
+    裁剪审批详情，只保留转换需要的字段
+
+    Args:
+        detail: 完整的审批详情
+
+    Returns:
+        裁剪后的审批详情
+    """
+    result = _project(detail, DETAIL_FIELDS)
+    if isinstance(detail.get('tasks'), list):
+        result['tasks'] = [_project(task, TASK_FIELDS) for task in detail['tasks']]
+    if isinstance(detail.get('form_component_values'), list):
+        result['form_component_values'] = [_project(item, FORM_FIELDS) for item in detail['form_component_values']]
+    return result
+
+
+def decode_detail_response(data: Union[bytes, str]) -> Dict:
+    """
+    解码审批详情接口的响应
+
+    使用 msgspec 后端时直接解码为只含所需字段的结构体再转为字典，
+    其他后端先完整解码再裁剪字段。
+
+    Args:
+        data: 响应体
+
+    Returns:
+        包含 errcode/errmsg/process_instance 的字典
+    """
+    if _detail_decoder is not None:
+        try:
+            return msgspec.to_builtins(_detail_decoder.decode(data))
+        except msgspec.ValidationError:
+            # 字段结构与预期不符（如 tasks 不是列表）时退回完整解码
+            pass
+
+    payload = loads(data)
+    if _project_detail and isinstance(payload.get('process_instance'), dict):
+        payload['process_instance'] = project_detail(payload['process_instance'])
+    return payload
+
+
+configure()
@@ -0,0 +1,137 @@
+"""查询缓存模块 - 带过期时间的LRU缓存，用于用户和部门信息"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class TTLCache:
+    """
+    内存LRU缓存，条目按TTL过期，可选持久化到磁盘
+
+    值为None表示上次查询失败（负缓存），使用较短的TTL。
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600, negative_ttl: float = 300,
+                 persist_file: Optional[str] = None):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最多缓存的条目数
+            ttl: 正常条目的有效期（秒）
+            negative_ttl: 查询失败（None）条目的有效期（秒）
+            persist_file: 持久化文件路径（可选）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.persist_file = persist_file
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()  # key -> (过期时间, 值)
+        if persist_file:
+            self.load()
+
+    def lookup(self, key: str) -> Tuple[bool, Any]:
+        """
+        查询缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            (是否命中, 值)，命中负缓存时值为None
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def contains(self, key: str) -> bool:
+        """判断键是否有未过期的条目（不计入命中统计）"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > time.time()
+
+    def set(self, key: str, value: Any):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            value: 值（None表示查询失败，按负缓存TTL过期）
+        """
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取缓存统计
+
+        Returns:
+            包含 hits/misses/entries 的字典
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._data)}
+
+    def reset_stats(self):
+        """重置命中统计（每次运行开始时调用）"""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def load(self):
+        """从持久化文件加载未过期的条目"""
+        if not self.persist_file or not os.path.exists(self.persist_file):
+            return
+        try:
+            with open(self.persist_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f"加载查询缓存失败: {e}")
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, expires_at, value in entries:
+                if expires_at > now:
+                    self._data[key] = (expires_at, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def save(self):
+        """将未过期的条目写入持久化文件"""
+        if not self.persist_file:
+            return
+        now = time.time()
+        with self._lock:
+            entries = [[key, expires_at, value] for key, (expires_at, value) in self._data.items()
+                       if expires_at > now]
+
+        Path(self.persist_file).parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = f"{self.persist_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_file, self.persist_file)
+        except IOError as e:
+            logger.warning(f"保存查询缓存失败: {e}")
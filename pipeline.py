@@ -0,0 +1,374 @@
+"""流水线模块 - 拉取、转换、写入分为独立阶段，阶段间用有界队列连接并逐级反压"""
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 停止信号
+_STOP = object()
+
+
+class PipelineGroup:
+    """
+    一组一起提交、一起等待完成的数据（如一个时间窗口）
+
+    数据离开流水线（最后一个阶段处理完、被某个阶段丢弃或处理失败）时计为完成；
+    处理失败的条数记入 failed。counts 供最后一个阶段记录写入结果（只由该阶段更新）。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = 0
+        self.failed = 0
+        self.counts: Counter = Counter()
+
+    def _add(self):
+        with self._cond:
+            self._pending += 1
+
+    def _done(self, failed: bool = False):
+        with self._cond:
+            self._pending -= 1
+            if failed:
+                self.failed += 1
+            if self._pending <= 0:
+                self._cond.notify_all()
+
+    def wait(self):
+        """等待组内数据全部离开流水线"""
+        with self._cond:
+            while self._pending > 0:
+                self._cond.wait()
+
+
+class PipelineStage:
+    """
+    流水线阶段
+
+    多个工作线程从有界输入队列取数据调用 func，结果放入下一阶段的队列（队列满时阻塞）。
+    batch_size 大于1时每次取出队列中已有的最多 batch_size 条，func 接收列表并返回列表。
+    """
+
+    def __init__(self, name: str, func: Callable, workers: int = 1, queue_size: int = 0,
+                 batch_size: int = 1, on_error: Optional[Callable[[Any, Exception], None]] = None):
+        """
+        初始化阶段
+
+        Args:
+            name: 阶段名称
+            func: 处理函数，返回None表示丢弃（批量时返回要传给下一阶段的列表）
+            workers: 工作线程数
+            queue_size: 输入队列容量（默认为工作线程数的4倍）
+            batch_size: 每次处理的最大条数
+            on_error: 处理失败时的回调（数据, 异常）
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.on_error = on_error
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size or self.workers * 4)
+        self.next_stage: Optional['PipelineStage'] = None
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stats = {'processed': 0, 'failed': 0, 'busy_seconds': 0.0, 'max_depth': 0}
+
+    def put(self, envelope):
+        """放入输入队列（队列满时阻塞）"""
+        self.queue.put(envelope)
+        depth = self.queue.qsize()
+        with self._lock:
+            if depth > self._stats['max_depth']:
+                self._stats['max_depth'] = depth
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """处理完队列中的数据后停止工作线程"""
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _take(self):
+        """
+        取出下一批数据
+
+        Returns:
+            (数据列表, 是否收到停止信号)
+        """
+        envelope = self.queue.get()
+        if envelope is _STOP:
+            return [], True
+        batch = [envelope]
+        while len(batch) < self.batch_size:
+            try:
+                envelope = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if envelope is _STOP:
+                return batch, True
+            batch.append(envelope)
+        return batch, False
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._take()
+            if batch:
+                self._process(batch)
+
+    def _process(self, batch: List):
+        """处理一批数据并传给下一阶段"""
+        started = time.monotonic()
+        payloads = [payload for _, payload in batch]
+        try:
+            if self.batch_size > 1:
+                results = list(self.func(payloads) or [])
+            else:
+                results = [self.func(payloads[0])]
+        except Exception as e:
+            self._record(started, len(batch), failed=len(batch))
+            for group, payload in batch:
+                self._fail(group, payload, e)
+            return
+        self._record(started, len(batch))
+
+        if self.next_stage is None:
+            results = []
+        # 批量阶段返回的结果与输入一一对应，缺少的视为丢弃
+        results += [None] * (len(batch) - len(results))
+        for (group, _), result in zip(batch, results):
+            if result is not None:
+                self.next_stage.put((group, result))
+            elif group is not None:
+                group._done()
+
+    def _fail(self, group: Optional[PipelineGroup], payload, error: Exception):
+        if self.on_error:
+            try:
+                self.on_error(payload, error)
+            except Exception as e:
+                logger.error(f"流水线阶段 {self.name} 错误处理失败: {e}")
+        else:
+            logger.error(f"流水线阶段 {self.name} 处理失败: {error}")
+        if group is not None:
+            group._done(failed=True)
+
+    def _record(self, started: float, count: int, failed: int = 0):
+        with self._lock:
+            self._stats['processed'] += count - failed
+            self._stats['failed'] += failed
+            self._stats['busy_seconds'] += time.monotonic() - started
+
+    def get_stats(self, elapsed: float) -> Dict[str, Any]:
+        """
+        获取阶段统计
+
+        Args:
+            elapsed: 流水线运行时长（秒），用于计算利用率
+
+        Returns:
+            工作线程数、处理/失败条数、忙碌时间、利用率、当前和峰值队列深度
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats['queue_depth'] = self.queue.qsize()
+        stats['queue_size'] = self.queue.maxsize
+        stats['busy_seconds'] = round(stats['busy_seconds'], 2)
+        stats['utilization'] = round(stats['busy_seconds'] / (elapsed * self.workers), 2) if elapsed > 0 else 0.0
+        return stats
+
+
+class AsyncPipelineStage(PipelineStage):
+    """
+    协程流水线阶段
+
+    一个线程运行事件循环，最多 workers 个协程同时处理数据（如数百个并发的详情请求共用一个线程）。
+    从输入队列取数据和向下一阶段的有界队列放数据都在单独的线程中等待，不阻塞事件循环，
+    达到并发上限时不再取数据，反压照常传到上游。
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Awaitable[Any]], workers: int = 100,
+                 queue_size: int = 0, on_error: Optional[Callable[[Any, Exception], None]] = None,
+                 on_stop: Optional[Callable[[], Awaitable[None]]] = None):
+        """
+        初始化阶段
+
+        Args:
+            name: 阶段名称
+            func: 处理数据的协程函数，返回None表示丢弃
+            workers: 同时处理的最大协程数
+            queue_size: 输入队列容量（默认为并发数的4倍）
+            on_error: 处理失败时的回调（数据, 异常）
+            on_stop: 事件循环结束前调用的协程函数（如关闭异步HTTP会话）
+        """
+        super().__init__(name, func, workers, queue_size, 1, on_error)
+        self.on_stop = on_stop
+
+    def start(self):
+        thread = threading.Thread(target=lambda: asyncio.run(self._serve()), name=f'{self.name}-loop', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.workers)
+        tasks = set()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{self.name}-take') as taker, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{self.name}-put') as putter:
+            try:
+                while True:
+                    await slots.acquire()
+                    envelope = await loop.run_in_executor(taker, self.queue.get)
+                    if envelope is _STOP:
+                        break
+                    task = loop.create_task(self._handle(envelope, putter))
+                    tasks.add(task)
+                    task.add_done_callback(lambda done: (tasks.discard(done), slots.release()))
+                if tasks:
+                    await asyncio.gather(*tasks)
+            finally:
+                if self.on_stop:
+                    try:
+                        await self.on_stop()
+                    except Exception as e:
+                        logger.warning(f"流水线阶段 {self.name} 关闭失败: {e}")
+
+    async def _handle(self, envelope, putter: ThreadPoolExecutor):
+        """处理一条数据并传给下一阶段"""
+        group, payload = envelope
+        started = time.monotonic()
+        try:
+            result = await self.func(payload)
+        except Exception as e:
+            self._record(started, 1, failed=1)
+            self._fail(group, payload, e)
+            return
+        self._record(started, 1)
+        if result is not None and self.next_stage is not None:
+            await asyncio.get_running_loop().run_in_executor(putter, self.next_stage.put, (group, result))
+        elif group is not None:
+            group._done()
+
+
+class Pipeline:
+    """
+    多阶段流水线
+
+    数据经 put 进入第一个阶段，依次流过各阶段；每个阶段有独立的工作线程数和有界输入队列，
+    下游处理不过来时上游阻塞，逐级反压到数据源。各阶段统计忙碌时间和队列深度，
+    利用率最高、队列长期积压的阶段即为瓶颈。
+    """
+
+    def __init__(self):
+        self.stages: List[PipelineStage] = []
+        self._sources: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._started_at: Optional[float] = None
+        self._stopped_at: Optional[float] = None
+
+    def add_stage(self, name: str, func: Callable, workers: int = 1, queue_size: int = 0,
+                  batch_size: int = 1, on_error: Optional[Callable[[Any, Exception], None]] = None) -> 'Pipeline':
+        """
+        追加一个阶段（参数见 PipelineStage）
+
+        Returns:
+            流水线本身，便于链式调用
+        """
+        stage = PipelineStage(name, func, workers, queue_size, batch_size, on_error)
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+        return self
+
+    def add_async_stage(self, name: str, func: Callable[[Any], Awaitable[Any]], concurrency: int = 100,
+                        queue_size: int = 0, on_error: Optional[Callable[[Any, Exception], None]] = None,
+                        on_stop: Optional[Callable[[], Awaitable[None]]] = None) -> 'Pipeline':
+        """
+        追加一个协程阶段（参数见 AsyncPipelineStage，concurrency 为最大并发协程数）
+
+        Returns:
+            流水线本身，便于链式调用
+        """
+        stage = AsyncPipelineStage(name, func, concurrency, queue_size, on_error, on_stop)
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+        return self
+
+    def start(self):
+        """启动各阶段的工作线程"""
+        self._started_at = time.monotonic()
+        self._stopped_at = None
+        for stage in self.stages:
+            stage.start()
+
+    def put(self, payload, group: Optional[PipelineGroup] = None):
+        """
+        提交数据到第一个阶段（队列满时阻塞）
+
+        Args:
+            payload: 数据
+            group: 所属的组（可选，用于等待完成）
+        """
+        if group is not None:
+            group._add()
+        self.stages[0].put((group, payload))
+
+    def record_source(self, name: str, busy_seconds: float, items: int = 0):
+        """
+        记录数据源的耗时（如列表分页），与各阶段一起输出
+
+        Args:
+            name: 数据源名称
+            busy_seconds: 等待数据源的时间（秒）
+            items: 产出的数据条数
+        """
+        with self._lock:
+            source = self._sources.setdefault(name, {'items': 0, 'busy_seconds': 0.0})
+            source['items'] += items
+            source['busy_seconds'] += busy_seconds
+
+    def close(self):
+        """按顺序处理完各阶段剩余数据后停止"""
+        for stage in self.stages:
+            stage.stop()
+        self._stopped_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取各数据源和阶段的统计
+
+        Returns:
+            名称到统计信息的映射（按数据流顺序）
+        """
+        if self._started_at is None:
+            return {}
+        elapsed = (self._stopped_at or time.monotonic()) - self._started_at
+        with self._lock:
+            stats = {name: {'items': int(source['items']), 'busy_seconds': round(source['busy_seconds'], 2)}
+                     for name, source in self._sources.items()}
+        for stage in self.stages:
+            stats[stage.name] = stage.get_stats(elapsed)
+        return stats
+
+    def __enter__(self) -> 'Pipeline':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,152 @@
+"""限流模块 - 按接口的令牌桶，可通过本地状态文件跨进程共享"""
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from logger import setup_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持 fcntl，退化为进程内限流
+    fcntl = None
+
+logger = setup_logger(__name__)
+
+
+class TokenBucket:
+    """
+    令牌桶（按理论到达时间实现，均匀排队而非先突发再退避）
+
+    每次 reserve 都会立即预占一个时间槽并返回需要等待的秒数，
+    因此并发调用者会被均匀地排开。
+    """
+
+    def __init__(self, rate: float, burst: int = 1, name: str = "default",
+                 state_file: Optional[str] = None):
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 每秒允许的请求数
+            burst: 允许的突发请求数
+            name: 桶名称（共享状态文件中的键）
+            state_file: 跨进程共享的状态文件路径（为空则仅进程内生效）
+        """
+        if rate <= 0:
+            raise ValueError(f"限流速率必须大于0: {rate}")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.name = name
+        self.state_file = state_file if fcntl else None
+        self._interval = 1.0 / rate
+        self._tat = 0.0  # 理论到达时间（theoretical arrival time）
+        self._lock = threading.Lock()
+
+        if state_file and not fcntl:
+            logger.warning("当前平台不支持文件锁，限流仅在进程内生效")
+        if self.state_file:
+            Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+
+    def _schedule(self, tat: float, now: float) -> Tuple[float, float]:
+        """
+        计算新的理论到达时间和需要等待的秒数
+
+        Args:
+            tat: 当前理论到达时间
+            now: 当前时间
+
+        Returns:
+            (新的理论到达时间, 等待秒数)
+        """
+        new_tat = max(tat, now) + self._interval
+        delay = new_tat - self._interval * self.burst - now
+        return new_tat, max(0.0, delay)
+
+    def reserve(self) -> float:
+        """
+        预占一个令牌
+
+        Returns:
+            调用方在发送请求前需要等待的秒数
+        """
+        with self._lock:
+            if not self.state_file:
+                self._tat, delay = self._schedule(self._tat, time.time())
+                return delay
+            return self._reserve_shared()
+
+    def _reserve_shared(self) -> float:
+        """在文件锁保护下读取并更新共享状态"""
+        with open(self.state_file, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    state = json.loads(content) if content else {}
+                except json.JSONDecodeError:
+                    state = {}
+
+                new_tat, delay = self._schedule(state.get(self.name, 0.0), time.time())
+                state[self.name] = new_tat
+
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+                return delay
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def acquire(self):
+        """阻塞直到获得令牌"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RateLimiter:
+    """按接口划分的限流器"""
+
+    def __init__(self, rates: Dict[str, float], burst: int = 1,
+                 state_file: Optional[str] = None, namespace: str = ""):
+        """
+        初始化限流器
+
+        Args:
+            rates: 接口名到每秒请求数的映射（未配置的接口不限流）
+            burst: 允许的突发请求数
+            state_file: 跨进程共享的状态文件路径（为空则仅进程内生效）
+            namespace: 状态键前缀（区分不同应用）
+        """
+        self.buckets = {
+            endpoint: TokenBucket(rate, burst=burst, name=f"{namespace}:{endpoint}", state_file=state_file)
+            for endpoint, rate in (rates or {}).items()
+            if rate
+        }
+
+    def reserve(self, endpoint: str) -> float:
+        """
+        为指定接口预占一个令牌
+
+        Args:
+            endpoint: 接口名
+
+        Returns:
+            需要等待的秒数
+        """
+        bucket = self.buckets.get(endpoint)
+        return bucket.reserve() if bucket else 0.0
+
+    def acquire(self, endpoint: str):
+        """
+        阻塞直到指定接口获得令牌
+
+        Args:
+            endpoint: 接口名
+        """
+        delay = self.reserve(endpoint)
+        if delay > 0:
+            time.sleep(delay)
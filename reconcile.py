@@ -0,0 +1,155 @@
+"""对账模块 - 按审批模板/天计算钉钉和飞书两侧的摘要树，逐层比较，只修复不一致的审批实例"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from data_processor import DataProcessor
+from logger import setup_logger
+from state_store import content_hash
+
+logger = setup_logger(__name__)
+
+# 列表元数据字段 -> (主表字段, 转换函数)，只比较列表接口返回了的字段；
+# 时间字段在列表和详情中的格式不一定相同，不参与比较（终态变化已体现在状态上）
+LIST_FIELDS: Tuple[Tuple[str, str, Callable[[Any], Any]], ...] = (
+    ('status', 'status', lambda value: DataProcessor.STATUS_MAP.get(value, value)),
+    ('title', 'title', lambda value: value),
+)
+
+
+def list_field_hashes(instance: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    由列表元数据计算钉钉侧的主表字段哈希（与 StateStore 中记录的字段哈希可直接比较）
+
+    Args:
+        instance: 列表接口返回的审批实例
+
+    Returns:
+        主表字段名到内容哈希的映射，值为None的字段为None（None不写入飞书）
+    """
+    hashes = {}
+    for list_key, field, convert in LIST_FIELDS:
+        if list_key not in instance:
+            continue
+        value = convert(instance[list_key])
+        hashes[field] = content_hash(value) if value is not None else None
+    return hashes
+
+
+class DigestTree:
+    """
+    摘要树：根 -> 审批模板 -> 天 -> 审批实例
+
+    叶子为每个审批实例的内容摘要（缺失的实例为None），上层摘要由下层摘要排序后哈希得到；
+    两棵树的根摘要相同即两侧一致，不同时只需展开摘要不同的分支。
+    """
+
+    def __init__(self):
+        # 模板 -> 天 -> 审批实例ID -> 叶子摘要
+        self._buckets: Dict[str, Dict[str, Dict[str, Optional[str]]]] = {}
+
+    def add_bucket(self, template: str, day: str):
+        """登记一个分桶（没有审批实例的分桶也参与比较）"""
+        self._buckets.setdefault(template, {}).setdefault(day, {})
+
+    def add(self, template: str, day: str, instance_id: str, leaf: Optional[str]):
+        """
+        加入一个审批实例
+
+        Args:
+            template: 审批模板代码
+            day: 日期（YYYY-MM-DD）
+            instance_id: 审批实例ID
+            leaf: 实例摘要（该侧没有此实例时为None）
+        """
+        self._buckets.setdefault(template, {}).setdefault(day, {})[instance_id] = leaf
+
+    def templates(self) -> List[str]:
+        return sorted(self._buckets)
+
+    def days(self, template: str) -> List[str]:
+        return sorted(self._buckets.get(template, {}))
+
+    def leaves(self, template: str, day: str) -> Dict[str, Optional[str]]:
+        return self._buckets.get(template, {}).get(day, {})
+
+    def bucket_count(self) -> int:
+        return sum(len(days) for days in self._buckets.values())
+
+    def bucket_digest(self, template: str, day: str) -> str:
+        return content_hash(sorted(self.leaves(template, day).items()))
+
+    def template_digest(self, template: str) -> str:
+        return content_hash([(day, self.bucket_digest(template, day)) for day in self.days(template)])
+
+    def digest(self) -> str:
+        return content_hash([(template, self.template_digest(template)) for template in self.templates()])
+
+
+def compare_trees(source: DigestTree, target: DigestTree) -> Dict[str, Any]:
+    """
+    自上而下比较两棵摘要树
+
+    Args:
+        source: 钉钉侧（权威数据）
+        target: 飞书侧
+
+    Returns:
+        对账报告：分桶数、比较过叶子的分桶数、不一致的分桶（模板、天、实例数）、
+        飞书缺失（missing）、内容不同（changed）、钉钉侧已不存在（extra）的审批实例ID
+    """
+    report = {
+        'source_digest': source.digest(),
+        'target_digest': target.digest(),
+        'buckets': source.bucket_count(),
+        'compared_buckets': 0,
+        'mismatched_buckets': [],
+        'missing': [],
+        'changed': [],
+        'extra': []
+    }
+    if report['source_digest'] == report['target_digest']:
+        return report
+
+    for template in sorted(set(source.templates()) | set(target.templates())):
+        if source.template_digest(template) == target.template_digest(template):
+            continue
+        for day in sorted(set(source.days(template)) | set(target.days(template))):
+            if source.bucket_digest(template, day) == target.bucket_digest(template, day):
+                continue
+            report['compared_buckets'] += 1
+            expected = source.leaves(template, day)
+            actual = target.leaves(template, day)
+            differing = 0
+            for instance_id in sorted(set(expected) | set(actual)):
+                want, have = expected.get(instance_id), actual.get(instance_id)
+                if want == have:
+                    continue
+                differing += 1
+                if instance_id not in expected or want is None:
+                    report['extra'].append(instance_id)
+                elif have is None:
+                    report['missing'].append(instance_id)
+                else:
+                    report['changed'].append(instance_id)
+            report['mismatched_buckets'].append({'template': template, 'day': day, 'instances': differing})
+    return report
+
+
+def save_report(report: Dict[str, Any], report_file: str):
+    """
+    保存对账报告
+
+    Args:
+        report: 对账报告
+        report_file: 报告文件路径
+    """
+    try:
+        Path(report_file).parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = f"{report_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, report_file)
+    except IOError as e:
+        logger.warning(f"保存对账报告失败: {e}")
@@ -0,0 +1,212 @@
+"""主表记录索引模块 - 本地维护 instance_id 到 record_id 的映射，避免逐条查询飞书"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from bitable_batch import BITABLE_BATCH_LIMIT, field_text
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class RecordIndex:
+    """
+    主表记录索引
+
+    首次使用时从快照文件加载（快照未过期时），否则分页拉取整张主表建立索引；
+    新增记录后由写入路径更新索引，运行结束时保存快照。快照超过 reconcile_interval
+    后重新全量拉取校准，修正在表格中手工增删的记录。
+    """
+
+    def __init__(self, bitable, app_token: str, table_id: str, key_field: str = 'instance_id',
+                 snapshot_file: Optional[str] = None, reconcile_interval: float = 86400):
+        """
+        初始化记录索引
+
+        Args:
+            bitable: 飞书多维表格客户端（BitableClient）
+            app_token: 多维表格 app_token
+            table_id: 主表ID
+            key_field: 唯一键字段名
+            snapshot_file: 快照文件路径（可选，跨运行复用索引）
+            reconcile_interval: 全量校准间隔（秒）
+        """
+        self.bitable = bitable
+        self.app_token = app_token
+        self.table_id = table_id
+        self.key_field = key_field
+        self.snapshot_file = snapshot_file
+        self.reconcile_interval = reconcile_interval
+        self.reconciled_at = 0.0
+        self._lock = threading.RLock()
+        self._records: Dict[str, str] = {}
+        self._loaded = False
+        self._load_failed = False
+        self._dirty = False
+
+    @property
+    def table_key(self) -> str:
+        return f"{self.app_token}/{self.table_id}"
+
+    def ensure_loaded(self) -> bool:
+        """
+        确保索引已加载（快照或全量拉取）
+
+        Returns:
+            索引是否可用（加载失败后直到下次校准前不再重试，调用方退回远程查询）
+        """
+        with self._lock:
+            if self._loaded:
+                return True
+            if self._load_failed:
+                return False
+            if self._load_snapshot():
+                return True
+            try:
+                self.reconcile()
+            except Exception as e:
+                self._load_failed = True
+                logger.warning(f"加载主表记录索引失败，改为远程查询: {e}")
+                return False
+            return True
+
+    def maybe_reconcile(self):
+        """索引已超过校准间隔时全量重新拉取（失败时保留现有索引）"""
+        with self._lock:
+            if self._loaded and time.time() - self.reconciled_at < self.reconcile_interval:
+                return
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.warning(f"校准主表记录索引失败: {e}")
+                self._load_failed = not self._loaded
+
+    def reconcile(self):
+        """分页拉取整张主表，重建索引并与现有索引比对"""
+        records: Dict[str, str] = {}
+        page_token = None
+        pages = 0
+        while True:
+            result = self.bitable.list_records(
+                self.app_token,
+                self.table_id,
+                page_token=page_token,
+                page_size=BITABLE_BATCH_LIMIT
+            )
+            pages += 1
+            for item in result.get('items') or []:
+                key = field_text(item.get('fields', {}).get(self.key_field))
+                if key:
+                    if key in records:
+                        logger.warning(f"主表存在重复记录 {key}: {records[key]}, {item['record_id']}")
+                    records[key] = item['record_id']
+            page_token = result.get('page_token')
+            if not result.get('has_more') or not page_token:
+                break
+
+        with self._lock:
+            if self._loaded:
+                added = len(records.keys() - self._records.keys())
+                removed = len(self._records.keys() - records.keys())
+                changed = sum(1 for key, record_id in records.items()
+                              if key in self._records and self._records[key] != record_id)
+                if added or removed or changed:
+                    logger.info(f"主表记录索引校准: 新增 {added}，删除 {removed}，变更 {changed}")
+            self._records = records
+            self._loaded = True
+            self._load_failed = False
+            self.reconciled_at = time.time()
+            self._dirty = True
+        logger.info(f"已加载主表记录索引 {len(records)} 条（{pages} 页）")
+        self.save()
+
+    def _load_snapshot(self) -> bool:
+        """从快照文件加载未过期的索引"""
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return False
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f"加载主表记录索引快照失败: {e}")
+            return False
+
+        if snapshot.get('table') != self.table_key:
+            return False
+        if time.time() - snapshot.get('reconciled_at', 0) >= self.reconcile_interval:
+            logger.info("主表记录索引快照已超过校准间隔，重新拉取")
+            return False
+        self._records = dict(snapshot.get('records', {}))
+        self.reconciled_at = snapshot['reconciled_at']
+        self._loaded = True
+        logger.info(f"从快照加载主表记录索引 {len(self._records)} 条")
+        return True
+
+    def save(self):
+        """索引有变化时保存快照"""
+        if not self.snapshot_file:
+            return
+        with self._lock:
+            if not self._loaded or not self._dirty:
+                return
+            snapshot = {'table': self.table_key, 'reconciled_at': self.reconciled_at,
+                        'records': dict(self._records)}
+            self._dirty = False
+
+        Path(self.snapshot_file).parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = f"{self.snapshot_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_file, self.snapshot_file)
+        except IOError as e:
+            logger.warning(f"保存主表记录索引快照失败: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询记录ID
+
+        Args:
+            key: 唯一键值
+
+        Returns:
+            record_id，不存在时返回None
+        """
+        with self._lock:
+            return self._records.get(key)
+
+    def resolve(self, keys: List[str]) -> Dict[str, str]:
+        """
+        批量查询记录ID
+
+        Args:
+            keys: 唯一键值列表
+
+        Returns:
+            键值到 record_id 的映射（不存在的键不包含在内）
+        """
+        with self._lock:
+            return {key: self._records[key] for key in keys if key in self._records}
+
+    def set(self, key: str, record_id: str):
+        """
+        记录新增的记录
+
+        Args:
+            key: 唯一键值
+            record_id: 记录ID
+        """
+        if not key or not record_id:
+            return
+        with self._lock:
+            if self._records.get(key) != record_id:
+                self._records[key] = record_id
+                self._dirty = True
+
+    def size(self) -> int:
+        """索引中的记录数"""
+        with self._lock:
+            return len(self._records)
@@ -0,0 +1,342 @@
+"""重试策略模块 - 钉钉错误分类、单次调用统一重试预算和熔断器"""
+import asyncio
+import inspect
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional, Tuple, TypeVar
+
+import requests
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+T = TypeVar('T')
+
+# 错误类别
+TOKEN_EXPIRED = 'token_expired'
+RATE_LIMITED = 'rate_limited'
+TRANSIENT = 'transient'
+FATAL = 'fatal'
+
+
+class DingTalkAPIError(Exception):
+    """钉钉接口返回非0 errcode"""
+
+    def __init__(self, description: str, errcode: Optional[int], errmsg: str = '',
+                 access_token: Optional[str] = None, status_code: Optional[int] = None):
+        """
+        Args:
+            description: 接口描述
+            errcode: 钉钉错误码（HTTP错误时为None）
+            errmsg: 错误信息
+            access_token: 请求使用的令牌（用于令牌过期时只作废该令牌）
+            status_code: HTTP状态码（HTTP错误时）
+        """
+        self.errcode = errcode
+        self.errmsg = errmsg
+        self.access_token = access_token
+        self.status_code = status_code
+        super().__init__(f"{description}失败: {errmsg or errcode or status_code}")
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，上游不健康，直接失败"""
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后打开，冷却期内所有调用直接失败；
+    冷却期后放行一次试探调用（半开），成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold: int = 10, reset_timeout: float = 60):
+        """
+        Args:
+            failure_threshold: 打开熔断器的连续失败次数
+            reset_timeout: 打开后的冷却时间（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        # 累计打开次数，调用方据此判断一次运行期间是否发生过熔断
+        self.trips = 0
+
+    @property
+    def is_open(self) -> bool:
+        """熔断器是否处于打开（含半开）状态"""
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_call(self) -> bool:
+        """
+        调用前检查，熔断器打开时抛出 CircuitOpenError
+
+        Returns:
+            本次调用是否为半开状态下放行的试探调用（调用方结束后须调用 end_probe）
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.time() - self._opened_at < self.reset_timeout or self._probing:
+                raise CircuitOpenError(f"钉钉接口连续失败 {self._failures} 次，熔断中")
+            # 冷却期结束，放行一次试探调用
+            self._probing = True
+            return True
+
+    def end_probe(self):
+        """
+        结束试探调用
+
+        试探调用以业务错误、令牌过期等不计入熔断的结果结束时，record_success/record_failure
+        都不会执行，此时只清除试探标记，熔断器保持打开，下一次调用重新试探。
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        """记录调用成功，关闭熔断器"""
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("钉钉接口恢复，熔断器关闭")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        """记录一次上游失败（限流或临时错误）"""
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    self.trips += 1
+                logger.error(f"钉钉接口连续失败 {self._failures} 次，熔断器打开 {self.reset_timeout} 秒")
+                self._opened_at = time.time()
+                self._probing = False
+
+
+class RetryPolicy:
+    """
+    统一重试策略
+
+    每次调用只有一份重试预算（max_attempts），令牌过期、限流和临时错误共用；
+    令牌过期立即刷新重试（最多 max_token_refreshes 次），限流和临时错误按指数退避，
+    业务错误不重试。
+    """
+
+    TOKEN_EXPIRED_CODES = frozenset({40014, 42001})
+    RATE_LIMITED_CODES = frozenset({90002, 90018})
+    TRANSIENT_CODES = frozenset({-1})
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8,
+                 rate_limit_delay: float = 1.0, max_token_refreshes: int = 1,
+                 circuit_breaker: Optional[CircuitBreaker] = None):
+        """
+        Args:
+            max_attempts: 单次调用的最大尝试次数（含首次）
+            base_delay: 退避基础时间（秒）
+            max_delay: 退避上限（秒）
+            rate_limit_delay: 限流时的最小等待（秒，钉钉QPS按秒计）
+            max_token_refreshes: 单次调用内最多刷新令牌次数
+            circuit_breaker: 熔断器（可选）
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_delay = rate_limit_delay
+        self.max_token_refreshes = max_token_refreshes
+        self.circuit_breaker = circuit_breaker
+
+    def classify(self, error: Exception) -> str:
+        """
+        错误分类
+
+        Args:
+            error: 异常
+
+        Returns:
+            token_expired/rate_limited/transient/fatal
+        """
+        if isinstance(error, CircuitOpenError):
+            return FATAL
+        if isinstance(error, DingTalkAPIError):
+            if error.errcode in self.TOKEN_EXPIRED_CODES:
+                return TOKEN_EXPIRED
+            if error.errcode in self.RATE_LIMITED_CODES or error.status_code == 429:
+                return RATE_LIMITED
+            if error.errcode in self.TRANSIENT_CODES or (error.status_code or 0) >= 500:
+                return TRANSIENT
+            return FATAL
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return TRANSIENT
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            status = error.response.status_code
+            if status == 429:
+                return RATE_LIMITED
+            if status >= 500:
+                return TRANSIENT
+            return FATAL
+        # 其他网络层异常（如套接字连接错误、超时）按临时错误处理
+        if isinstance(error, (ConnectionError, TimeoutError, OSError)):
+            return TRANSIENT
+        return FATAL
+
+    def backoff(self, attempt: int, kind: str) -> float:
+        """
+        计算第 attempt 次失败后的等待时间（指数退避 + 抖动）
+
+        Args:
+            attempt: 已尝试次数
+            kind: 错误类别
+
+        Returns:
+            等待秒数
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = random.uniform(delay / 2, delay)
+        if kind == RATE_LIMITED:
+            delay = max(delay, self.rate_limit_delay)
+        return delay
+
+    def decide(self, error: Exception, attempt: int, token_refreshes: int) -> Tuple[str, float]:
+        """
+        根据错误决定下一步
+
+        Args:
+            error: 本次尝试的异常
+            attempt: 已尝试次数
+            token_refreshes: 已刷新令牌次数
+
+        Returns:
+            (动作, 等待秒数)，动作为 refresh/retry/raise
+        """
+        kind = self.classify(error)
+        if kind in (RATE_LIMITED, TRANSIENT) and self.circuit_breaker:
+            self.circuit_breaker.record_failure()
+
+        if attempt >= self.max_attempts or kind == FATAL:
+            return 'raise', 0.0
+        if kind == TOKEN_EXPIRED:
+            if token_refreshes >= self.max_token_refreshes:
+                return 'raise', 0.0
+            return 'refresh', 0.0
+        return 'retry', self.backoff(attempt, kind)
+
+    def before_call(self) -> bool:
+        """
+        调用前检查熔断器
+
+        Returns:
+            本次调用是否为熔断器半开时的试探调用
+        """
+        if self.circuit_breaker:
+            return self.circuit_breaker.before_call()
+        return False
+
+    def end_probe(self):
+        """结束试探调用（无论调用以何种结果结束）"""
+        if self.circuit_breaker:
+            self.circuit_breaker.end_probe()
+
+    def record_success(self):
+        """记录调用成功"""
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success()
+
+    def call(self, func: Callable[[], T], description: str = '',
+             on_token_expired: Optional[Callable[[Exception], None]] = None) -> T:
+        """
+        按策略执行调用
+
+        Args:
+            func: 无参调用，每次尝试执行一次
+            description: 接口描述（用于日志）
+            on_token_expired: 令牌过期时的回调（作废令牌）
+
+        Returns:
+            调用结果
+        """
+        attempt = 0
+        token_refreshes = 0
+        probing = False
+        refreshed = False
+        try:
+            while True:
+                # 刷新令牌后的重试是同一次尝试的延续（上游已应答），不重新经过熔断器
+                if not refreshed:
+                    probing = self.before_call() or probing
+                refreshed = False
+                attempt += 1
+                try:
+                    result = func()
+                except Exception as e:
+                    action, delay = self.decide(e, attempt, token_refreshes)
+                    if action == 'raise':
+                        raise
+                    if action == 'refresh':
+                        token_refreshes += 1
+                        refreshed = True
+                        logger.warning(f"{description} Token过期，刷新后重试")
+                        if on_token_expired:
+                            on_token_expired(e)
+                        continue
+                    logger.warning(f"{description}失败，{delay:.1f}秒后重试 (第{attempt}次): {e}")
+                    time.sleep(delay)
+                    continue
+                self.record_success()
+                return result
+        finally:
+            # 试探调用以任何结果结束都要清除试探标记，否则熔断器永久打开
+            if probing:
+                self.end_probe()
+
+    async def acall(self, func: Callable[[], Awaitable[T]], description: str = '',
+                    on_token_expired: Optional[Callable[[Exception], Optional[Awaitable[None]]]] = None) -> T:
+        """
+        按策略执行协程调用（与 call 共用错误分类、重试预算和熔断器，退避时不阻塞事件循环）
+
+        Args:
+            func: 无参协程函数，每次尝试执行一次
+            description: 接口描述（用于日志）
+            on_token_expired: 令牌过期时的回调（作废令牌，可以是协程函数）
+
+        Returns:
+            调用结果
+        """
+        attempt = 0
+        token_refreshes = 0
+        probing = False
+        refreshed = False
+        try:
+            while True:
+                if not refreshed:
+                    probing = self.before_call() or probing
+                refreshed = False
+                attempt += 1
+                try:
+                    result = await func()
+                except Exception as e:
+                    action, delay = self.decide(e, attempt, token_refreshes)
+                    if action == 'raise':
+                        raise
+                    if action == 'refresh':
+                        token_refreshes += 1
+                        refreshed = True
+                        logger.warning(f"{description} Token过期，刷新后重试")
+                        if on_token_expired:
+                            outcome = on_token_expired(e)
+                            if inspect.isawaitable(outcome):
+                                await outcome
+                        continue
+                    logger.warning(f"{description}失败，{delay:.1f}秒后重试 (第{attempt}次): {e}")
+                    await asyncio.sleep(delay)
+                    continue
+                self.record_success()
+                return result
+        finally:
+            if probing:
+                self.end_probe()
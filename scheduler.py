@@ -0,0 +1,121 @@
+"""调度模块 - 常驻进程内按间隔重复执行同步，保持令牌、连接池和缓存跨轮次复用"""
+import os
+import random
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from logger import setup_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持 fcntl，不做跨进程互斥
+    fcntl = None
+
+logger = setup_logger(__name__)
+
+
+class SyncScheduler:
+    """
+    进程内同步调度器
+
+    在调用线程中循环执行任务：每轮开始后间隔 interval 秒（加 0~jitter 秒随机抖动）开始下一轮。
+    任务在同一线程中依次执行，耗时超过间隔时下一轮在本轮结束后立即开始，不会重叠，
+    也不会补跑错过的轮次。收到 SIGTERM/SIGINT 时不再开始新的一轮，等待当前一轮完成后退出。
+    """
+
+    def __init__(self, job: Callable[[], Any], interval: float, jitter: float = 0,
+                 lock_file: Optional[str] = None, name: str = '常驻同步'):
+        """
+        初始化调度器
+
+        Args:
+            job: 每轮执行的任务，返回False表示本轮失败
+            interval: 调度间隔（秒）
+            jitter: 随机抖动上限（秒），避免多个部署同时请求接口
+            lock_file: 进程锁文件路径（可选，同一时刻只允许一个常驻进程）
+            name: 任务名称（用于日志）
+        """
+        if interval <= 0:
+            raise Exception(f"调度间隔必须大于0: {interval}")
+        self.job = job
+        self.interval = interval
+        self.jitter = max(0.0, jitter)
+        self.lock_file = lock_file
+        self.name = name
+        self._stop = threading.Event()
+        self.cycles = 0
+        self.failures = 0
+
+    def install_signal_handlers(self):
+        """收到 SIGTERM/SIGINT 时优雅退出（只能在主线程调用）"""
+        def _handle(signum, frame):
+            logger.info(f"收到退出信号 {signum}，当前一轮完成后退出")
+            self.stop()
+
+        signal.signal(signal.SIGTERM, _handle)
+        signal.signal(signal.SIGINT, _handle)
+
+    def stop(self):
+        """请求停止：正在等待时立即返回，正在执行时等本轮结束"""
+        self._stop.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def run_forever(self, max_cycles: Optional[int] = None):
+        """
+        循环执行任务直到 stop 被调用
+
+        Args:
+            max_cycles: 最多执行的轮数（可选）
+        """
+        with self._process_lock():
+            logger.info(f"{self.name}已启动: 间隔={self.interval:.0f}s, 抖动={self.jitter:.0f}s")
+            while not self._stop.is_set():
+                started = time.monotonic()
+                self._run_cycle()
+                if max_cycles is not None and self.cycles >= max_cycles:
+                    break
+                elapsed = time.monotonic() - started
+                if elapsed >= self.interval:
+                    logger.warning(f"{self.name}本轮耗时 {elapsed:.1f}s 超过调度间隔，下一轮立即开始")
+                delay = max(0.0, self.interval - elapsed) + random.uniform(0, self.jitter)
+                self._stop.wait(delay)
+            logger.info(f"{self.name}已停止: 共 {self.cycles} 轮，失败 {self.failures} 轮")
+
+    def _run_cycle(self):
+        """执行一轮任务（异常不会终止调度）"""
+        self.cycles += 1
+        try:
+            ok = self.job() is not False
+        except Exception as e:
+            logger.error(f"{self.name}第 {self.cycles} 轮异常: {e}")
+            ok = False
+        if not ok:
+            self.failures += 1
+
+    @contextmanager
+    def _process_lock(self):
+        """持有进程锁，已有常驻进程持有时抛出异常"""
+        if not self.lock_file or not fcntl:
+            yield
+            return
+        Path(self.lock_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_file, 'a+') as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise Exception(f"已有常驻同步进程在运行（锁文件 {self.lock_file}）")
+            try:
+                f.seek(0)
+                f.truncate()
+                f.write(str(os.getpid()))
+                f.flush()
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,206 @@
+"""时间窗口分片模块 - 将大时间范围拆分为可并行分页的子窗口，并记录分片进度"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+SHARD_UNITS = {
+    'day': timedelta(days=1),
+    'hour': timedelta(hours=1),
+}
+
+
+def resolve_shard_size(unit: Optional[str], start_time: datetime, end_time: datetime) -> Optional[timedelta]:
+    """
+    根据配置确定分片粒度
+
+    Args:
+        unit: 分片单位（day/hour/auto/none）
+        start_time: 开始时间
+        end_time: 结束时间
+
+    Returns:
+        分片粒度，不分片时返回None
+    """
+    if not unit or unit == 'none':
+        return None
+    if unit == 'auto':
+        span = end_time - start_time
+        # 多天范围按天分片，数小时范围按小时分片，更短的范围不分片
+        if span > timedelta(days=3):
+            return SHARD_UNITS['day']
+        if span > timedelta(hours=6):
+            return SHARD_UNITS['hour']
+        return None
+    if unit not in SHARD_UNITS:
+        raise ValueError(f"不支持的分片单位: {unit}")
+    return SHARD_UNITS[unit]
+
+
+def split_time_range(start_time: datetime, end_time: datetime,
+                     shard_size: Optional[timedelta]) -> List[Tuple[datetime, datetime]]:
+    """
+    将时间范围按自然边界（整天/整点）拆分为左闭右开的子窗口
+
+    Args:
+        start_time: 开始时间
+        end_time: 结束时间
+        shard_size: 分片粒度（None表示不拆分）
+
+    Returns:
+        子窗口列表
+    """
+    if not shard_size or end_time - start_time <= shard_size:
+        return [(start_time, end_time)]
+
+    if shard_size >= SHARD_UNITS['day']:
+        boundary = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        boundary = start_time.replace(minute=0, second=0, microsecond=0)
+
+    shards = []
+    shard_start = start_time
+    boundary += shard_size
+    while boundary < end_time:
+        shards.append((shard_start, boundary))
+        shard_start = boundary
+        boundary += shard_size
+    shards.append((shard_start, end_time))
+    return shards
+
+
+class ShardProgress:
+    """分片进度记录，用于单独重试失败的分片"""
+
+    def __init__(self, progress_file: str = "state/shard_progress.json"):
+        """
+        初始化分片进度记录
+
+        Args:
+            progress_file: 进度文件路径
+        """
+        self.progress_file = progress_file
+        self._lock = threading.Lock()
+        Path(progress_file).parent.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def run_key(start_time: datetime, end_time: datetime, process_code: Optional[str] = None) -> str:
+        """生成一次分片同步的键"""
+        return f"{process_code or '*'}|{start_time.strftime('%Y-%m-%d %H:%M:%S')}|{end_time.strftime('%Y-%m-%d %H:%M:%S')}"
+
+    @staticmethod
+    def shard_key(start_time: datetime, end_time: datetime) -> str:
+        """生成分片的键"""
+        return f"{start_time.strftime('%Y-%m-%d %H:%M:%S')}|{end_time.strftime('%Y-%m-%d %H:%M:%S')}"
+
+    def _load(self) -> Dict:
+        if not os.path.exists(self.progress_file):
+            return {}
+        try:
+            with open(self.progress_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f"加载分片进度失败: {e}")
+            return {}
+
+    def _save(self, data: Dict):
+        tmp_file = f"{self.progress_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.progress_file)
+        except IOError as e:
+            logger.warning(f"保存分片进度失败: {e}")
+
+    def start_run(self, run_key: str, shards: List[Tuple[datetime, datetime]],
+                  process_code: Optional[str] = None) -> List[Tuple[datetime, datetime]]:
+        """
+        登记一次分片同步，返回尚未完成的分片（同一范围重跑时跳过已完成分片）
+
+        Args:
+            run_key: 同步键
+            shards: 全部分片
+            process_code: 审批流程代码
+
+        Returns:
+            待同步的分片
+        """
+        with self._lock:
+            data = self._load()
+            run = data.setdefault(run_key, {'process_code': process_code, 'shards': {}})
+            pending = []
+            for shard in shards:
+                key = self.shard_key(*shard)
+                entry = run['shards'].setdefault(key, {'status': 'pending'})
+                if entry['status'] != 'done':
+                    pending.append(shard)
+            self._save(data)
+        return pending
+
+    def mark(self, run_key: str, shard: Tuple[datetime, datetime], status: str,
+             error: Optional[str] = None):
+        """
+        记录分片状态
+
+        Args:
+            run_key: 同步键
+            shard: 分片
+            status: 状态（done/failed）
+            error: 失败原因
+        """
+        with self._lock:
+            data = self._load()
+            run = data.setdefault(run_key, {'process_code': None, 'shards': {}})
+            entry = {'status': status, 'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            if error:
+                entry['error'] = error
+            run['shards'][self.shard_key(*shard)] = entry
+            self._save(data)
+
+    def finish_run(self, run_key: str) -> bool:
+        """
+        结束一次分片同步：全部分片完成时删除记录
+
+        Args:
+            run_key: 同步键
+
+        Returns:
+            是否全部完成
+        """
+        with self._lock:
+            data = self._load()
+            run = data.get(run_key)
+            if run is None:
+                return True
+            if all(entry['status'] == 'done' for entry in run['shards'].values()):
+                del data[run_key]
+                self._save(data)
+                return True
+            return False
+
+    def failed_runs(self) -> List[Tuple[str, Optional[str], List[Tuple[datetime, datetime]]]]:
+        """
+        获取存在未完成分片的同步记录
+
+        Returns:
+            (同步键, 审批流程代码, 未完成分片列表) 的列表
+        """
+        with self._lock:
+            data = self._load()
+        result = []
+        for run_key, run in data.items():
+            shards = []
+            for key, entry in run['shards'].items():
+                if entry['status'] != 'done':
+                    start_str, end_str = key.split('|')
+                    shards.append((datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S'),
+                                   datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')))
+            if shards:
+                result.append((run_key, run.get('process_code'), sorted(shards)))
+        return result
@@ -0,0 +1,410 @@
+"""写入状态模块 - 记录每个审批实例及审批任务上次写入飞书的内容哈希，跳过无变化的写入"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def content_hash(value: Any) -> str:
+    """
+    计算值的内容哈希（字典按键排序，结果与字段顺序无关）
+
+    Args:
+        value: 任意可JSON序列化的值
+
+    Returns:
+        16位十六进制哈希
+    """
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+
+class _JsonStateFile:
+    """以JSON文件持久化的状态字典（有变化时原子替换写入）"""
+
+    description = '写入状态'
+
+    def __init__(self, state_file: str):
+        """
+        初始化状态
+
+        Args:
+            state_file: 状态文件路径
+        """
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """从状态文件加载"""
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                states = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f"加载{self.description}失败: {e}")
+            return
+        with self._lock:
+            self._states = states
+
+    def save(self):
+        """有变化时写入状态文件"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._states, ensure_ascii=False, separators=(',', ':'))
+            self._dirty = False
+
+        Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = f"{self.state_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_file, self.state_file)
+        except IOError as e:
+            logger.warning(f"保存{self.description}失败: {e}")
+
+    @staticmethod
+    def _normalize(fields: Dict[str, Any]) -> Dict[str, Any]:
+        # 值为None的字段不会写入飞书，不参与比较
+        return {key: value for key, value in fields.items() if value is not None}
+
+    def forget(self, instance_id: str):
+        """
+        删除实例的状态（下次按首次写入处理）
+
+        Args:
+            instance_id: 审批实例ID
+        """
+        with self._lock:
+            if self._states.pop(instance_id, None) is not None:
+                self._dirty = True
+
+
+class StateStore(_JsonStateFile):
+    """
+    实例写入状态
+
+    按实例ID保存整条记录的哈希和各字段的哈希：整条哈希相同则跳过写入，
+    否则比较字段哈希，只发送变化的字段。写入成功后才提交新的哈希。
+    """
+
+    def diff(self, instance_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        比较与上次写入的内容
+
+        Args:
+            instance_id: 审批实例ID
+            fields: 本次要写入的字段
+
+        Returns:
+            无变化时返回None；否则返回需要写入的字段（首次写入时为全部字段）
+        """
+        fields = self._normalize(fields)
+        with self._lock:
+            state = self._states.get(instance_id)
+        if state is None:
+            return fields
+        if state['hash'] == content_hash(fields):
+            return None
+        previous = state.get('fields', {})
+        return {key: value for key, value in fields.items() if previous.get(key) != content_hash(value)}
+
+    def field_hashes(self, instance_id: str) -> Optional[Dict[str, str]]:
+        """
+        获取上次写入的各字段哈希（对账时与钉钉侧比较）
+
+        Args:
+            instance_id: 审批实例ID
+
+        Returns:
+            字段名到内容哈希的映射，未写入过时返回None
+        """
+        with self._lock:
+            state = self._states.get(instance_id)
+        return dict(state.get('fields', {})) if state is not None else None
+
+    def commit(self, instance_id: str, fields: Dict[str, Any]):
+        """
+        记录写入成功的内容
+
+        Args:
+            instance_id: 审批实例ID
+            fields: 写入后的完整字段
+        """
+        fields = self._normalize(fields)
+        state = {
+            'hash': content_hash(fields),
+            'fields': {key: content_hash(value) for key, value in fields.items()}
+        }
+        with self._lock:
+            self._states[instance_id] = state
+            self._dirty = True
+
+
+class TaskStateStore(_JsonStateFile):
+    """
+    审批任务写入状态
+
+    按审批实例保存每个任务指纹对应的明细记录ID和内容哈希：未写入过的任务新增，
+    内容变化的任务按记录ID原地更新，内容未变的任务跳过。
+
+    定时同步、事件回调和活跃实例复查可能同时同步同一审批实例，需要写入的任务在查询时即被预留，
+    写入成功（commit）或失败（release）前，其他线程查询同一任务时跳过，避免重复新增明细记录。
+    预留只保存在内存中。
+
+    在已有数据的明细表上首次启用时，先用 ensure_seeded 导入表中已有的记录：这些记录没有任务指纹，
+    按实例保存为待认领记录，查询该实例的任务时认领，避免首次运行把已有的明细记录重复新增一遍。
+    """
+
+    description = '任务写入状态'
+
+    # 待认领的已有明细记录在实例状态中的键前缀
+    LEGACY_PREFIX = 'legacy:'
+
+    def __init__(self, state_file: str, match_fields: Iterable[str] = ()):
+        """
+        初始化任务写入状态
+
+        Args:
+            state_file: 状态文件路径
+            match_fields: 认领已有明细记录时内容不完全相同，这些字段相同也视为同一任务（如节点、审批人）
+        """
+        # 已预留、尚未写入完成的任务：审批实例ID -> 任务指纹集合
+        self._pending: Dict[str, set] = {}
+        self.match_fields = tuple(match_fields)
+        # 状态文件不存在（首次启用）时需要从明细表导入已有记录
+        self.needs_seed = not os.path.exists(state_file)
+        self._seed_lock = threading.Lock()
+        super().__init__(state_file)
+
+    @staticmethod
+    def _field_hashes(fields: Dict[str, Any]) -> Dict[str, str]:
+        # 多维表格不返回空字段，认领时空值与缺失视为相同
+        return {key: content_hash(value) for key, value in fields.items() if value not in (None, '')}
+
+    def ensure_seeded(self, loader: Callable[[], Iterable[Tuple[str, str, Dict[str, Any]]]]):
+        """
+        首次启用时导入明细表中已有的记录（只执行一次，失败时不再重试）
+
+        Args:
+            loader: 返回 (审批实例ID, 记录ID, 字段文本值) 序列的函数
+        """
+        with self._seed_lock:
+            if not self.needs_seed:
+                return
+            self.needs_seed = False
+            try:
+                rows = list(loader())
+            except Exception as e:
+                logger.warning(f"导入明细表已有记录失败，已有审批实例的明细记录可能重复新增: {e}")
+                return
+            count = 0
+            with self._lock:
+                for instance_id, record_id, fields in rows:
+                    if not instance_id or not record_id:
+                        continue
+                    states = self._states.setdefault(instance_id, {})
+                    states[f"{self.LEGACY_PREFIX}{record_id}"] = [record_id, self._field_hashes(fields)]
+                    count += 1
+                self._dirty = True
+            logger.info(f"已导入明细表已有记录 {count} 条，按任务内容认领")
+            self.save()
+
+    def _claim_legacy(self, instance_id: str, fingerprint: str,
+                      fields: Dict[str, Any]) -> Optional[List[Any]]:
+        """
+        为未写入过的任务认领实例的已有明细记录（调用方持有锁）
+
+        内容相同的记录认领后跳过写入；内容不同但 match_fields 相同的记录认领后原地更新。
+
+        Returns:
+            认领后的 [记录ID, 内容哈希]，没有可认领的记录时返回None
+        """
+        states = self._states.get(instance_id)
+        legacy = [key for key in states if key.startswith(self.LEGACY_PREFIX)] if states else []
+        if not legacy:
+            return None
+        hashes = self._field_hashes(fields)
+        match = next((key for key in legacy
+                      if all(states[key][1].get(name) == hashes.get(name) for name in fields)), None)
+        digest = content_hash(self._normalize(fields))
+        if match is None and self.match_fields:
+            match = next((key for key in legacy
+                          if all(states[key][1].get(name) == hashes.get(name) for name in self.match_fields)), None)
+            digest = ''
+        if match is None:
+            return None
+        written = states[fingerprint] = [states.pop(match)[0], digest]
+        self._dirty = True
+        return written
+
+    def lookup(self, instance_id: str, fingerprint: str, fields: Dict[str, Any],
+               force: bool = False) -> Tuple[bool, Optional[str]]:
+        """
+        查询任务的写入状态，需要写入时预留该任务
+
+        Args:
+            instance_id: 审批实例ID
+            fingerprint: 任务指纹
+            fields: 本次要写入的字段
+            force: 内容未变也写入（其他线程正在写入的任务仍然跳过）
+
+        Returns:
+            (是否需要写入, 已写入的记录ID)，记录ID为None时需要新增；需要写入时调用方
+            须在写入结束后调用 commit 或 release
+        """
+        digest = content_hash(self._normalize(fields))
+        with self._lock:
+            pending = self._pending.get(instance_id)
+            written = self._states.get(instance_id, {}).get(fingerprint)
+            record_id = written[0] if written else None
+            if pending and fingerprint in pending:
+                return False, record_id
+            if written is None:
+                written = self._claim_legacy(instance_id, fingerprint, fields)
+                record_id = written[0] if written else None
+            if written and digest == written[1] and not force:
+                return False, record_id
+            self._pending.setdefault(instance_id, set()).add(fingerprint)
+        return True, record_id
+
+    def release(self, instance_id: str, fingerprint: str):
+        """
+        释放写入失败的任务预留（下次同步重新写入）
+
+        Args:
+            instance_id: 审批实例ID
+            fingerprint: 任务指纹
+        """
+        with self._lock:
+            self._discard_pending(instance_id, fingerprint)
+
+    def _discard_pending(self, instance_id: str, fingerprint: str):
+        pending = self._pending.get(instance_id)
+        if pending is not None:
+            pending.discard(fingerprint)
+            if not pending:
+                del self._pending[instance_id]
+
+    def commit(self, instance_id: str, fingerprint: str, record_id: str, fields: Dict[str, Any]):
+        """
+        记录写入成功的任务
+
+        Args:
+            instance_id: 审批实例ID
+            fingerprint: 任务指纹
+            record_id: 明细记录ID
+            fields: 写入的字段
+        """
+        if not record_id:
+            self.release(instance_id, fingerprint)
+            return
+        digest = content_hash(self._normalize(fields))
+        with self._lock:
+            self._states.setdefault(instance_id, {})[fingerprint] = [record_id, digest]
+            self._dirty = True
+            self._discard_pending(instance_id, fingerprint)
+
+
+class HotSetStore(_JsonStateFile):
+    """
+    活跃审批实例集合
+
+    记录未到终态的审批实例及其上次拉取详情的时间。列表接口按创建时间过滤，检查点之前创建的
+    进行中实例不会再被增量同步扫描到，由活跃集合按ID定期重新拉取；实例到达终态后移出集合。
+    """
+
+    description = '活跃实例集合'
+
+    def __init__(self, state_file: str, terminal_statuses: Iterable[str]):
+        """
+        初始化活跃实例集合
+
+        Args:
+            state_file: 状态文件路径
+            terminal_statuses: 终态状态（到达后移出集合）
+        """
+        self.terminal_statuses = frozenset(terminal_statuses)
+        super().__init__(state_file)
+
+    def track(self, instance_id: str, status: Optional[str]) -> bool:
+        """
+        记录一次详情拉取：未到终态时加入集合并更新拉取时间，到达终态时移出
+
+        Args:
+            instance_id: 审批实例ID
+            status: 审批状态
+
+        Returns:
+            实例是否在集合中
+        """
+        now = time.time()
+        with self._lock:
+            if status in self.terminal_statuses:
+                if self._states.pop(instance_id, None) is not None:
+                    self._dirty = True
+                return False
+            state = self._states.get(instance_id)
+            if state is None:
+                state = self._states[instance_id] = {'added_at': now}
+            state['status'] = status
+            state['polled_at'] = now
+            self._dirty = True
+            return True
+
+    def due(self, interval: float) -> List[str]:
+        """
+        获取需要重新拉取的实例（上次拉取早于 interval 秒前）
+
+        Args:
+            interval: 重新拉取间隔（秒）
+
+        Returns:
+            审批实例ID列表，按上次拉取时间从早到晚排列
+        """
+        deadline = time.time() - interval
+        with self._lock:
+            due = [(state.get('polled_at', 0), instance_id) for instance_id, state in self._states.items()
+                   if state.get('polled_at', 0) <= deadline]
+        return [instance_id for _, instance_id in sorted(due)]
+
+    def prune(self, max_age: float) -> int:
+        """
+        移出加入集合超过 max_age 秒的实例（长期未结束或已删除的实例不再重复拉取）
+
+        Args:
+            max_age: 最长保留时间（秒）
+
+        Returns:
+            移出的实例数
+        """
+        deadline = time.time() - max_age
+        with self._lock:
+            expired = [instance_id for instance_id, state in self._states.items()
+                       if state.get('added_at', 0) < deadline]
+            for instance_id in expired:
+                del self._states[instance_id]
+            if expired:
+                self._dirty = True
+        return len(expired)
+
+    def contains(self, instance_id: str) -> bool:
+        """实例是否在集合中"""
+        with self._lock:
+            return instance_id in self._states
+
+    def size(self) -> int:
+        """集合中的实例数"""
+        with self._lock:
+            return len(self._states)
@@ -1,16 +1,37 @@
 """钉钉审批记录同步到飞书主程序"""
 import yaml
 import argparse
+import asyncio
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Set, Tuple
 import requests
 
+import json_codec
 from dingtalk_client import DingTalkClient
+from async_dingtalk_client import AsyncDingTalkClient, aiohttp
+from rate_limiter import RateLimiter
+from token_cache import TokenCache
+from detail_cache import DetailCache
+from lookup_cache import TTLCache
+from retry_policy import RetryPolicy, CircuitBreaker
 from feishu_toolkit import TenantAuth, BitableClient
 from data_processor import DataProcessor
 from checkpoint import CheckpointManager
+from sharding import SHARD_UNITS, ShardProgress, resolve_shard_size, split_time_range
+from bitable_batch import ActionRecordBatcher, MainRecordBatcher, BITABLE_BATCH_LIMIT, field_text
+from record_index import RecordIndex
+from state_store import StateStore, TaskStateStore, HotSetStore, content_hash
+from feishu_writer import WriteBehindWriter
+from adaptive_concurrency import AdaptiveConcurrencyLimiter, AdaptiveBitableClient
+from pipeline import Pipeline, PipelineGroup
+from scheduler import SyncScheduler
+from callback_server import CallbackServer, DingTalkCallbackCrypto, InstanceWorkQueue
+from reconcile import DigestTree, compare_trees, list_field_hashes, save_report
 from logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -19,6 +40,9 @@ logger = setup_logger(__name__)
 class SyncManager:
     """同步管理器"""
     
+    # 批量查找主表记录时每次查询的实例数（过滤公式长度有限）
+    MAIN_LOOKUP_CHUNK = 50
+    
     def __init__(self, config_path: str = "config.yaml"):
         """
         初始化同步管理器
@@ -30,11 +54,30 @@ class SyncManager:
         
         # 初始化客户端
         dt_config = self.config['dingtalk']
+        json_codec.configure(
+            backend=dt_config.get('json_backend', 'auto'),
+            project_detail=dt_config.get('project_detail_fields', True)
+        )
         self.dingtalk_client = DingTalkClient(
             app_key=dt_config['app_key'],
             app_secret=dt_config['app_secret'],
-            base_url=dt_config.get('base_url', 'https://oapi.dingtalk.com')
+            base_url=dt_config.get('base_url', 'https://oapi.dingtalk.com'),
+            pool_connections=dt_config.get('pool_connections', 4),
+            pool_maxsize=dt_config.get('pool_maxsize', 16),
+            pool_block=dt_config.get('pool_block', False),
+            keep_alive=dt_config.get('keep_alive', True),
+            gzip=dt_config.get('gzip', True),
+            rate_limiter=self.build_rate_limiter(dt_config),
+            token_cache=self.build_token_cache(dt_config),
+            detail_cache=self.build_detail_cache(dt_config),
+            user_cache=self.build_lookup_cache(dt_config, dt_config.get('user_cache_file')),
+            dept_cache=self.build_lookup_cache(dt_config, dt_config.get('dept_cache_file')),
+            retry_policy=self.build_retry_policy(dt_config)
         )
+        if dt_config.get('token_refresher', False):
+            self.dingtalk_client.start_token_refresher(
+                lead_seconds=dt_config.get('token_refresh_lead', 300)
+            )
         
         fs_config = self.config['feishu']
         feishu_auth = TenantAuth(
@@ -43,6 +86,13 @@ class SyncManager:
             base_url=fs_config.get('base_url', 'https://open.feishu.cn'),
         )
         self.bitable = BitableClient(feishu_auth)
+        self.write_limiter = self.build_write_limiter(fs_config)
+        if self.write_limiter:
+            self.bitable = AdaptiveBitableClient(
+                self.bitable,
+                self.write_limiter,
+                rate_limit_retries=fs_config.get('write_concurrency', {}).get('rate_limit_retries', 3)
+            )
         
         # 初始化处理器
         self.data_processor = DataProcessor()
@@ -59,6 +109,58 @@ class SyncManager:
         self.action_table_id = fs_config['tables'].get('action')
         self.batch_size = sync_config.get('batch_size', 20)
         self.max_retries = sync_config.get('max_retries', 3)
+        self.record_index = self.build_record_index(sync_config)
+        state_file = sync_config.get('state_file', 'state/instance_state.json')
+        self.state_store = StateStore(state_file) if state_file else None
+        task_state_file = sync_config.get('task_state_file', 'state/task_state.json')
+        self.task_store = None
+        if task_state_file and self.action_table_id:
+            self.task_store = TaskStateStore(task_state_file, match_fields=('node_name', 'approver'))
+        hot_config = sync_config.get('hot_set', {})
+        hot_file = hot_config.get('state_file', 'state/hot_set.json')
+        self.hot_set = None
+        if hot_config.get('enabled', True) and hot_file:
+            self.hot_set = HotSetStore(hot_file, DataProcessor.TERMINAL_STATUSES)
+        self.hot_poll_interval = hot_config.get('poll_interval_seconds', 300)
+        self.hot_max_age = hot_config.get('max_age_days', 90) * 86400
+        self._hot_poll_lock = threading.Lock()
+        self.reconcile_config = sync_config.get('reconcile', {})
+        self.force_write = False  # 全量校验时不跳过无变化的写入，修正表格中被手工改动的记录
+        self.main_batcher = MainRecordBatcher(
+            self.bitable,
+            self.feishu_app_token,
+            self.main_table_id,
+            resolver=self.find_main_records,
+            max_retries=self.max_retries,
+            on_created=self.record_index.set if self.record_index else None
+        )
+        self.action_batcher = None
+        if self.action_table_id:
+            self.action_batcher = ActionRecordBatcher(
+                self.bitable,
+                self.feishu_app_token,
+                self.action_table_id,
+                batch_size=sync_config.get('action_batch_size', BITABLE_BATCH_LIMIT),
+                on_written=self.task_store.commit if self.task_store else None,
+                on_failed=self.handle_failed_action
+            )
+        self.writer = self.build_writer(sync_config)
+        self.concurrency = max(1, sync_config.get('concurrency', 8))
+        self.pipeline_config = sync_config.get('pipeline', {})
+        self.async_client = self.build_async_client(self.pipeline_config)
+        self.prefetch_pages = sync_config.get('prefetch_pages', 2)
+        self.shard_unit = sync_config.get('shard_unit', 'auto')
+        self.shard_concurrency = max(1, sync_config.get('shard_concurrency', 4))
+        self.shard_progress = ShardProgress(
+            progress_file=sync_config.get('shard_progress_file', 'state/shard_progress.json')
+        )
+        self._seen_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.callback_server: Optional[CallbackServer] = None
+        self.callback_queue: Optional[InstanceWorkQueue] = None
+        self.templates = self.load_templates(sync_config)
+        self.enrich_users = sync_config.get('enrich_users', False)
+        self.template_concurrency = max(1, sync_config.get('template_concurrency', 4))
         
         # 通知配置
         self.notification_enabled = self.config.get('notification', {}).get('enabled', False)
@@ -89,9 +191,203 @@ class SyncManager:
             logger.error(f"加载配置文件失败: {e}")
             sys.exit(1)
     
+    def load_templates(self, sync_config: Dict) -> List[Dict[str, Any]]:
+        """
+        解析审批模板配置，按优先级排序（数值越小越优先）
+        
+        Args:
+            sync_config: 同步配置
+            
+        Returns:
+            模板列表，每项包含 process_code/batch_size/priority
+        """
+        templates = []
+        for item in sync_config.get('templates') or []:
+            if isinstance(item, str):
+                item = {'process_code': item}
+            if not item.get('process_code'):
+                logger.warning(f"忽略缺少 process_code 的模板配置: {item}")
+                continue
+            templates.append({
+                'process_code': item['process_code'],
+                'batch_size': item.get('batch_size', self.batch_size),
+                'priority': item.get('priority', 100)
+            })
+        return sorted(templates, key=lambda t: t['priority'])
+    
+    @staticmethod
+    def build_rate_limiter(dt_config: Dict) -> Optional[RateLimiter]:
+        """
+        根据钉钉配置创建限流器
+        
+        Args:
+            dt_config: 钉钉配置
+            
+        Returns:
+            限流器，未配置 rate_limits 时返回None
+        """
+        rates = dt_config.get('rate_limits')
+        if not rates:
+            return None
+        return RateLimiter(
+            rates,
+            burst=dt_config.get('rate_limit_burst', 1),
+            state_file=dt_config.get('rate_limit_state_file') or None,
+            namespace=dt_config['app_key']
+        )
+    
+    @staticmethod
+    def build_retry_policy(dt_config: Dict) -> RetryPolicy:
+        """
+        根据钉钉配置创建重试策略和熔断器
+        
+        Args:
+            dt_config: 钉钉配置
+            
+        Returns:
+            重试策略，circuit_breaker.enabled 为 false 时不熔断
+        """
+        retry_config = dt_config.get('retry', {})
+        breaker_config = dt_config.get('circuit_breaker', {})
+        circuit_breaker = None
+        if breaker_config.get('enabled', True):
+            circuit_breaker = CircuitBreaker(
+                failure_threshold=breaker_config.get('failure_threshold', 10),
+                reset_timeout=breaker_config.get('reset_timeout', 60)
+            )
+        return RetryPolicy(
+            max_attempts=retry_config.get('max_attempts', 3),
+            base_delay=retry_config.get('base_delay', 0.5),
+            max_delay=retry_config.get('max_delay', 8),
+            rate_limit_delay=retry_config.get('rate_limit_delay', 1.0),
+            max_token_refreshes=retry_config.get('max_token_refreshes', 1),
+            circuit_breaker=circuit_breaker
+        )
+    
+    @staticmethod
+    def build_token_cache(dt_config: Dict) -> Optional[TokenCache]:
+        """
+        根据钉钉配置创建令牌文件缓存
+        
+        Args:
+            dt_config: 钉钉配置
+            
+        Returns:
+            令牌缓存，未配置 token_cache_file 时返回None
+        """
+        cache_file = dt_config.get('token_cache_file')
+        if not cache_file:
+            return None
+        return TokenCache(cache_file, key=dt_config['app_key'])
+    
+    @staticmethod
+    def build_detail_cache(dt_config: Dict) -> Optional[DetailCache]:
+        """
+        根据钉钉配置创建终态详情缓存
+        
+        Args:
+            dt_config: 钉钉配置
+            
+        Returns:
+            详情缓存，未配置 detail_cache_dir 时返回None
+        """
+        cache_dir = dt_config.get('detail_cache_dir')
+        if not cache_dir:
+            return None
+        return DetailCache(
+            cache_dir,
+            max_entries=dt_config.get('detail_cache_max_entries', 50000),
+            max_bytes=dt_config.get('detail_cache_max_mb', 512) * 1024 * 1024
+        )
+    
+    @staticmethod
+    def build_lookup_cache(dt_config: Dict, persist_file: Optional[str]) -> TTLCache:
+        """
+        根据钉钉配置创建用户/部门查询缓存
+        
+        Args:
+            dt_config: 钉钉配置
+            persist_file: 持久化文件路径（可选）
+            
+        Returns:
+            查询缓存
+        """
+        return TTLCache(
+            max_entries=dt_config.get('user_cache_max_entries', 10000),
+            ttl=dt_config.get('user_cache_ttl', 3600),
+            negative_ttl=dt_config.get('user_cache_negative_ttl', 300),
+            persist_file=persist_file or None
+        )
+    
+    @staticmethod
+    def build_write_limiter(fs_config: Dict) -> Optional[AdaptiveConcurrencyLimiter]:
+        """
+        根据飞书配置创建写入并发限制器
+        
+        Args:
+            fs_config: 飞书配置
+            
+        Returns:
+            并发限制器，write_concurrency.enabled 为 false 时返回None
+        """
+        limiter_config = fs_config.get('write_concurrency', {})
+        if not limiter_config.get('enabled', True):
+            return None
+        return AdaptiveConcurrencyLimiter(
+            initial_limit=limiter_config.get('initial', 2),
+            min_limit=limiter_config.get('min', 1),
+            max_limit=limiter_config.get('max', 8),
+            decrease_factor=limiter_config.get('decrease_factor', 0.5),
+            latency_tolerance=limiter_config.get('latency_tolerance', 2.0)
+        )
+    
+    def build_record_index(self, sync_config: Dict) -> Optional[RecordIndex]:
+        """
+        根据同步配置创建主表记录索引
+        
+        Args:
+            sync_config: 同步配置
+            
+        Returns:
+            记录索引，record_index.enabled 为 false 时返回None
+        """
+        index_config = sync_config.get('record_index', {})
+        if not index_config.get('enabled', True):
+            return None
+        return RecordIndex(
+            self.bitable,
+            self.feishu_app_token,
+            self.main_table_id,
+            snapshot_file=index_config.get('snapshot_file', 'state/main_record_index.json') or None,
+            reconcile_interval=index_config.get('reconcile_interval_hours', 24) * 3600
+        )
+    
+    def build_writer(self, sync_config: Dict) -> Optional[WriteBehindWriter]:
+        """
+        根据同步配置创建写后缓冲写入器
+        
+        Args:
+            sync_config: 同步配置
+            
+        Returns:
+            写入器，write_behind.enabled 为 false 时返回None（在拉取线程中直接写入）
+        """
+        writer_config = sync_config.get('write_behind', {})
+        if not writer_config.get('enabled', True):
+            return None
+        return WriteBehindWriter(
+            self.write_instance_rows,
+            self.flush_action_records,
+            batch_size=writer_config.get('batch_size', BITABLE_BATCH_LIMIT),
+            flush_interval=writer_config.get('flush_interval', 1.0),
+            max_pending=writer_config.get('max_pending', 2000),
+            workers=writer_config.get('workers', 8),
+            journal_file=writer_config.get('journal_file', 'state/write_journal.json') or None
+        )
+    
     def find_main_record(self, instance_id: str) -> Optional[Dict]:
         """
-        查找主表记录
+        查找主表记录（启用记录索引时直接查本地索引）
         
         Args:
             instance_id: 审批实例ID
@@ -99,6 +395,9 @@ class SyncManager:
         Returns:
             记录字典（包含record_id）或None
         """
+        if self.record_index and self.record_index.ensure_loaded():
+            record_id = self.record_index.get(instance_id)
+            return {'record_id': record_id} if record_id else None
         return self.bitable.find_record(
             self.feishu_app_token,
             self.main_table_id,
@@ -106,172 +405,901 @@ class SyncManager:
             instance_id
         )
     
-    def upsert_main_record(self, main_data: Dict[str, Any]) -> Dict:
+    def find_main_records(self, instance_ids: List[str]) -> Dict[str, str]:
         """
-        新增或更新主表记录
+        批量查找主表记录（按 instance_id 组合 OR 过滤条件分页查询）
         
         Args:
-            main_data: 主表数据
+            instance_ids: 审批实例ID列表
             
         Returns:
-            操作结果
+            审批实例ID到record_id的映射（不存在的实例不包含在内）
         """
-        # 查找是否存在
-        existing_record = self.find_main_record(main_data['instance_id'])
-        record_id = existing_record.get('record_id') if existing_record else None
+        if self.record_index and self.record_index.ensure_loaded():
+            return self.record_index.resolve(instance_ids)
         
-        # 转换为飞书字段格式（这里假设字段名与配置一致，实际需要根据飞书表格字段配置调整）
-        fields = {}
-        for key, value in main_data.items():
-            if value is not None:
-                fields[key] = value
-        
-        # 新增或更新
-        result = self.bitable.upsert_record(
-            self.feishu_app_token,
-            self.main_table_id,
-            record_id,
-            fields
-        )
-        
-        return result
+        found = {}
+        for start in range(0, len(instance_ids), self.MAIN_LOOKUP_CHUNK):
+            chunk = instance_ids[start:start + self.MAIN_LOOKUP_CHUNK]
+            conditions = ','.join(f'CurrentValue.[instance_id]="{instance_id}"' for instance_id in chunk)
+            try:
+                page_token = None
+                while True:
+                    result = self.bitable.list_records(
+                        self.feishu_app_token,
+                        self.main_table_id,
+                        filter=f"OR({conditions})",
+                        page_token=page_token,
+                        page_size=BITABLE_BATCH_LIMIT
+                    )
+                    for item in result.get('items') or []:
+                        found[field_text(item.get('fields', {}).get('instance_id'))] = item['record_id']
+                    page_token = result.get('page_token')
+                    if not result.get('has_more') or not page_token:
+                        break
+            except Exception as e:
+                # 过滤查询不可用时退回逐条查找
+                logger.warning(f"批量查找主表记录失败，改为逐条查找: {e}")
+                for instance_id in chunk:
+                    record = self.find_main_record(instance_id)
+                    if record:
+                        found[instance_id] = record.get('record_id')
+        return found
     
     def upsert_action_records(self, action_records: List[Dict[str, Any]], 
-                             instance_id: str) -> int:
+                             instance_id: str, stats: Optional[Dict[str, int]] = None,
+                             fingerprints: Optional[List[str]] = None) -> int:
         """
-        新增或更新动作明细记录
+        写入动作明细记录（加入批量写入缓冲，跨审批实例合并为批量请求）
+        
+        提供任务指纹且启用任务写入状态时，只新增未写入过的任务，内容变化的任务按记录ID
+        原地更新，内容未变的任务跳过；否则全部新增。需要写入的任务在查询时预留，其他线程
+        同时同步同一审批实例时跳过这些任务，不会重复新增。
         
         Args:
             action_records: 动作记录列表
             instance_id: 审批实例ID
+            stats: 写入结果计入的统计信息（批量写入完成后更新 action_inserted/action_updated/action_failed）
+            fingerprints: 与 action_records 对应的任务指纹（可选）
             
         Returns:
-            处理的记录数
+            加入缓冲的记录数
         """
-        if not self.action_table_id or not action_records:
+        if not self.action_batcher or not action_records:
             return 0
+        if not self.task_store or not fingerprints:
+            return self.action_batcher.add(instance_id, action_records, stats)
         
-        # 批量处理
-        batch_records = []
-        for action in action_records:
-            # 查找是否存在（根据instance_id和action_time判断唯一性）
-            # 这里简化处理，实际可以根据业务需求调整去重逻辑
-            fields = {}
-            for key, value in action.items():
-                if value is not None:
-                    fields[key] = value
-            
-            batch_records.append({
-                "fields": fields
-            })
+        self.task_store.ensure_seeded(self.load_action_rows)
+        records, pending_fingerprints, record_ids = [], [], []
+        for record, fingerprint in zip(action_records, fingerprints):
+            need_write, record_id = self.task_store.lookup(instance_id, fingerprint, record, self.force_write)
+            if not need_write:
+                continue
+            records.append(record)
+            pending_fingerprints.append(fingerprint)
+            record_ids.append(record_id)
+        self.action_batcher.record_skipped(stats, len(action_records) - len(records))
+        return self.action_batcher.add(instance_id, records, stats, pending_fingerprints, record_ids)
+    
+    def load_action_rows(self) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """
+        分页拉取明细表已有的全部记录（首次启用任务写入状态时导入）
         
-        # 批量写入（飞书支持批量接口，但需要去重处理）
-        # 这里简化处理，逐条写入（生产环境可以优化为批量）
-        success_count = 0
-        for record in batch_records:
-            try:
-                self.bitable.upsert_record(
-                    self.feishu_app_token,
-                    self.action_table_id,
-                    None,  # 明细表每次新增，不更新
-                    record['fields']
-                )
-                success_count += 1
-            except Exception as e:
-                logger.warning(f"写入动作记录失败: {e}")
+        Returns:
+            (审批实例ID, 记录ID, 字段文本值) 列表
+        """
+        rows = []
+        page_token = None
+        while True:
+            result = self.bitable.list_records(
+                self.feishu_app_token,
+                self.action_table_id,
+                page_token=page_token,
+                page_size=BITABLE_BATCH_LIMIT
+            )
+            for item in result.get('items') or []:
+                fields = {key: field_text(value) for key, value in item.get('fields', {}).items()}
+                rows.append((fields.get('instance_id'), item.get('record_id'), fields))
+            page_token = result.get('page_token')
+            if not result.get('has_more') or not page_token:
+                break
+        return rows
+    
+    def handle_failed_action(self, instance_id: str, fingerprint: Optional[str],
+                             fields: Optional[Dict[str, Any]]):
+        """
+        处理写入失败的明细记录：释放任务指纹的预留，记入写入日志由下次运行重写
         
-        return success_count
+        主表写入状态已提交，增量同步和对账都不会再发现这些明细记录，必须记入写入日志。
+        
+        Args:
+            instance_id: 审批实例ID
+            fingerprint: 任务指纹（未启用任务写入状态时为None）
+            fields: 明细记录字段（新增成功但未返回记录ID时为None，只释放指纹）
+        """
+        if fingerprint and self.task_store:
+            self.task_store.release(instance_id, fingerprint)
+        if fields is None:
+            return
+        if self.writer:
+            self.writer.journal_actions(instance_id, [fields], [fingerprint])
+        else:
+            logger.warning(f"未启用写后缓冲，写入失败的明细记录需全量校验补写: {instance_id}")
     
-    def sync_instances(self, start_time: datetime, end_time: datetime, 
-                      process_code: Optional[str] = None) -> Dict[str, int]:
+    def flush_action_records(self):
+        """写入缓冲中剩余的动作明细记录"""
+        if self.action_batcher:
+            self.action_batcher.flush()
+    
+    def build_async_client(self, pipeline_config: Dict) -> Optional[AsyncDingTalkClient]:
         """
-        同步审批实例
+        根据流水线配置创建异步详情客户端
         
         Args:
-            start_time: 开始时间
-            end_time: 结束时间
-            process_code: 审批流程代码（可选）
+            pipeline_config: 流水线配置
             
         Returns:
-            同步统计信息
+            异步客户端，未启用 async_detail 或未安装 aiohttp 时返回None（使用线程拉取详情）
+        """
+        if not pipeline_config.get('async_detail', False):
+            return None
+        if aiohttp is None:
+            logger.warning("未安装 aiohttp，详情拉取改用线程池（pip install aiohttp）")
+            return None
+        return AsyncDingTalkClient(
+            self.dingtalk_client,
+            limit=pipeline_config.get('async_concurrency', 100),
+            keep_alive=self.config['dingtalk'].get('keep_alive', True),
+            gzip=self.config['dingtalk'].get('gzip', True)
+        )
+    
+    def build_pipeline(self) -> Pipeline:
+        """
+        创建详情拉取 -> 转换 -> 写入流水线
+        
+        各阶段线程数独立配置，阶段间用有界队列连接：写入跟不上时转换阻塞，转换跟不上时拉取阻塞，
+        最终阻塞列表分页。写入阶段只有一个线程（启用写后缓冲时只负责提交，由写入器的线程并发写入）。
+        启用 pipeline.async_detail 时拉取阶段是一个事件循环，最多 async_concurrency 个详情请求同时进行。
+        
+        Returns:
+            流水线（调用方负责启动和关闭）
+        """
+        queue_size = self.pipeline_config.get('queue_size', 0)
+        pipeline = Pipeline()
+        if self.async_client:
+            pipeline.add_async_stage('detail', self.fetch_instance_detail_async,
+                                     concurrency=self.pipeline_config.get('async_concurrency', 100),
+                                     queue_size=queue_size, on_error=self.log_instance_error,
+                                     on_stop=self.async_client.close)
+        else:
+            pipeline.add_stage('detail', self.fetch_instance_detail, workers=self.concurrency,
+                               queue_size=queue_size, on_error=self.log_instance_error)
+        return (pipeline
+                .add_stage('transform', self.transform_instance_detail,
+                           workers=self.pipeline_config.get('transform_workers', 2),
+                           queue_size=queue_size, on_error=self.log_instance_error)
+                .add_stage('write', self.write_prepared_instances, workers=1,
+                           queue_size=max(queue_size, BITABLE_BATCH_LIMIT), batch_size=BITABLE_BATCH_LIMIT,
+                           on_error=self.log_instance_error))
+    
+    def fetch_instance_detail(self, task: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
-        stats = {
+        流水线拉取阶段：拉取审批实例详情（或按页预热发起人缓存）
+        
+        Args:
+            task: 流水线任务
+            
+        Returns:
+            带详情的任务，预热任务返回None
+        """
+        if 'warm_users' in task:
+            self.dingtalk_client.warm_user_cache(task['warm_users'])
+            return None
+        task['detail'] = self.dingtalk_client.get_process_instance_detail(task['instance_id'])
+        return task
+    
+    async def fetch_instance_detail_async(self, task: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        协程拉取阶段：拉取审批实例详情（发起人缓存预热仍使用同步客户端，在线程中执行）
+        
+        Args:
+            task: 流水线任务
+            
+        Returns:
+            带详情的任务，预热任务返回None
+        """
+        if 'warm_users' in task:
+            await asyncio.to_thread(self.dingtalk_client.warm_user_cache, task['warm_users'])
+            return None
+        task['detail'] = await self.async_client.get_process_instance_detail(task['instance_id'])
+        return task
+    
+    def transform_instance_detail(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        流水线转换阶段：补全并转换详情
+        
+        Args:
+            task: 带详情的流水线任务
+            
+        Returns:
+            带待写入数据的任务
+        """
+        detail = task.pop('detail')
+        self.track_hot_instance(task['instance_id'], detail)
+        task['prepared'] = (task['instance_id'],) + self.prepare_instance_rows(detail)
+        return task
+    
+    def track_hot_instance(self, instance_id: str, detail: Dict):
+        """按详情状态更新活跃实例集合（未到终态加入，到达终态移出）"""
+        if self.hot_set:
+            self.hot_set.track(instance_id, detail.get('status'))
+    
+    def write_prepared_instances(self, tasks: List[Dict[str, Any]]) -> List:
+        """
+        流水线写入阶段：提交给写后缓冲写入器（缓冲区满时阻塞），未启用写入器时按统计分组直接批量写入
+        
+        Args:
+            tasks: 带待写入数据的流水线任务列表
+            
+        Returns:
+            空列表（写入阶段是最后一个阶段）
+        """
+        if self.writer:
+            for task in tasks:
+                self.writer.submit(task['prepared'], task['write_stats'])
+            return []
+        groups: Dict[int, Tuple[Dict[str, int], List[Tuple]]] = {}
+        for task in tasks:
+            groups.setdefault(id(task['stats']), (task['stats'], []))[1].append(task['prepared'])
+        for stats, prepared in groups.values():
+            self.write_instance_rows(prepared, stats)
+        return []
+    
+    @staticmethod
+    def log_instance_error(task: Dict[str, Any], error: Exception):
+        """记录流水线中处理失败的审批实例"""
+        logger.error(f"同步审批实例失败 {task.get('instance_id')}: {error}")
+        if task.get('failed_ids') is not None:
+            task['failed_ids'].append(task.get('instance_id'))
+    
+    def prepare_instance_rows(self, detail: Dict) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[str]]:
+        """
+        补全并转换审批实例详情
+        
+        Args:
+            detail: 审批实例详情
+            
+        Returns:
+            (主表数据, 明细表数据列表, 明细记录对应的任务指纹列表)
+        """
+        if self.enrich_users:
+            self.enrich_instance_detail(detail)
+        main_data = self.data_processor.process_instance_main(detail)
+        if not self.action_table_id:
+            return main_data, [], []
+        action_records = self.data_processor.process_instance_actions(detail)
+        return main_data, action_records, self.data_processor.action_fingerprints(detail)
+    
+    def write_instance_rows(self, prepared: List[Tuple[str, Dict[str, Any], List[Dict[str, Any]], List[str]]],
+                            stats: Dict[str, int]) -> List[str]:
+        """
+        批量写入一批审批实例：主表按新增/更新分组批量写入，成功后明细记录进入批量写入缓冲
+        
+        Args:
+            prepared: (审批实例ID, 主表数据, 明细表数据列表, 任务指纹列表) 列表，
+                主表数据为None时只写明细记录（写入日志中主表已写入的审批实例）
+            stats: 同步统计信息（原地更新）
+            
+        Returns:
+            主表写入失败的审批实例ID列表
+        """
+        if not prepared:
+            return []
+        pending = []
+        changes = {}
+        for item in prepared:
+            instance_id, main_data, action_records, fingerprints = item
+            if main_data is None:
+                self.upsert_action_records(action_records, instance_id, stats, fingerprints)
+                stats['success'] += 1
+                continue
+            changed = self.diff_main_record(main_data)
+            if not changed:
+                stats['main_skipped'] += 1
+                self.upsert_action_records(action_records, instance_id, stats, fingerprints)
+                stats['success'] += 1
+                continue
+            changes[main_data['instance_id']] = changed
+            pending.append(item)
+        if not pending:
+            return []
+        
+        failed = []
+        results = self.main_batcher.upsert([item[1] for item in pending], changes)
+        for instance_id, main_data, action_records, fingerprints in pending:
+            error = results.get(main_data['instance_id'])
+            if error:
+                stats['failed'] += 1
+                failed.append(instance_id)
+                logger.error(f"同步审批实例失败 {instance_id}: {error}")
+                continue
+            stats['main_updated'] += 1
+            if self.state_store:
+                self.state_store.commit(main_data['instance_id'], main_data)
+            self.upsert_action_records(action_records, instance_id, stats, fingerprints)
+            stats['success'] += 1
+            logger.debug(f"成功同步审批实例: {instance_id}")
+        return failed
+    
+    def diff_main_record(self, main_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        比较主表数据与上次写入的内容
+        
+        Args:
+            main_data: 主表数据
+            
+        Returns:
+            需要写入的字段，无变化时返回空字典（未启用写入状态或全量校验时返回全部字段）
+        """
+        fields = {key: value for key, value in main_data.items() if value is not None}
+        if not self.state_store or self.force_write:
+            return fields
+        changed = self.state_store.diff(main_data['instance_id'], fields)
+        if changed is None:
+            return {}
+        if not changed:
+            # 只有字段被清空（值为None的字段不写入飞书），无需写入，记录新的内容
+            self.state_store.commit(main_data['instance_id'], fields)
+        return changed
+    
+    def enrich_instance_detail(self, detail: Dict):
+        """
+        用缓存的用户/部门信息补全详情中缺失的姓名和部门（原地修改）
+        
+        Args:
+            detail: 审批实例详情
+        """
+        client = self.dingtalk_client
+        tasks = detail.get('tasks', [])
+        client.warm_user_cache([detail.get('originator_userid')] + [task.get('userid') for task in tasks])
+        
+        if not detail.get('originator_user_name') and detail.get('originator_userid'):
+            user = client.get_user_info(detail['originator_userid'])
+            if user:
+                detail['originator_user_name'] = user.get('name', '')
+        
+        if not detail.get('originator_dept_name') and detail.get('originator_dept_id'):
+            dept = client.get_department_info(detail['originator_dept_id'])
+            if dept:
+                detail['originator_dept_name'] = dept.get('name', '')
+        
+        for task in tasks:
+            if not task.get('user_name') and task.get('userid'):
+                user = client.get_user_info(task['userid'])
+                if user:
+                    task['user_name'] = user.get('name', '')
+    
+    @staticmethod
+    def new_stats() -> Dict[str, int]:
+        """创建空的同步统计信息"""
+        return {
             'total': 0,
             'success': 0,
             'failed': 0,
             'main_updated': 0,
-            'action_inserted': 0
+            'main_skipped': 0,
+            'action_inserted': 0,
+            'action_updated': 0,
+            'action_skipped': 0,
+            'action_failed': 0
         }
+    
+    @staticmethod
+    def merge_stats(target: Dict[str, int], source: Dict[str, int]):
+        """将 source 中的统计累加到 target"""
+        for key, value in source.items():
+            target[key] = target.get(key, 0) + value
+    
+    def sync_window(self, start_time: datetime, end_time: datetime, process_code: Optional[str],
+                    pipeline: Pipeline, stats: Dict[str, int],
+                    seen: Optional[Set[str]] = None, batch_size: Optional[int] = None,
+                    write_stats: Optional[Dict[str, int]] = None):
+        """
+        分页同步一个时间窗口，列表请求失败时抛出异常（已提交的审批实例仍会处理完）
         
-        # 转换时间戳
+        列表页中的审批实例逐条放入流水线，流水线满时阻塞分页；窗口结束时等待本窗口的
+        审批实例全部离开流水线。启用写后缓冲时不等待飞书写入完成，写入结果由调用方 drain 后
+        计入 write_stats；写入失败的数据记入写入日志，下次运行重新写入。
+        
+        Args:
+            start_time: 开始时间
+            end_time: 结束时间
+            process_code: 审批流程代码（可选）
+            pipeline: 详情拉取 -> 转换 -> 写入流水线
+            stats: 同步统计信息（原地更新）
+            seen: 已提交的审批实例ID集合（可选，用于跨分片去重）
+            batch_size: 每页大小（默认使用 sync.batch_size）
+            write_stats: 写后缓冲的写入结果计入的统计信息（默认同 stats）
+        """
         start_ts = self.dingtalk_client.datetime_to_timestamp(start_time)
         end_ts = self.dingtalk_client.datetime_to_timestamp(end_time)
         
-        logger.info(f"开始同步审批记录: {start_time.strftime('%Y-%m-%d %H:%M:%S')} ~ {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        cursor = 0
-        size = self.batch_size
+        # 列表页由后台线程预取；本窗口的审批实例在流水线中的结果记入 group
+        group = PipelineGroup()
+        pages = self.dingtalk_client.iter_process_instances(
+            start_time=str(start_ts),
+            end_time=str(end_ts),
+            process_code=process_code,
+            size=batch_size or self.batch_size,
+            prefetch=self.prefetch_pages
+        )
         
-        while True:
-            try:
-                # 获取审批实例列表
-                result = self.dingtalk_client.get_process_instances(
-                    start_time=str(start_ts),
-                    end_time=str(end_ts),
-                    process_code=process_code,
-                    cursor=cursor,
-                    size=size
-                )
-                
-                instances = result.get('list', [])
-                if not instances:
+        try:
+            while True:
+                started = time.monotonic()
+                instances = next(pages, None)
+                pipeline.record_source('list', time.monotonic() - started, len(instances or []))
+                if instances is None:
                     break
+                if self.enrich_users:
+                    # 按页批量预热发起人缓存，与详情拉取并行
+                    pipeline.put({'warm_users': [instance.get('originator_userid') for instance in instances]})
                 
-                stats['total'] += len(instances)
-                
-                # 处理每条实例
                 for instance in instances:
                     instance_id = instance.get('process_instance_id', '')
                     if not instance_id:
                         continue
-                    
-                    try:
-                        # 获取详情
-                        detail = self.dingtalk_client.get_process_instance_detail(instance_id)
-                        
-                        # 处理主表数据
-                        main_data = self.data_processor.process_instance_main(detail)
-                        self.upsert_main_record(main_data)
-                        stats['main_updated'] += 1
-                        
-                        # 处理明细表数据
-                        if self.action_table_id:
-                            action_records = self.data_processor.process_instance_actions(detail)
-                            action_count = self.upsert_action_records(action_records, instance_id)
-                            stats['action_inserted'] += action_count
-                        
-                        stats['success'] += 1
-                        logger.debug(f"成功同步审批实例: {instance_id}")
-                        
-                    except Exception as e:
-                        stats['failed'] += 1
-                        logger.error(f"同步审批实例失败 {instance_id}: {e}")
-                
-                # 检查是否有下一页
-                if not result.get('has_more', False):
-                    break
-                
-                cursor = result.get('next_cursor', 0)
-                if cursor == 0:
-                    break
-                    
+                    if seen is not None:
+                        with self._seen_lock:
+                            if instance_id in seen:
+                                continue
+                            seen.add(instance_id)
+                    stats['total'] += 1
+                    pipeline.put({
+                        'instance_id': instance_id,
+                        'stats': group.counts,
+                        'write_stats': stats if write_stats is None else write_stats
+                    }, group)
+        finally:
+            pages.close()
+            group.wait()
+            if not self.writer:
+                # 窗口结束前写完缓冲的明细记录，使结果计入本窗口的统计
+                self.flush_action_records()
+            stats['failed'] += group.failed
+            self.merge_stats(stats, group.counts)
+    
+    def sync_shards(self, shards: List[Tuple[datetime, datetime]], process_code: Optional[str],
+                    pipeline: Pipeline, stats: Dict[str, int], run_key: str,
+                    batch_size: Optional[int] = None):
+        """
+        并行同步多个时间分片，按审批实例ID去重，并记录每个分片的进度
+        
+        Args:
+            shards: 时间分片列表
+            process_code: 审批流程代码（可选）
+            pipeline: 详情拉取 -> 转换 -> 写入流水线
+            stats: 同步统计信息（原地更新）
+            run_key: 分片进度记录的键
+            batch_size: 每页大小（默认使用 sync.batch_size）
+        """
+        pending_shards = self.shard_progress.start_run(run_key, shards, process_code)
+        if len(pending_shards) < len(shards):
+            logger.info(f"跳过已完成的分片 {len(shards) - len(pending_shards)} 个")
+        logger.info(f"并行同步 {len(pending_shards)} 个时间分片（并发 {self.shard_concurrency}）")
+        
+        seen: Set[str] = set()
+        stats_lock = threading.Lock()
+        
+        def _sync_shard(shard: Tuple[datetime, datetime]):
+            shard_stats = self.new_stats()
+            error = None
+            try:
+                self.sync_window(shard[0], shard[1], process_code, pipeline, shard_stats, seen, batch_size,
+                                 write_stats=stats)
+                if shard_stats['failed']:
+                    error = f"{shard_stats['failed']} 条审批实例同步失败"
+            except Exception as e:
+                error = f"获取审批实例列表失败: {e}"
+            
+            if error:
+                logger.error(f"分片同步失败 {ShardProgress.shard_key(*shard)}: {error}")
+            self.shard_progress.mark(run_key, shard, 'failed' if error else 'done', error)
+            with stats_lock:
+                self.merge_stats(stats, shard_stats)
+        
+        with ThreadPoolExecutor(max_workers=self.shard_concurrency, thread_name_prefix='shard') as shard_executor:
+            list(shard_executor.map(_sync_shard, pending_shards))
+        if self.writer:
+            self.writer.drain(stats)
+        
+        if not self.shard_progress.finish_run(run_key):
+            logger.warning("部分分片同步失败，可使用 --retry-failed-shards 单独重试")
+    
+    def sync_range(self, start_time: datetime, end_time: datetime, process_code: Optional[str],
+                   pipeline: Pipeline, batch_size: Optional[int] = None) -> Dict[str, int]:
+        """
+        同步一个时间范围（范围较大时拆分为并行分页的子窗口）
+        
+        Args:
+            start_time: 开始时间
+            end_time: 结束时间
+            process_code: 审批流程代码（可选）
+            pipeline: 详情拉取 -> 转换 -> 写入流水线
+            batch_size: 每页大小（默认使用 sync.batch_size）
+            
+        Returns:
+            同步统计信息
+        """
+        stats = self.new_stats()
+        shard_size = resolve_shard_size(self.shard_unit, start_time, end_time)
+        shards = split_time_range(start_time, end_time, shard_size)
+        
+        if len(shards) > 1:
+            run_key = ShardProgress.run_key(start_time, end_time, process_code)
+            self.sync_shards(shards, process_code, pipeline, stats, run_key, batch_size)
+        else:
+            try:
+                self.sync_window(start_time, end_time, process_code, pipeline, stats, batch_size=batch_size)
             except Exception as e:
                 logger.error(f"获取审批实例列表失败: {e}")
-                break
+            if self.writer:
+                self.writer.drain(stats)
+        return stats
+    
+    def sync_instances(self, start_time: datetime, end_time: datetime, 
+                      process_code: Optional[str] = None) -> Dict[str, int]:
+        """
+        同步审批实例
+        
+        Args:
+            start_time: 开始时间
+            end_time: 结束时间
+            process_code: 审批流程代码（可选）
+            
+        Returns:
+            同步统计信息
+        """
+        logger.info(f"开始同步审批记录: {start_time.strftime('%Y-%m-%d %H:%M:%S')} ~ {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        
+        with self.build_pipeline() as pipeline:
+            stats = self.sync_range(start_time, end_time, process_code, pipeline)
+        
+        self.log_sync_summary(stats)
+        self.log_pipeline_stats(pipeline)
+        return stats
+    
+    def sync_templates(self, start_time: datetime, end_time: datetime) -> Tuple[Dict[str, int], Dict[str, Dict[str, int]]]:
+        """
+        并发同步配置中的多个审批模板（共享客户端、令牌、连接池和流水线）
+        
+        Args:
+            start_time: 开始时间
+            end_time: 结束时间
+            
+        Returns:
+            (汇总统计信息, 模板代码到统计信息的映射)
+        """
+        logger.info(f"开始同步 {len(self.templates)} 个审批模板: {start_time.strftime('%Y-%m-%d %H:%M:%S')} ~ {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        
+        stats = self.new_stats()
+        template_stats: Dict[str, Dict[str, int]] = {}
+        
+        with self.build_pipeline() as pipeline, \
+                ThreadPoolExecutor(max_workers=self.template_concurrency, thread_name_prefix='template') as template_executor:
+            # 按优先级提交，并发数不足时高优先级模板先开始
+            futures = {
+                template_executor.submit(self.sync_range, start_time, end_time, template['process_code'],
+                                         pipeline, template['batch_size']): template['process_code']
+                for template in self.templates
+            }
+            for future in as_completed(futures):
+                process_code = futures[future]
+                try:
+                    template_stats[process_code] = future.result()
+                except Exception as e:
+                    logger.error(f"同步审批模板失败 {process_code}: {e}")
+                    template_stats[process_code] = self.new_stats()
+                self.merge_stats(stats, template_stats[process_code])
+        
+        for template in self.templates:
+            process_code = template['process_code']
+            item = template_stats[process_code]
+            logger.info(f"模板 {process_code}: 总计={item['total']}, 成功={item['success']}, 失败={item['failed']}")
+        self.log_sync_summary(stats)
+        self.log_pipeline_stats(pipeline)
+        return stats, template_stats
+    
+    def retry_failed_shards(self) -> Dict[str, int]:
+        """
+        单独重试此前失败的时间分片
+        
+        Returns:
+            同步统计信息
+        """
+        stats = self.new_stats()
+        runs = self.shard_progress.failed_runs()
+        if not runs:
+            logger.info("没有需要重试的分片")
+            return stats
+        
+        with self.build_pipeline() as pipeline:
+            for run_key, process_code, shards in runs:
+                logger.info(f"重试失败分片: {run_key}，共 {len(shards)} 个")
+                self.sync_shards(shards, process_code, pipeline, stats, run_key)
+        
+        self.log_sync_summary(stats)
+        self.log_pipeline_stats(pipeline)
+        return stats
+    
+    def sync_instance_ids(self, instance_ids: List[str],
+                          failed_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        按审批实例ID同步（事件回调、活跃实例复查触发，不更新检查点）
+        
+        Args:
+            instance_ids: 审批实例ID列表
+            failed_ids: 收集拉取或转换失败的审批实例ID（可选）
+            
+        Returns:
+            同步统计信息
+        """
+        stats = self.new_stats()
+        group = PipelineGroup()
+        with self.build_pipeline() as pipeline:
+            for instance_id in instance_ids:
+                stats['total'] += 1
+                pipeline.put({'instance_id': instance_id, 'stats': group.counts, 'write_stats': stats,
+                              'failed_ids': failed_ids}, group)
+            group.wait()
+        if not self.writer:
+            self.flush_action_records()
+        stats['failed'] += group.failed
+        self.merge_stats(stats, group.counts)
+        if self.writer:
+            self.writer.drain(stats)
+        self.save_write_state()
+        logger.info(f"按ID同步完成: 总计={stats['total']}, 成功={stats['success']}, 失败={stats['failed']}")
+        return stats
+    
+    def poll_hot_set(self) -> Dict[str, int]:
+        """
+        重新拉取活跃实例集合中到期的审批实例（检查点之前创建、仍在进行中的实例由此获得后续审批进展）
+        
+        Returns:
+            同步统计信息（另一线程正在复查时直接返回空统计）
+        """
+        stats = self.new_stats()
+        if not self.hot_set or not self._hot_poll_lock.acquire(blocking=False):
+            return stats
+        try:
+            pruned = self.hot_set.prune(self.hot_max_age)
+            if pruned:
+                logger.info(f"移出长期未结束的活跃审批实例 {pruned} 条")
+            # 留出调度误差，避免刚好差几毫秒到期的实例推迟到下一轮
+            instance_ids = self.hot_set.due(self.hot_poll_interval * 0.9)
+            if not instance_ids:
+                return stats
+            logger.info(f"重新拉取活跃审批实例 {len(instance_ids)} 条（集合共 {self.hot_set.size()} 条）")
+            return self.sync_instance_ids(instance_ids)
+        finally:
+            self._hot_poll_lock.release()
+    
+    def reconcile_range(self, start_time: datetime, end_time: datetime) -> Tuple[Dict[str, int], Dict[str, Any]]:
+        """
+        对账一个时间范围：按模板/天分桶，由列表元数据计算钉钉侧摘要树，由写入状态和主表记录索引
+        计算飞书侧摘要树，逐层比较后只重新拉取并写入不一致的审批实例
+        
+        两侧一致时只需列表请求，不拉取详情也不写入飞书。审批中的实例由活跃实例集合复查，
+        对账只补充集合中没有的审批中实例（未启用活跃实例集合时审批中的实例全部重新同步）。
+        
+        Args:
+            start_time: 开始时间
+            end_time: 结束时间
+            
+        Returns:
+            (修复的同步统计信息, 对账报告)
+        """
+        index = self.record_index
+        if index and self.reconcile_config.get('refresh_index', True):
+            # 从表格重新加载索引，发现被手工删除的主表记录
+            try:
+                index.reconcile()
+            except Exception as e:
+                logger.warning(f"重新加载主表记录索引失败，使用已有索引: {e}")
+        if index and not index.ensure_loaded():
+            # 索引不可用时无法判断记录是否存在，只按写入状态比较
+            index = None
+        
+        source, target = DigestTree(), DigestTree()
+        untracked: List[str] = []
+        failed_buckets: List[Dict[str, str]] = []
+        lock = threading.Lock()
+        templates = [(template['process_code'], template['batch_size']) for template in self.templates] or [(None, None)]
+        buckets = [(process_code, batch_size, window)
+                   for process_code, batch_size in templates
+                   for window in split_time_range(start_time, end_time, SHARD_UNITS['day'])]
+        
+        def _scan(bucket):
+            process_code, batch_size, (window_start, window_end) = bucket
+            template, day = process_code or '*', window_start.strftime('%Y-%m-%d')
+            try:
+                instances = self.list_window_instances(window_start, window_end, process_code, batch_size)
+            except Exception as e:
+                logger.error(f"对账获取审批实例列表失败 {template} {day}: {e}")
+                with lock:
+                    failed_buckets.append({'template': template, 'day': day, 'error': str(e)})
+                return
+            with lock:
+                source.add_bucket(template, day)
+                target.add_bucket(template, day)
+                for instance in instances:
+                    instance_id = instance.get('process_instance_id')
+                    if not instance_id:
+                        continue
+                    expected = list_field_hashes(instance)
+                    source.add(template, day, instance_id, content_hash(sorted(expected.items())))
+                    target.add(template, day, instance_id, self.feishu_leaf(instance_id, expected, index))
+                    status = instance.get('status')
+                    if status and status not in DataProcessor.TERMINAL_STATUSES and \
+                            not (self.hot_set and self.hot_set.contains(instance_id)):
+                        untracked.append(instance_id)
+        
+        with ThreadPoolExecutor(max_workers=self.shard_concurrency, thread_name_prefix='reconcile') as executor:
+            list(executor.map(_scan, buckets))
+        
+        report = compare_trees(source, target)
+        report['range'] = [start_time.strftime('%Y-%m-%d %H:%M:%S'), end_time.strftime('%Y-%m-%d %H:%M:%S')]
+        report['failed_buckets'] = failed_buckets
+        differing = set(report['missing']) | set(report['changed'])
+        report['untracked'] = sorted(set(untracked) - differing)
         
+        # 飞书缺失或内容不同的实例清除主表写入状态后全量重写（摘要只覆盖主表，明细记录仍按任务指纹去重）
+        if self.state_store:
+            for instance_id in report['missing'] + report['changed']:
+                self.state_store.forget(instance_id)
+        repair_ids = report['missing'] + report['changed'] + report['untracked']
+        stats = self.sync_instance_ids(repair_ids) if repair_ids else self.new_stats()
+        report['repaired'] = {key: stats[key] for key in ('total', 'success', 'failed')}
+        
+        logger.info(f"对账完成: 分桶={report['buckets']}, 不一致分桶={len(report['mismatched_buckets'])}, "
+                    f"飞书缺失={len(report['missing'])}, 内容不同={len(report['changed'])}, "
+                    f"未跟踪的审批中实例={len(report['untracked'])}, 列表失败分桶={len(failed_buckets)}, "
+                    f"修复成功={stats['success']}, 修复失败={stats['failed']}")
+        report_file = self.reconcile_config.get('report_file', 'state/reconcile_report.json')
+        if report_file:
+            save_report(report, report_file)
+        return stats, report
+    
+    def list_window_instances(self, start_time: datetime, end_time: datetime, process_code: Optional[str],
+                              batch_size: Optional[int] = None) -> List[Dict]:
+        """
+        获取一个时间窗口内全部审批实例的列表元数据
+        
+        Args:
+            start_time: 开始时间
+            end_time: 结束时间
+            process_code: 审批流程代码（可选）
+            batch_size: 每页大小（默认使用 sync.batch_size）
+            
+        Returns:
+            审批实例列表
+        """
+        pages = self.dingtalk_client.iter_process_instances(
+            start_time=str(self.dingtalk_client.datetime_to_timestamp(start_time)),
+            end_time=str(self.dingtalk_client.datetime_to_timestamp(end_time)),
+            process_code=process_code,
+            size=batch_size or self.batch_size,
+            prefetch=self.prefetch_pages
+        )
+        try:
+            return [instance for instances in pages for instance in instances]
+        finally:
+            pages.close()
+    
+    def feishu_leaf(self, instance_id: str, expected: Dict[str, Optional[str]],
+                    index: Optional[RecordIndex] = None) -> Optional[str]:
+        """
+        计算飞书侧的实例摘要（与钉钉侧比较相同的字段）
+        
+        Args:
+            instance_id: 审批实例ID
+            expected: 钉钉侧的字段哈希
+            index: 已加载的主表记录索引（可选，用于判断记录是否存在）
+            
+        Returns:
+            实例摘要，主表记录不存在或没有写入状态时返回None
+        """
+        if index and index.get(instance_id) is None:
+            return None
+        written = self.state_store.field_hashes(instance_id) if self.state_store else None
+        if written is None:
+            return None
+        return content_hash(sorted({field: written.get(field) for field in expected}.items()))
+    
+    def log_sync_summary(self, stats: Dict[str, int]):
+        """
+        输出同步统计日志
+        
+        Args:
+            stats: 同步统计信息
+        """
         logger.info(f"同步完成: 总计={stats['total']}, 成功={stats['success']}, 失败={stats['failed']}")
+        conn_stats = self.dingtalk_client.get_connection_stats()
+        logger.info(f"钉钉连接统计: 请求={conn_stats['requests']}, 新建连接={conn_stats['opened']}, 复用连接={conn_stats['reused']}")
+        if self.dingtalk_client.detail_cache:
+            cache_stats = self.dingtalk_client.detail_cache.get_stats()
+            logger.info(f"详情缓存统计: 命中={cache_stats['hits']}, 未命中={cache_stats['misses']}, 条目={cache_stats['entries']}")
+        for name, cache in (('用户', self.dingtalk_client.user_cache), ('部门', self.dingtalk_client.dept_cache)):
+            cache_stats = cache.get_stats()
+            if cache_stats['hits'] or cache_stats['misses']:
+                logger.info(f"{name}缓存统计: 命中={cache_stats['hits']}, 未命中={cache_stats['misses']}, 条目={cache_stats['entries']}")
+        if self.write_limiter:
+            limiter_stats = self.write_limiter.get_stats()
+            logger.info(f"飞书写入并发: 窗口={limiter_stats['window']}, 峰值={limiter_stats['peak']}, "
+                        f"请求={limiter_stats['requests']}, 限流={limiter_stats['rate_limited']}, "
+                        f"平均延迟={limiter_stats['latency_ms']}ms")
+    
+    def log_pipeline_stats(self, pipeline: Pipeline):
+        """
+        输出流水线各阶段统计日志：利用率接近100%、队列长期积压的阶段是瓶颈
+        （列表等待长说明钉钉分页慢，写入阶段忙碌说明在等飞书写入缓冲）
+        
+        Args:
+            pipeline: 已关闭的流水线
+        """
+        for name, item in pipeline.get_stats().items():
+            if 'workers' not in item:
+                logger.info(f"流水线 {name}: 条数={item['items']}, 等待={item['busy_seconds']}s")
+                continue
+            logger.info(f"流水线 {name}: 线程={item['workers']}, 处理={item['processed']}, 失败={item['failed']}, "
+                        f"忙碌={item['busy_seconds']}s(利用率 {item['utilization']:.0%}), "
+                        f"队列={item['queue_depth']}/{item['queue_size']}(峰值 {item['max_depth']})")
+        if self.writer:
+            writer_stats = self.writer.get_stats()
+            logger.info(f"流水线 feishu: 线程={writer_stats['workers']}, 批次={writer_stats['batches']}, "
+                        f"忙碌={writer_stats['busy_seconds']}s, "
+                        f"缓冲={writer_stats['pending']}/{writer_stats['max_pending']}(峰值 {writer_stats['peak_pending']})")
+    
+    def reset_lookup_cache_stats(self):
+        """重置用户/部门缓存的命中统计，使统计按次运行"""
+        self.dingtalk_client.user_cache.reset_stats()
+        self.dingtalk_client.dept_cache.reset_stats()
+    
+    def save_lookup_caches(self):
+        """持久化用户/部门缓存"""
+        self.dingtalk_client.user_cache.save()
+        self.dingtalk_client.dept_cache.save()
+    
+    def replay_write_journal(self) -> Dict[str, int]:
+        """
+        重新写入上次运行中写入失败或未写出的审批实例
+        
+        Returns:
+            重写的统计信息
+        """
+        stats = self.new_stats()
+        if not self.writer:
+            return stats
+        stats['total'] = self.writer.replay(stats)
+        self.writer.drain(stats)
         return stats
     
+    def save_write_state(self):
+        """保存主表记录索引快照、实例和任务写入状态、写入日志（回调同步与定时同步可能同时保存）"""
+        with self._save_lock:
+            if self.record_index:
+                self.record_index.save()
+            if self.state_store:
+                self.state_store.save()
+            if self.task_store:
+                self.task_store.save()
+            if self.hot_set:
+                self.hot_set.save()
+            if self.writer:
+                self.writer.save_journal()
+    
     def send_notification(self, message: str):
         """
         发送通知（飞书机器人）
@@ -298,7 +1326,8 @@ class SyncManager:
     def run(self, start_time: Optional[datetime] = None, 
             end_time: Optional[datetime] = None,
             init_mode: bool = False,
-            full_check: bool = False):
+            full_check: bool = False,
+            exit_on_error: bool = True) -> bool:
         """
         运行同步任务
         
@@ -307,8 +1336,21 @@ class SyncManager:
             end_time: 结束时间（可选）
             init_mode: 是否为初始化模式（全量同步）
             full_check: 是否为全量校验
+            exit_on_error: 失败时是否退出进程（常驻模式下为False）
+            
+        Returns:
+            是否成功
         """
         try:
+            reconcile = full_check and self.reconcile_config.get('enabled', True)
+            self.force_write = full_check and not reconcile
+            self.reset_lookup_cache_stats()
+            if self.record_index:
+                self.record_index.maybe_reconcile()
+            circuit_breaker = self.dingtalk_client.retry_policy.circuit_breaker
+            breaker_trips = circuit_breaker.trips if circuit_breaker else 0
+            replay_stats = self.replay_write_journal()
+            
             # 确定时间范围
             if init_mode:
                 # 初始化模式：同步最近7天
@@ -319,7 +1361,7 @@ class SyncManager:
                 # 全量校验：同步最近30天
                 end_time = datetime.now()
                 start_time = end_time - timedelta(days=30)
-                logger.info("全量校验模式：同步最近30天数据")
+                logger.info("全量校验模式：对账最近30天数据" if reconcile else "全量校验模式：同步最近30天数据")
             elif not start_time or not end_time:
                 # 增量同步：从上次检查点到当前
                 last_sync_time = self.checkpoint_manager.load_checkpoint()
@@ -336,10 +1378,26 @@ class SyncManager:
                 
                 end_time = datetime.now()
             
-            # 执行同步
+            # 执行同步（配置了多个审批模板时并发同步）
             start = datetime.now()
-            stats = self.sync_instances(start_time, end_time)
+            template_stats = {}
+            report = None
+            if reconcile:
+                stats, report = self.reconcile_range(start_time, end_time)
+            elif self.templates:
+                stats, template_stats = self.sync_templates(start_time, end_time)
+            else:
+                stats = self.sync_instances(start_time, end_time)
+            self.merge_stats(stats, replay_stats)
+            hot_stats = self.poll_hot_set()
+            self.merge_stats(stats, hot_stats)
             elapsed = (datetime.now() - start).total_seconds()
+            self.save_lookup_caches()
+            self.save_write_state()
+            
+            # 运行期间发生熔断时，熔断后的实例均未同步，不推进检查点，下次从原位置重跑
+            if circuit_breaker and circuit_breaker.trips > breaker_trips:
+                raise Exception(f"钉钉接口不可用，熔断后提前结束（已成功 {stats['success']} 条，失败 {stats['failed']} 条），检查点未更新")
             
             # 保存检查点
             self.checkpoint_manager.save_checkpoint(end_time.strftime('%Y-%m-%d %H:%M:%S'))
@@ -352,17 +1410,183 @@ class SyncManager:
 成功: {stats['success']} 条
 失败: {stats['failed']} 条
 主表更新: {stats['main_updated']} 条
+主表跳过（无变化）: {stats['main_skipped']} 条
 明细表新增: {stats['action_inserted']} 条
+明细表更新: {stats['action_updated']} 条
+明细表跳过（无变化）: {stats['action_skipped']} 条
+明细表失败: {stats['action_failed']} 条
 耗时: {elapsed:.2f} 秒
 """
+            if report:
+                message += (f"对账: 分桶 {report['buckets']} 个，不一致 {len(report['mismatched_buckets'])} 个，"
+                            f"飞书缺失 {len(report['missing'])} 条，内容不同 {len(report['changed'])} 条，"
+                            f"列表失败 {len(report['failed_buckets'])} 个\n")
+            if self.hot_set:
+                message += f"活跃实例复查: {hot_stats['total']} 条（集合共 {self.hot_set.size()} 条）\n"
+            if template_stats:
+                message += "\n各模板统计:\n"
+                for process_code, item in template_stats.items():
+                    message += f"- {process_code}: 总计 {item['total']} 条, 成功 {item['success']} 条, 失败 {item['failed']} 条\n"
             self.send_notification(message)
             
             logger.info("同步任务完成")
+            return True
             
         except Exception as e:
+            # 已新增的记录需要写入快照，否则下次运行会重复新增；已写入的内容哈希同样保存
+            self.save_write_state()
             error_msg = f"同步任务失败: {e}"
             logger.error(error_msg)
             self.send_notification(error_msg)
+            if exit_on_error:
+                sys.exit(1)
+            return False
+    
+    def run_daemon(self, interval: Optional[float] = None, callback: bool = False):
+        """
+        常驻运行：按 sync.daemon 配置的间隔重复执行增量同步，直到收到 SIGTERM/SIGINT
+        
+        各轮共享同一个同步管理器，访问令牌、连接池、用户/部门缓存、主表记录索引和
+        写入状态都留在内存中，不需要每轮重新加载。活跃实例集合由后台线程按
+        sync.hot_set.poll_interval_seconds 复查。启用事件回调时审批变更由回调及时同步，
+        定时同步改为 callback.poll_interval_seconds 的低频兜底。
+        
+        Args:
+            interval: 调度间隔（秒，默认使用 sync.daemon.interval_seconds）
+            callback: 是否同时启动钉钉事件回调服务
+        """
+        daemon_config = self.config.get('sync', {}).get('daemon', {})
+        default_interval = daemon_config.get('interval_seconds', 300)
+        if callback:
+            default_interval = self.config.get('callback', {}).get('poll_interval_seconds', 3600)
+        scheduler = SyncScheduler(
+            lambda: self.run(exit_on_error=False),
+            interval=interval or default_interval,
+            jitter=daemon_config.get('jitter_seconds', 30),
+            lock_file=daemon_config.get('lock_file', 'state/sync_daemon.lock') or None
+        )
+        scheduler.install_signal_handlers()
+        # 活跃实例按自己的间隔在后台复查，不受增量同步间隔影响
+        hot_scheduler = None
+        if self.hot_set:
+            hot_scheduler = SyncScheduler(self.poll_hot_set, interval=self.hot_poll_interval, name='活跃实例复查')
+        hot_thread = None
+        try:
+            if callback:
+                self.start_callback_server()
+            if hot_scheduler:
+                hot_thread = threading.Thread(target=hot_scheduler.run_forever, name='hot-set', daemon=True)
+                hot_thread.start()
+            scheduler.run_forever()
+        finally:
+            if hot_thread:
+                hot_scheduler.stop()
+                hot_thread.join()
+            self.close()
+    
+    def start_callback_server(self):
+        """按 callback 配置启动钉钉事件回调服务和审批实例工作队列"""
+        callback_config = self.config.get('callback', {})
+        for key in ('token', 'aes_key'):
+            if not callback_config.get(key):
+                raise Exception(f"缺少事件回调配置: callback.{key}")
+        crypto = DingTalkCallbackCrypto(
+            callback_config['token'],
+            callback_config['aes_key'],
+            callback_config.get('owner_key') or self.config['dingtalk']['app_key']
+        )
+        self.callback_queue = InstanceWorkQueue(
+            self.sync_callback_instances,
+            debounce=callback_config.get('debounce_seconds', 1.0),
+            batch_size=callback_config.get('batch_size', 100),
+            max_retries=callback_config.get('max_retries', 3),
+            retry_delay=callback_config.get('retry_delay_seconds', 5.0),
+            on_give_up=self.track_unsynced
+        )
+        self.callback_server = CallbackServer(
+            crypto,
+            self.callback_queue,
+            host=callback_config.get('host', '0.0.0.0'),
+            port=callback_config.get('port', 8080),
+            path=callback_config.get('path', '/dingtalk/callback'),
+            process_codes={template['process_code'] for template in self.templates} or None,
+            max_clock_skew=callback_config.get('max_clock_skew_seconds', 300),
+            max_body_size=callback_config.get('max_body_bytes', 64 * 1024)
+        )
+        self.callback_queue.start()
+        self.callback_server.start()
+    
+    def sync_callback_instances(self, instance_ids: List[str]) -> List[str]:
+        """
+        同步事件回调中的一批审批实例
+
+        Args:
+            instance_ids: 审批实例ID列表
+
+        Returns:
+            同步失败、需要重试的审批实例ID列表
+        """
+        failed_ids: List[str] = []
+        self.sync_instance_ids(instance_ids, failed_ids)
+        return failed_ids
+    
+    def track_unsynced(self, instance_ids: List[str]):
+        """
+        回调同步多次失败的审批实例加入活跃实例集合，由定时复查继续重试
+
+        Args:
+            instance_ids: 审批实例ID列表
+        """
+        if not self.hot_set:
+            logger.warning(f"未启用活跃实例集合，{len(instance_ids)} 条审批实例留待定时同步: {instance_ids[:10]}")
+            return
+        for instance_id in instance_ids:
+            self.hot_set.track(instance_id, None)
+        self.hot_set.save()
+    
+    def stop_callback_server(self):
+        """停止接收回调，同步完队列中剩余的审批实例"""
+        if self.callback_server:
+            self.callback_server.shutdown()
+            self.callback_server = None
+        if self.callback_queue:
+            self.callback_queue.close()
+            queue_stats = self.callback_queue.get_stats()
+            logger.info(f"事件回调统计: 事件={queue_stats['received']}, 合并={queue_stats['deduplicated']}, "
+                        f"同步={queue_stats['synced']}, 重试={queue_stats['retried']}, 失败={queue_stats['failed']}")
+            self.callback_queue = None
+    
+    def close(self):
+        """停止事件回调，写完缓冲中的数据并保存状态，关闭连接"""
+        self.stop_callback_server()
+        if self.writer:
+            self.writer.close()
+        self.save_write_state()
+        self.save_lookup_caches()
+        self.dingtalk_client.close()
+    
+    def run_shard_retry(self):
+        """重试失败分片（不更新检查点）"""
+        try:
+            start = datetime.now()
+            stats = self.retry_failed_shards()
+            elapsed = (datetime.now() - start).total_seconds()
+            self.save_write_state()
+            
+            message = f"""钉钉审批失败分片重试完成
+
+总计: {stats['total']} 条
+成功: {stats['success']} 条
+失败: {stats['failed']} 条
+耗时: {elapsed:.2f} 秒
+"""
+            self.send_notification(message)
+            logger.info("分片重试完成")
+        except Exception as e:
+            self.save_write_state()
+            error_msg = f"分片重试失败: {e}"
+            logger.error(error_msg)
+            self.send_notification(error_msg)
             sys.exit(1)
 
 
@@ -374,6 +1598,10 @@ def main():
     parser.add_argument('--full-check', action='store_true', help='全量校验模式（同步最近30天）')
     parser.add_argument('--start-time', help='开始时间（格式：YYYY-MM-DD HH:MM:SS）')
     parser.add_argument('--end-time', help='结束时间（格式：YYYY-MM-DD HH:MM:SS）')
+    parser.add_argument('--retry-failed-shards', action='store_true', help='单独重试此前失败的时间分片')
+    parser.add_argument('--daemon', action='store_true', help='常驻模式（按 sync.daemon 配置的间隔重复增量同步）')
+    parser.add_argument('--interval', type=float, help='常驻模式的调度间隔（秒，覆盖配置）')
+    parser.add_argument('--callback', action='store_true', help='常驻模式下启动钉钉事件回调服务（定时同步改为低频兜底）')
     
     args = parser.parse_args()
     
@@ -397,6 +1625,17 @@ def main():
     
     # 创建同步管理器并运行
     sync_manager = SyncManager(config_path=args.config)
+    if args.retry_failed_shards:
+        sync_manager.run_shard_retry()
+        return
+    if args.daemon or args.callback:
+        try:
+            callback = args.callback or sync_manager.config.get('callback', {}).get('enabled', False)
+            sync_manager.run_daemon(interval=args.interval, callback=callback)
+        except Exception as e:
+            logger.error(f"常驻同步启动失败: {e}")
+            sys.exit(1)
+        return
     sync_manager.run(
         start_time=start_time,
         end_time=end_time,
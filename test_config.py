@@ -88,8 +88,7 @@ def check_dependencies() -> bool:
     required_packages = {
         'requests': 'HTTP请求库',
         'yaml': 'YAML配置文件解析',
-        'dateutil': '日期时间处理',
-        'tenacity': '重试机制'
+        'dateutil': '日期时间处理'
     }
     
     missing_packages = []
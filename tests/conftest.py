@@ -0,0 +1,30 @@
+"""测试公共设置
+
+feishu_toolkit 为内部依赖，未安装时注入占位模块，使 sync.py 可以导入；
+SyncManager 的测试在 tests/test_sync.py 中替换为内存版多维表格客户端，不访问线上接口。
+"""
+
+import sys
+import os
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+try:
+    import feishu_toolkit  # noqa: F401
+except ImportError:
+    feishu_toolkit = types.ModuleType('feishu_toolkit')
+
+    class TenantAuth:
+        def __init__(self, app_id, app_secret, base_url=None):
+            self.app_id = app_id
+            self.app_secret = app_secret
+            self.base_url = base_url
+
+    class BitableClient:
+        def __init__(self, auth):
+            raise RuntimeError("测试中应替换为内存版多维表格客户端")
+
+    feishu_toolkit.TenantAuth = TenantAuth
+    feishu_toolkit.BitableClient = BitableClient
+    sys.modules['feishu_toolkit'] = feishu_toolkit
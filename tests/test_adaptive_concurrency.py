@@ -0,0 +1,92 @@
+"""adaptive_concurrency.py 单元测试"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from adaptive_concurrency import AdaptiveBitableClient, AdaptiveConcurrencyLimiter, is_feishu_rate_limited
+
+
+class FeishuError(Exception):
+    def __init__(self, code):
+        super().__init__(f"code={code}")
+        self.code = code
+
+
+class TestRateLimitClassification:
+    def test_codes_and_status(self):
+        assert is_feishu_rate_limited(FeishuError(99991400))
+        assert is_feishu_rate_limited(Exception("请求失败: 1254290 TooManyRequest"))
+        assert not is_feishu_rate_limited(FeishuError(1254045))
+        assert not is_feishu_rate_limited(Exception("connection reset"))
+
+
+class TestAdaptiveConcurrencyLimiter:
+    def test_additive_increase_only_when_saturated(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=4)
+        # 窗口未占满：不增长
+        limiter.release(limiter.acquire())
+        assert limiter.limit == 2
+
+        for _ in range(10):
+            started = [limiter.acquire() for _ in range(int(limiter.limit))]
+            for value in started:
+                limiter.release(value)
+        assert limiter.limit == 4
+
+    def test_multiplicative_decrease_once_per_round(self, monkeypatch):
+        clock = [100.0]
+        monkeypatch.setattr('adaptive_concurrency.time.monotonic', lambda: clock[0])
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8, max_limit=8)
+        started = limiter.acquire()
+        clock[0] += 1.0
+        limiter.release(started)  # 平均延迟 1 秒
+
+        started = [limiter.acquire() for _ in range(3)]
+        for value in started:
+            clock[0] += 0.1
+            limiter.release(value, 'rate_limited')
+        assert limiter.limit == 4
+        clock[0] += 1.0
+        limiter.release(limiter.acquire(), 'rate_limited')
+        assert limiter.limit == 2
+
+        stats = limiter.get_stats()
+        assert stats['window'] == 2
+        assert stats['rate_limited'] == 4
+        assert stats['decreases'] == 2
+
+
+class FakeBitable:
+    def __init__(self, rate_limited_times=0):
+        self.rate_limited_times = rate_limited_times
+        self.calls = 0
+
+    def batch_create_records(self, app_token, table_id, records):
+        self.calls += 1
+        if self.rate_limited_times:
+            self.rate_limited_times -= 1
+            raise FeishuError(99991400)
+        return records
+
+    def list_records(self, app_token, table_id):
+        return {'items': []}
+
+
+class TestAdaptiveBitableClient:
+    def test_retries_rate_limited_writes(self, monkeypatch):
+        monkeypatch.setattr('adaptive_concurrency.time.sleep', lambda seconds: None)
+        bitable = FakeBitable(rate_limited_times=2)
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+        client = AdaptiveBitableClient(bitable, limiter, rate_limit_retries=3)
+        assert client.batch_create_records('app', 'tbl', [1]) == [1]
+        assert bitable.calls == 3
+        assert limiter.get_stats()['rate_limited'] == 2
+
+    def test_reads_pass_through(self):
+        bitable = FakeBitable()
+        limiter = AdaptiveConcurrencyLimiter()
+        client = AdaptiveBitableClient(bitable, limiter)
+        assert client.list_records('app', 'tbl') == {'items': []}
+        assert limiter.get_stats()['requests'] == 0
@@ -0,0 +1,123 @@
+"""async_dingtalk_client.py 单元测试（本地 aiohttp 服务模拟钉钉接口）"""
+
+import asyncio
+import sys
+import os
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+web = pytest.importorskip('aiohttp.web')
+
+from async_dingtalk_client import AsyncDingTalkClient
+from detail_cache import DetailCache
+from dingtalk_client import DingTalkClient
+from retry_policy import RetryPolicy
+
+
+class FakeDingTalkServer:
+    """令牌过期返回40014、指定实例先返回502的钉钉接口"""
+
+    def __init__(self, flaky=()):
+        self.calls = Counter()
+        self.flaky = set(flaky)
+        self.token = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        app = web.Application()
+        app.router.add_get('/gettoken', self.gettoken)
+        app.router.add_get('/topapi/processinstance/get', self.detail)
+        self.runner = web.AppRunner(app)
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(5)
+
+    async def _start(self):
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def gettoken(self, request):
+        self.calls['gettoken'] += 1
+        await asyncio.sleep(0.05)
+        self.token = f"fresh-{self.calls['gettoken']}"
+        return web.json_response({'errcode': 0, 'access_token': self.token, 'expires_in': 7200})
+
+    async def detail(self, request):
+        instance_id = request.query['process_instance_id']
+        self.calls['detail'] += 1
+        if request.query['access_token'] != self.token:
+            return web.json_response({'errcode': 40014, 'errmsg': '不合法的access_token'})
+        if instance_id in self.flaky:
+            self.flaky.discard(instance_id)
+            return web.Response(status=502)
+        await asyncio.sleep(0.01)
+        return web.json_response({'errcode': 0, 'process_instance': {
+            'process_instance_id': instance_id, 'status': 'FINISHED', 'result': 'agree',
+            'title': f"审批 {instance_id}", 'extra_field': 'x'}})
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+@pytest.fixture
+def server():
+    server = FakeDingTalkServer(flaky={'flaky'})
+    yield server
+    server.close()
+
+
+def _client(server, **kwargs):
+    client = DingTalkClient('key', 'secret', base_url=server.url,
+                            retry_policy=RetryPolicy(base_delay=0.01, max_delay=0.02), **kwargs)
+    # 令牌在本地看来仍有效，服务端已作废
+    client._access_token = 'stale'
+    client._token_expires_at = time.time() + 7000
+    return client
+
+
+async def _fetch_all(async_client, instance_ids):
+    try:
+        return await asyncio.gather(*(async_client.get_process_instance_detail(instance_id)
+                                      for instance_id in instance_ids))
+    finally:
+        await async_client.close()
+
+
+class TestAsyncDingTalkClient:
+    def test_token_expiry_refreshed_once_for_all_coroutines(self, server):
+        client = _client(server)
+        instance_ids = [f"inst{k}" for k in range(50)]
+        details = asyncio.run(_fetch_all(AsyncDingTalkClient(client, limit=20), instance_ids))
+        assert [detail['process_instance_id'] for detail in details] == instance_ids
+        assert server.calls['gettoken'] == 1
+        # 同步客户端的线程拿到的也是协程刷新后的令牌
+        assert client.get_access_token() == 'fresh-1'
+        client.close()
+
+    def test_transient_errors_retried_with_shared_policy(self, server):
+        client = _client(server)
+        details = asyncio.run(_fetch_all(AsyncDingTalkClient(client), ['flaky', 'ok']))
+        assert [detail['process_instance_id'] for detail in details] == ['flaky', 'ok']
+        # 首次40014刷新令牌后重试，flaky 再遇到502退避后重试
+        assert server.calls['detail'] == 5
+        client.close()
+
+    def test_terminal_details_served_from_shared_cache(self, server, tmp_path):
+        client = _client(server, detail_cache=DetailCache(str(tmp_path / 'details')))
+        async_client = AsyncDingTalkClient(client)
+        asyncio.run(_fetch_all(async_client, ['inst0']))
+        requests_made = server.calls['detail']
+        # 第二次运行使用新的事件循环，会话随之重建；终态详情直接读缓存
+        cached, fresh = asyncio.run(_fetch_all(async_client, ['inst0', 'inst1']))
+        assert (cached['process_instance_id'], fresh['process_instance_id']) == ('inst0', 'inst1')
+        assert server.calls['detail'] == requests_made + 1
+        assert client.get_process_instance_detail('inst0') == cached
+        assert server.calls['detail'] == requests_made + 1
+        client.close()
@@ -0,0 +1,217 @@
+"""bitable_batch.py 单元测试"""
+
+import sys
+import os
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from adaptive_concurrency import AdaptiveBitableClient, AdaptiveConcurrencyLimiter
+from bitable_batch import ActionRecordBatcher, MainRecordBatcher, field_text, is_batch_error
+
+
+class FeishuError(Exception):
+    def __init__(self, message, code=None, status_code=None):
+        super().__init__(message)
+        self.code = code
+        self.status_code = status_code
+
+
+class FakeBitable:
+    def __init__(self, fail_batches=False, bad_value=None, batch_error=None):
+        self.fail_batches = fail_batches
+        self.bad_value = bad_value
+        self.batch_error = batch_error or Exception("batch failed")
+        self.batches = []
+        self.updates = []
+        self.singles = []
+
+    def batch_create_records(self, app_token, table_id, records):
+        if self.fail_batches:
+            raise self.batch_error
+        self.batches.append(records)
+        return [dict(record, record_id=f"rec{len(self.batches)}_{i}") for i, record in enumerate(records)]
+
+    def batch_update_records(self, app_token, table_id, records):
+        self.updates.append(records)
+        return records
+
+    def upsert_record(self, app_token, table_id, record_id, fields):
+        if fields.get('node') == self.bad_value:
+            raise Exception("bad record")
+        self.singles.append(fields)
+        return {'record_id': 'rec'}
+
+
+class TestActionRecordBatcher:
+    def test_batches_across_instances(self):
+        bitable = FakeBitable()
+        batcher = ActionRecordBatcher(bitable, 'app', 'tbl', batch_size=4)
+        stats_a, stats_b = {}, {}
+        batcher.add('a', [{'node': i} for i in range(3)], stats_a)
+        assert bitable.batches == []
+        batcher.add('b', [{'node': i} for i in range(3)], stats_b)
+        assert [len(batch) for batch in bitable.batches] == [4]
+        assert batcher.pending_count() == 2
+
+        batcher.flush()
+        assert [len(batch) for batch in bitable.batches] == [4, 2]
+        assert stats_a == {'action_inserted': 3}
+        assert stats_b == {'action_inserted': 3}
+
+    def test_batch_size_capped_at_limit(self):
+        assert ActionRecordBatcher(FakeBitable(), 'app', 'tbl', batch_size=1000).batch_size == 500
+
+    def test_none_fields_dropped(self):
+        bitable = FakeBitable()
+        batcher = ActionRecordBatcher(bitable, 'app', 'tbl')
+        batcher.add('a', [{'node': 1, 'comment': None}])
+        batcher.flush()
+        assert bitable.batches == [[{'fields': {'node': 1}}]]
+
+    def test_updates_and_written_callback(self):
+        bitable = FakeBitable()
+        written = []
+        batcher = ActionRecordBatcher(bitable, 'app', 'tbl',
+                                      on_written=lambda *args: written.append(args[:3]))
+        stats = {}
+        batcher.add('a', [{'node': 1}, {'node': 2}], stats, fingerprints=['f1', 'f2'], record_ids=[None, 'old2'])
+        batcher.record_skipped(stats, 3)
+        batcher.flush()
+        assert bitable.batches == [[{'fields': {'node': 1}}]]
+        assert bitable.updates == [[{'record_id': 'old2', 'fields': {'node': 2}}]]
+        assert stats == {'action_inserted': 1, 'action_updated': 1, 'action_skipped': 3}
+        assert written == [('a', 'f1', 'rec1_0'), ('a', 'f2', 'old2')]
+
+    def test_failed_batch_falls_back_per_record(self):
+        bitable = FakeBitable(fail_batches=True, bad_value=1)
+        batcher = ActionRecordBatcher(bitable, 'app', 'tbl')
+        stats = {}
+        batcher.add('a', [{'node': i} for i in range(3)], stats)
+        batcher.flush()
+        assert len(bitable.singles) == 2
+        assert stats == {'action_inserted': 2, 'action_failed': 1}
+
+    def test_rate_limited_batch_not_split(self):
+        bitable = FakeBitable(fail_batches=True, batch_error=FeishuError("too many requests", code=1254290))
+        written, failed = [], []
+        batcher = ActionRecordBatcher(bitable, 'app', 'tbl', on_written=lambda *args: written.append(args),
+                                      on_failed=lambda *args: failed.append(args))
+        stats = {}
+        batcher.add('a', [{'node': i} for i in range(3)], stats, fingerprints=['f0', 'f1', 'f2'])
+        batcher.flush()
+        assert bitable.singles == []
+        assert stats == {'action_failed': 3}
+        assert written == []
+        assert failed == [('a', 'f0', {'node': 0}), ('a', 'f1', {'node': 1}), ('a', 'f2', {'node': 2})]
+
+
+class FakeMainBitable:
+    def __init__(self, bad_key=None, transient_failures=0, outage=None):
+        self.bad_key = bad_key
+        self.transient_failures = transient_failures
+        self.outage = outage
+        self.calls = []
+
+    def _check(self, records):
+        if self.outage:
+            raise self.outage
+        if self.transient_failures:
+            self.transient_failures -= 1
+            raise Exception("temporary")
+        if self.bad_key and any(record['fields'].get('instance_id') == self.bad_key for record in records):
+            raise Exception("invalid field")
+
+    def batch_create_records(self, app_token, table_id, records):
+        self.calls.append(('create', len(records)))
+        self._check(records)
+        return records
+
+    def batch_update_records(self, app_token, table_id, records):
+        self.calls.append(('update', len(records)))
+        self.updated = records
+        self._check(records)
+        return records
+
+
+class TestMainRecordBatcher:
+    @staticmethod
+    def _rows(n):
+        return [{'instance_id': f"i{k}", 'title': f"t{k}"} for k in range(n)]
+
+    def test_split_create_and_update(self):
+        bitable = FakeMainBitable()
+        batcher = MainRecordBatcher(bitable, 'app', 'tbl', resolver=lambda ids: {'i0': 'rec0', 'i2': 'rec2'})
+        results = batcher.upsert(self._rows(4))
+        assert results == {'i0': None, 'i1': None, 'i2': None, 'i3': None}
+        assert bitable.calls == [('update', 2), ('create', 2)]
+
+    def test_update_sends_only_changed_fields(self):
+        bitable = FakeMainBitable()
+        batcher = MainRecordBatcher(bitable, 'app', 'tbl', resolver=lambda ids: {'i0': 'rec0'})
+        batcher.upsert(self._rows(2), changes={'i0': {'title': 'new'}, 'i1': {'title': 'new'}})
+        assert bitable.updated == [{'record_id': 'rec0', 'fields': {'title': 'new'}}]
+        assert bitable.calls == [('update', 1), ('create', 1)]
+
+    def test_retry_at_batch_granularity(self, monkeypatch):
+        monkeypatch.setattr('bitable_batch.time.sleep', lambda seconds: None)
+        bitable = FakeMainBitable(transient_failures=1)
+        batcher = MainRecordBatcher(bitable, 'app', 'tbl', resolver=lambda ids: {})
+        assert all(error is None for error in batcher.upsert(self._rows(3)).values())
+        assert bitable.calls == [('create', 3), ('create', 3)]
+
+    def test_bad_row_bisected_out(self, monkeypatch):
+        monkeypatch.setattr('bitable_batch.time.sleep', lambda seconds: None)
+        bitable = FakeMainBitable(bad_key='i5')
+        batcher = MainRecordBatcher(bitable, 'app', 'tbl', resolver=lambda ids: {}, max_retries=2)
+        results = batcher.upsert(self._rows(8))
+        assert [key for key, error in results.items() if error] == ['i5']
+        assert sum(1 for error in results.values() if error is None) == 7
+
+    def test_outage_fails_batch_without_bisecting(self, monkeypatch):
+        monkeypatch.setattr('bitable_batch.time.sleep', lambda seconds: None)
+        for outage in (FeishuError("internal error", status_code=500),
+                       requests.ConnectionError("connection reset")):
+            bitable = FakeMainBitable(outage=outage)
+            batcher = MainRecordBatcher(bitable, 'app', 'tbl', resolver=lambda ids: {}, max_retries=2)
+            results = batcher.upsert(self._rows(8))
+            assert all(results.values())
+            assert bitable.calls == [('create', 8), ('create', 8)]
+
+    def test_rate_limit_retried_only_by_adaptive_client(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr('bitable_batch.time.sleep', sleeps.append)
+        monkeypatch.setattr('adaptive_concurrency.time.sleep', lambda seconds: None)
+        bitable = FakeMainBitable(outage=FeishuError("too many requests", status_code=429))
+        client = AdaptiveBitableClient(bitable, AdaptiveConcurrencyLimiter(), rate_limit_retries=2)
+        batcher = MainRecordBatcher(client, 'app', 'tbl', resolver=lambda ids: {}, max_retries=3)
+        results = batcher.upsert(self._rows(8))
+        assert all(results.values())
+        # 只有自适应客户端的一次首发加两次退避重试，批量写入器不再重试也不拆批
+        assert bitable.calls == [('create', 8)] * 3
+        assert sleeps == []
+
+    def test_resolver_failure_fails_all_rows(self):
+        def resolver(ids):
+            raise Exception("search failed")
+        batcher = MainRecordBatcher(FakeMainBitable(), 'app', 'tbl', resolver=resolver)
+        results = batcher.upsert(self._rows(2))
+        assert all(results.values())
+
+
+def test_is_batch_error():
+    assert is_batch_error(FeishuError("limited", status_code=429))
+    assert is_batch_error(FeishuError("frequency limit", code=99991400))
+    assert is_batch_error(FeishuError("server", status_code=502))
+    assert is_batch_error(FeishuError("write conflict", code=1254291))
+    assert is_batch_error(requests.ConnectionError("reset"))
+    assert is_batch_error(requests.Timeout("timeout"))
+    assert not is_batch_error(FeishuError("TextFieldConvFail", code=1254060))
+    assert not is_batch_error(FeishuError("bad request", status_code=400))
+    assert not is_batch_error(Exception("invalid field"))
+
+
+def test_field_text():
+    assert field_text([{'type': 'text', 'text': 'PROC-'}, {'type': 'text', 'text': '1'}]) == 'PROC-1'
+    assert field_text('plain') == 'plain'
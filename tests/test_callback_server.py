@@ -0,0 +1,244 @@
+"""callback_server.py 单元测试"""
+
+import sys
+import os
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from callback_server import (CallbackServer, Cipher, DingTalkCallbackCrypto, InstanceWorkQueue,
+                             build_event_request, instance_event)
+
+requires_crypto = pytest.mark.skipif(Cipher is None, reason="需要 cryptography")
+
+AES_KEY = 'abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG'
+
+
+class RecordingQueue:
+    def __init__(self):
+        self.added = []
+
+    def add(self, instance_id):
+        self.added.append(instance_id)
+        return True
+
+
+@requires_crypto
+class TestDingTalkCallbackCrypto:
+    def test_round_trip(self):
+        crypto = DingTalkCallbackCrypto('token', AES_KEY, 'appkey')
+        message = json.dumps({'EventType': 'bpms_instance_change', 'title': '请假'}, ensure_ascii=False)
+        assert crypto.decrypt(crypto.encrypt(message)) == message
+
+    def test_signature_and_owner_checked(self):
+        crypto = DingTalkCallbackCrypto('token', AES_KEY, 'appkey')
+        reply = crypto.encrypted_reply('success', '1700000000000', 'nonce')
+        assert crypto.verify(reply['msg_signature'], '1700000000000', 'nonce', reply['encrypt'])
+        assert not crypto.verify(reply['msg_signature'], '1700000000001', 'nonce', reply['encrypt'])
+        other = DingTalkCallbackCrypto('token', AES_KEY, 'other')
+        with pytest.raises(Exception):
+            other.decrypt(reply['encrypt'])
+
+    def test_invalid_key(self):
+        with pytest.raises(Exception):
+            DingTalkCallbackCrypto('token', 'short', 'appkey')
+
+
+@requires_crypto
+class TestCallbackServer:
+    def _server(self, work_queue, process_codes=None):
+        crypto = DingTalkCallbackCrypto('token', AES_KEY, 'appkey')
+        return crypto, CallbackServer(crypto, work_queue, host='127.0.0.1', port=0, process_codes=process_codes)
+
+    def test_instance_events_queued(self):
+        work_queue = RecordingQueue()
+        crypto, server = self._server(work_queue, process_codes={'PROC-1'})
+        try:
+            for event in (instance_event('i1', process_code='PROC-1'),
+                          instance_event('i2', 'bpms_task_change', 'start', process_code='PROC-1'),
+                          instance_event('i3', process_code='PROC-2'),
+                          {'EventType': 'check_url'}):
+                query, body = build_event_request(crypto, event)
+                status, reply = server.handle(query, body)
+                assert status == 200
+                assert crypto.decrypt(reply['encrypt']) == 'success'
+        finally:
+            server.httpd.server_close()
+        assert work_queue.added == ['i1', 'i2']
+
+    def test_bad_signature_rejected(self):
+        work_queue = RecordingQueue()
+        crypto, server = self._server(work_queue)
+        try:
+            query, body = build_event_request(crypto, instance_event('i1'))
+            query['msg_signature'] = '0' * 40
+            assert server.handle(query, body)[0] == 403
+        finally:
+            server.httpd.server_close()
+        assert work_queue.added == []
+
+    def test_stale_timestamp_rejected(self):
+        work_queue = RecordingQueue()
+        crypto, server = self._server(work_queue)
+        try:
+            stale = str(int((time.time() - 600) * 1000))
+            query, body = build_event_request(crypto, instance_event('i1'), timestamp=stale)
+            assert server.handle(query, body) == (403, {'error': 'expired timestamp'})
+            query, body = build_event_request(crypto, instance_event('i2'), timestamp='not-a-number')
+            assert server.handle(query, body)[0] == 403
+            query, body = build_event_request(crypto, instance_event('i3'))
+            assert server.handle(query, body)[0] == 200
+        finally:
+            server.httpd.server_close()
+        assert work_queue.added == ['i3']
+
+    def test_oversized_body_rejected(self):
+        work_queue = RecordingQueue()
+        crypto, server = self._server(work_queue)
+        server.start()
+        try:
+            url = f"http://127.0.0.1:{server.port}{server.path}"
+            query, body = build_event_request(crypto, instance_event('i1'))
+            body['padding'] = 'x' * 65 * 1024
+            response = requests.post(url, params=query, json=body, timeout=5)
+            assert response.status_code == 413
+        finally:
+            server.shutdown()
+        assert work_queue.added == []
+
+    def test_http_round_trip(self):
+        synced = []
+        work_queue = InstanceWorkQueue(synced.extend, debounce=0.05)
+        crypto, server = self._server(work_queue)
+        work_queue.start()
+        server.start()
+        try:
+            url = f"http://127.0.0.1:{server.port}{server.path}"
+            for instance_id in ['i1', 'i1', 'i2']:
+                query, body = build_event_request(crypto, instance_event(instance_id))
+                response = requests.post(url, params=query, json=body, timeout=5)
+                assert response.status_code == 200
+        finally:
+            server.shutdown()
+            work_queue.close()
+        assert sorted(synced) == ['i1', 'i2']
+
+
+class TestInstanceWorkQueue:
+    def test_duplicates_merged_within_debounce(self):
+        batches = []
+        work_queue = InstanceWorkQueue(batches.append, debounce=0.1)
+        work_queue.start()
+        assert work_queue.add('a')
+        assert not work_queue.add('a')
+        assert work_queue.add('b')
+        work_queue.close()
+        assert batches == [['a', 'b']]
+        assert work_queue.get_stats() == {'received': 3, 'deduplicated': 1, 'synced': 2, 'retried': 0, 'failed': 0,
+                                            'pending': 0}
+
+    def test_event_during_sync_requeues(self):
+        started = threading.Event()
+        release = threading.Event()
+        batches = []
+
+        def sync(ids):
+            batches.append(list(ids))
+            if len(batches) == 1:
+                started.set()
+                release.wait()
+
+        work_queue = InstanceWorkQueue(sync, debounce=0)
+        work_queue.start()
+        work_queue.add('a')
+        assert started.wait(5)
+        work_queue.add('a')
+        work_queue.add('a')
+        release.set()
+        deadline = time.monotonic() + 5
+        while work_queue.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        work_queue.close()
+        assert batches == [['a'], ['a']]
+
+    def test_failed_batch_retried_with_backoff(self):
+        calls = []
+
+        def sync(ids):
+            calls.append((list(ids), time.monotonic()))
+            if len(calls) < 3:
+                raise Exception("boom")
+
+        work_queue = InstanceWorkQueue(sync, debounce=0, max_retries=3, retry_delay=0.05)
+        work_queue.start()
+        work_queue.add('a')
+        deadline = time.monotonic() + 5
+        while work_queue.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        work_queue.close()
+        assert [ids for ids, _ in calls] == [['a'], ['a'], ['a']]
+        # 第二次重试的等待时间翻倍
+        assert calls[1][1] - calls[0][1] >= 0.05
+        assert calls[2][1] - calls[1][1] >= 0.1
+        stats = work_queue.get_stats()
+        assert (stats['synced'], stats['retried'], stats['failed']) == (1, 2, 0)
+
+    def test_only_returned_failures_retried(self):
+        batches = []
+
+        def sync(ids):
+            batches.append(list(ids))
+            return ['b'] if len(batches) == 1 else []
+
+        work_queue = InstanceWorkQueue(sync, debounce=0, retry_delay=0.01)
+        work_queue.start()
+        work_queue.add('a')
+        work_queue.add('b')
+        deadline = time.monotonic() + 5
+        while work_queue.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        work_queue.close()
+        assert batches == [['a', 'b'], ['b']]
+        stats = work_queue.get_stats()
+        assert (stats['synced'], stats['retried'], stats['failed']) == (2, 1, 0)
+
+    def test_given_up_after_max_retries(self):
+        calls = []
+        given_up = []
+
+        def sync(ids):
+            calls.append(list(ids))
+            raise Exception("boom")
+
+        work_queue = InstanceWorkQueue(sync, debounce=0, max_retries=2, retry_delay=0.01,
+                                       on_give_up=given_up.extend)
+        work_queue.start()
+        work_queue.add('a')
+        work_queue.add('b')
+        deadline = time.monotonic() + 5
+        while work_queue.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        work_queue.close()
+        assert calls == [['a', 'b']] * 3
+        assert sorted(given_up) == ['a', 'b']
+        stats = work_queue.get_stats()
+        assert (stats['retried'], stats['failed'], stats['pending']) == (4, 2, 0)
+
+    def test_failures_retried_before_close(self):
+        calls = []
+
+        def sync(ids):
+            calls.append(list(ids))
+            raise Exception("boom")
+
+        work_queue = InstanceWorkQueue(sync, debounce=0, max_retries=1, retry_delay=60)
+        work_queue.start()
+        work_queue.add('a')
+        work_queue.close()
+        assert calls == [['a'], ['a']]
+        assert work_queue.get_stats()['failed'] == 1
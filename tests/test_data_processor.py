@@ -128,3 +128,15 @@ class TestProcessInstanceActions:
     def test_empty_tasks(self):
         actions = DataProcessor.process_instance_actions({"process_instance_id": "x", "tasks": []})
         assert actions == []
+
+    def test_fingerprints_match_actions(self):
+        task = {"task_name": "部门审批", "userid": "u1", "action_type": "EXECUTE_TASK_NORMAL",
+                "create_time": 1705285800000}
+        instance = {"process_instance_id": "test-001", "tasks": [task, dict(task), dict(task, userid="u2")]}
+        fingerprints = DataProcessor.action_fingerprints(instance)
+        assert len(fingerprints) == len(DataProcessor.process_instance_actions(instance))
+        assert len(set(fingerprints)) == 3
+        assert fingerprints[1] == fingerprints[0] + "#2"
+        # 完成时间、审批意见变化不影响指纹
+        changed = dict(task, finish_time=1705286400000, comment="同意")
+        assert DataProcessor.action_fingerprints({"process_instance_id": "test-001", "tasks": [changed]})[0] == fingerprints[0]
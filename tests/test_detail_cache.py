@@ -0,0 +1,56 @@
+"""detail_cache.py 单元测试"""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import json_codec
+from detail_cache import DetailCache
+
+
+class TestDetailCache:
+    def test_terminal_detail_cached(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = DetailCache(tmp)
+            detail = {"process_instance_id": "a", "status": "FINISHED", "title": "报销"}
+            assert cache.put("a", detail) is True
+            assert cache.get("a") == detail
+            assert cache.get_stats()["hits"] == 1
+
+    def test_running_detail_not_cached(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = DetailCache(tmp)
+            assert cache.put("a", {"status": "RUNNING"}) is False
+            assert cache.get("a") is None
+            assert cache.get_stats()["misses"] == 1
+
+    def test_projection_change_misses_old_entries(self, tmp_path, monkeypatch):
+        cache = DetailCache(str(tmp_path))
+        detail = {"process_instance_id": "a", "status": "FINISHED"}
+        cache.put("a", detail)
+        # 关闭裁剪或调整字段列表后，裁剪过的旧详情不再命中
+        monkeypatch.setattr(json_codec, '_project_detail', False)
+        assert cache.get("a") is None
+        monkeypatch.setattr(json_codec, '_project_detail', True)
+        monkeypatch.setattr(json_codec, 'TASK_FIELDS', json_codec.TASK_FIELDS + ('remark',))
+        assert cache.get("a") is None
+        monkeypatch.undo()
+        assert cache.get("a") == detail
+
+    def test_persisted_across_instances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            DetailCache(tmp).put("a", {"status": "REVOKED"})
+            assert DetailCache(tmp).get("a") == {"status": "REVOKED"}
+
+    def test_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = DetailCache(tmp, max_entries=2)
+            cache.put("a", {"status": "FINISHED"})
+            cache.put("b", {"status": "FINISHED"})
+            cache.get("a")
+            cache.put("c", {"status": "FINISHED"})
+            assert cache.get("b") is None
+            assert cache.get("a") is not None
+            assert cache.get_stats()["entries"] == 2
@@ -0,0 +1,235 @@
+"""dingtalk_client.py 单元测试"""
+
+import json
+import sys
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dingtalk_client import ConnectionStats, DingTalkClient
+from token_cache import TokenCache
+
+
+class TestConnectionStats:
+    def test_reused_is_requests_minus_opened(self):
+        stats = ConnectionStats()
+        for _ in range(5):
+            stats.record_request()
+        stats.record_open()
+        assert stats.snapshot() == {'requests': 5, 'opened': 1, 'reused': 4}
+
+    def test_empty(self):
+        assert ConnectionStats().snapshot() == {'requests': 0, 'opened': 0, 'reused': 0}
+
+    def test_keep_alive_reuses_one_connection(self):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                body = json.dumps({'errcode': 0, 'process_instance': {'status': 'RUNNING'}}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            client = DingTalkClient("key", "secret", base_url=f"http://127.0.0.1:{server.server_port}")
+            client._access_token = 'token'
+            client._token_expires_at = time.time() + 7200
+            for k in range(5):
+                assert client.get_process_instance_detail(f"inst{k}") == {'status': 'RUNNING'}
+            assert client.get_connection_stats() == {'requests': 5, 'opened': 1, 'reused': 4}
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestSession:
+    def test_default_headers(self):
+        client = DingTalkClient("key", "secret")
+        assert client.session.headers['Connection'] == 'keep-alive'
+        assert 'gzip' in client.session.headers['Accept-Encoding']
+
+    def test_disable_keep_alive_and_gzip(self):
+        client = DingTalkClient("key", "secret", keep_alive=False, gzip=False)
+        assert client.session.headers['Connection'] == 'close'
+        assert client.session.headers['Accept-Encoding'] == 'identity'
+
+    def test_pool_settings(self):
+        client = DingTalkClient("key", "secret", pool_maxsize=8)
+        adapter = client.session.get_adapter("https://oapi.dingtalk.com")
+        assert adapter._pool_maxsize == 8
+
+
+class TestIterProcessInstances:
+    @staticmethod
+    def _client_with_pages(pages):
+        client = DingTalkClient("key", "secret")
+        calls = []
+
+        def fake_get_process_instances(start_time, end_time, process_code=None,
+                                       statuses=None, cursor=0, size=20):
+            calls.append(cursor)
+            index = cursor // size
+            return {
+                'list': pages[index] if index < len(pages) else [],
+                'has_more': index + 1 < len(pages),
+                'next_cursor': cursor + size
+            }
+
+        client.get_process_instances = fake_get_process_instances
+        return client, calls
+
+    def test_walks_all_pages(self):
+        pages = [[{'process_instance_id': 'a'}], [{'process_instance_id': 'b'}], [{'process_instance_id': 'c'}]]
+        for prefetch in (0, 1, 3):
+            client, calls = self._client_with_pages(pages)
+            result = list(client.iter_process_instances("0", "1", size=1, prefetch=prefetch))
+            assert result == pages
+            assert calls == [0, 1, 2]
+
+    def test_error_propagates(self):
+        client = DingTalkClient("key", "secret")
+
+        def failing(**kwargs):
+            raise RuntimeError("boom")
+
+        client.get_process_instances = failing
+        try:
+            list(client.iter_process_instances("0", "1", prefetch=2))
+            assert False, "列表请求失败应抛出异常"
+        except RuntimeError:
+            pass
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self.reason = 'OK'
+        self.content = json.dumps(data).encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeTokenSession:
+    """模拟 /gettoken 和业务接口：携带 stale 令牌的请求返回 40014"""
+
+    def __init__(self, stale_requests=0):
+        self.gettoken_calls = 0
+        self._lock = threading.Lock()
+        # 所有线程都用旧令牌发出请求后才返回 40014，保证过期同时被并发发现
+        self._stale_barrier = threading.Barrier(stale_requests) if stale_requests else None
+
+    def get(self, url, params=None, timeout=None):
+        with self._lock:
+            self.gettoken_calls += 1
+            token = f"fresh-{self.gettoken_calls}"
+        time.sleep(0.05)
+        return FakeResponse({'errcode': 0, 'access_token': token, 'expires_in': 7200})
+
+    def request(self, method, url, params=None, json=None, timeout=None):
+        if params['access_token'] == 'stale':
+            if self._stale_barrier:
+                self._stale_barrier.wait(timeout=5)
+            return FakeResponse({'errcode': 40014, 'errmsg': 'invalid access_token'})
+        return FakeResponse({'errcode': 0, 'result': params['access_token']})
+
+    def close(self):
+        pass
+
+
+def _client(session, token_cache=None):
+    client = DingTalkClient("key", "secret", token_cache=token_cache)
+    client.session = session
+    return client
+
+
+class TestAccessToken:
+    def test_concurrent_token_expired_refreshes_once(self):
+        threads_count = 8
+        session = FakeTokenSession(stale_requests=threads_count)
+        client = _client(session)
+        client._access_token = 'stale'
+        client._token_expires_at = time.time() + 7000
+        results = []
+
+        def call():
+            results.append(client._request("GET", "/topapi/x", "detail", "测试接口")['result'])
+
+        threads = [threading.Thread(target=call) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert session.gettoken_calls == 1
+        assert results == ['fresh-1'] * threads_count
+
+    def test_token_shared_between_processes_via_cache(self, tmp_path):
+        cache_file = str(tmp_path / 'token.json')
+        session = FakeTokenSession()
+        first = _client(session, TokenCache(cache_file, 'key'))
+        second = _client(session, TokenCache(cache_file, 'key'))
+        assert first.get_access_token() == 'fresh-1'
+        assert second.get_access_token() == 'fresh-1'
+        assert session.gettoken_calls == 1
+
+    def test_token_refreshed_by_other_process_while_waiting_for_lock(self, tmp_path):
+        session = FakeTokenSession()
+        token_cache = TokenCache(str(tmp_path / 'token.json'), 'key')
+        other_process_cache = TokenCache(str(tmp_path / 'token.json'), 'key')
+        acquire = token_cache.refresh_lock
+
+        @contextmanager
+        def contended_lock():
+            # 等待跨进程锁期间，另一个进程完成了刷新
+            other_process_cache.save('other-process', time.time() + 7000)
+            with acquire():
+                yield
+
+        token_cache.refresh_lock = contended_lock
+        client = _client(session, token_cache)
+        assert client.get_access_token() == 'other-process'
+        assert session.gettoken_calls == 0
+
+    def test_background_refresher_renews_before_safety_margin(self):
+        session = FakeTokenSession()
+        client = _client(session)
+        client._access_token = 'old'
+        # 剩余有效期已进入 安全边界 + 提前量 范围，但请求仍可使用
+        client._token_expires_at = time.time() + DingTalkClient.TOKEN_SAFETY_MARGIN + 100
+        client.start_token_refresher(lead_seconds=300, check_interval=0.05)
+        try:
+            deadline = time.time() + 5
+            while session.gettoken_calls == 0 and time.time() < deadline:
+                time.sleep(0.01)
+            assert session.gettoken_calls == 1
+            deadline = time.time() + 5
+            while client._access_token != 'fresh-1' and time.time() < deadline:
+                time.sleep(0.01)
+            assert client.get_access_token() == 'fresh-1'
+        finally:
+            client.stop_token_refresher()
+        assert session.gettoken_calls == 1
+
+    def test_background_refresher_idle_while_token_fresh(self):
+        session = FakeTokenSession()
+        client = _client(session)
+        client._access_token = 'current'
+        client._token_expires_at = time.time() + 7000
+        client.start_token_refresher(lead_seconds=300, check_interval=0.05)
+        time.sleep(0.2)
+        client.stop_token_refresher()
+        assert session.gettoken_calls == 0
+        assert client._refresher_thread is None
@@ -0,0 +1,133 @@
+"""feishu_writer.py 单元测试"""
+
+import json
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from feishu_writer import WriteBehindWriter
+
+
+class RecordingSink:
+    def __init__(self, fail_ids=(), block=None):
+        self.fail_ids = set(fail_ids)
+        self.block = block
+        self.batches = []
+        self.flushes = 0
+
+    def write(self, items, stats):
+        if self.block:
+            self.block.wait()
+        self.batches.append([item[0] for item in items])
+        failed = [item[0] for item in items if item[0] in self.fail_ids]
+        stats['success'] += len(items) - len(failed)
+        stats['failed'] += len(failed)
+        return failed
+
+    def flush(self):
+        self.flushes += 1
+
+
+def _item(instance_id, title='t'):
+    return (instance_id, {'instance_id': instance_id, 'title': title}, [], [])
+
+
+class TestWriteBehindWriter:
+    def test_batches_and_merges_stats_on_drain(self):
+        sink = RecordingSink()
+        writer = WriteBehindWriter(sink.write, sink.flush, batch_size=3, flush_interval=60, workers=1)
+        stats = {'success': 0}
+        for k in range(4):
+            writer.submit(_item(f"i{k}"), stats)
+        writer.drain(stats)
+        assert sink.batches == [['i0', 'i1', 'i2'], ['i3']]
+        assert sink.flushes >= 1
+        assert stats == {'success': 4, 'failed': 0}
+        writer.close()
+
+    def test_coalesces_same_instance(self):
+        sink = RecordingSink()
+        writer = WriteBehindWriter(sink.write, batch_size=10, flush_interval=60, workers=1)
+        stats = {}
+        writer.submit(_item('i1', 'old'), stats)
+        writer.submit(_item('i1', 'new'), stats)
+        writer.drain(stats)
+        assert sink.batches == [['i1']]
+        assert stats['coalesced'] == 1
+        assert stats['success'] == 2
+        writer.close()
+
+    def test_backpressure_blocks_submit_when_full(self):
+        release = threading.Event()
+        sink = RecordingSink(block=release)
+        writer = WriteBehindWriter(sink.write, batch_size=1, flush_interval=60, max_pending=1, workers=1)
+        writer.submit(_item('i0'))  # 写入线程取走后阻塞在 write 中
+        writer.submit(_item('i1'))  # 占满缓冲区
+
+        blocked = threading.Thread(target=writer.submit, args=(_item('i2'),))
+        blocked.start()
+        blocked.join(0.2)
+        assert blocked.is_alive()
+        release.set()
+        blocked.join(5)
+        assert not blocked.is_alive()
+        writer.close()
+        assert sorted(sum(sink.batches, [])) == ['i0', 'i1', 'i2']
+
+    def test_failed_rows_are_journaled_and_replayed(self, tmp_path):
+        journal_file = str(tmp_path / 'journal.json')
+        writer = WriteBehindWriter(RecordingSink(fail_ids={'i1'}).write, flush_interval=60,
+                                   journal_file=journal_file)
+        writer.submit(_item('i0'))
+        writer.submit(_item('i1'))
+        writer.close()
+        assert os.path.exists(journal_file)
+
+        sink = RecordingSink()
+        replayed = WriteBehindWriter(sink.write, flush_interval=60, journal_file=journal_file)
+        assert replayed.journal_size() == 1
+        stats = {}
+        assert replayed.replay(stats) == 1
+        replayed.drain(stats)
+        replayed.close()
+        assert sink.batches == [['i1']]
+        assert stats == {'success': 1, 'failed': 0}
+        assert not os.path.exists(journal_file)
+
+    def test_action_failures_during_write_stay_journaled(self, tmp_path):
+        journal_file = str(tmp_path / 'journal.json')
+        writer = None
+
+        def write(items, stats):
+            # 主表写入成功，明细缓冲攒满后在写入过程中失败
+            for item in items:
+                writer.journal_actions(item[0], [{'node': 1}], ['f1'])
+                writer.journal_actions(item[0], [{'node': 1}, {'node': 2}], ['f1', 'f2'])
+            return []
+
+        writer = WriteBehindWriter(write, flush_interval=60, journal_file=journal_file)
+        writer.submit(_item('i0'))
+        writer.close()
+        with open(journal_file, encoding='utf-8') as f:
+            assert json.load(f) == [['i0', None, [{'node': 1}, {'node': 2}], ['f1', 'f2']]]
+
+        sink = RecordingSink()
+        replayed = WriteBehindWriter(sink.write, flush_interval=60, journal_file=journal_file)
+        assert replayed.journal_size() == 1
+        replayed.replay()
+        replayed.close()
+        assert sink.batches == [['i0']]
+        assert not os.path.exists(journal_file)
+
+    def test_action_only_item_keeps_buffered_main_data(self):
+        items = []
+        writer = WriteBehindWriter(lambda batch, stats: items.extend(batch) or [], flush_interval=60, workers=1)
+        writer.submit(('i0', None, [{'node': 1}], ['f1']))
+        writer.submit(('i0', None, [{'node': 2}], ['f2']))
+        writer.drain()
+        writer.submit(_item('i1'))
+        writer.submit(('i1', None, [{'node': 1}], ['f1']))
+        writer.close()
+        assert items == [('i0', None, [{'node': 1}, {'node': 2}], ['f1', 'f2']), _item('i1')]
@@ -0,0 +1,78 @@
+"""json_codec.py 单元测试"""
+
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import json_codec
+from data_processor import DataProcessor
+
+RESPONSE = json.dumps({
+    "errcode": 0,
+    "errmsg": "ok",
+    "request_id": "r1",
+    "process_instance": {
+        "process_instance_id": "test-001",
+        "title": "出差审批",
+        "status": "FINISHED",
+        "originator_user_name": "张三",
+        "create_time": 1705285800000,
+        "operation_records": [{"remark": "不需要的字段"}],
+        "form_component_values": [{"name": "金额", "value": "5,000", "ext_value": "{}"}],
+        "tasks": [{"task_name": "部门审批", "user_name": "李四", "action_type": "EXECUTE_TASK_NORMAL",
+                   "finish_time": 1705286400000, "url": "https://example.com"}],
+    },
+}, ensure_ascii=False).encode('utf-8')
+
+
+def _installed_backends():
+    modules = {'orjson': json_codec.orjson, 'msgspec': json_codec.msgspec, 'json': json}
+    return [name for name in json_codec.BACKENDS if modules[name] is not None]
+
+
+class TestDecodeDetailResponse:
+    def teardown_method(self):
+        json_codec.configure()
+
+    def test_projection_drops_unused_fields(self):
+        for backend in _installed_backends():
+            json_codec.configure(backend=backend, project_detail=True)
+            data = json_codec.decode_detail_response(RESPONSE)
+            detail = data['process_instance']
+            assert data['errcode'] == 0
+            assert 'operation_records' not in detail
+            assert 'url' not in detail['tasks'][0]
+            assert 'ext_value' not in detail['form_component_values'][0]
+            assert detail['title'] == "出差审批"
+
+    def test_transform_unchanged_by_projection(self):
+        json_codec.configure(backend='json', project_detail=False)
+        expected = DataProcessor.process_instance_main(json_codec.decode_detail_response(RESPONSE)['process_instance'])
+        for backend in _installed_backends():
+            json_codec.configure(backend=backend, project_detail=True)
+            detail = json_codec.decode_detail_response(RESPONSE)['process_instance']
+            assert DataProcessor.process_instance_main(detail) == expected
+
+    def test_no_projection_keeps_payload(self):
+        json_codec.configure(backend='json', project_detail=False)
+        detail = json_codec.decode_detail_response(RESPONSE)['process_instance']
+        assert 'operation_records' in detail
+
+
+class TestConfigure:
+    def teardown_method(self):
+        json_codec.configure()
+
+    def test_unknown_backend(self):
+        try:
+            json_codec.configure(backend='simdjson')
+            assert False, "不支持的后端应抛出异常"
+        except ValueError:
+            pass
+
+    def test_loads(self):
+        for backend in _installed_backends():
+            json_codec.configure(backend=backend)
+            assert json_codec.loads(b'{"errcode": 0}') == {"errcode": 0}
@@ -0,0 +1,54 @@
+"""lookup_cache.py 单元测试"""
+
+import sys
+import os
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lookup_cache import TTLCache
+
+
+class TestTTLCache:
+    def test_hit_and_miss(self):
+        cache = TTLCache()
+        assert cache.lookup("u1") == (False, None)
+        cache.set("u1", {"name": "张三"})
+        assert cache.lookup("u1") == (True, {"name": "张三"})
+        assert cache.get_stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+    def test_negative_cache(self):
+        cache = TTLCache()
+        cache.set("bad", None)
+        assert cache.lookup("bad") == (True, None)
+
+    def test_expiry(self):
+        cache = TTLCache(ttl=0.01, negative_ttl=0.01)
+        cache.set("u1", {"name": "张三"})
+        time.sleep(0.02)
+        assert cache.lookup("u1") == (False, None)
+        assert cache.contains("u1") is False
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.lookup("a")
+        cache.set("c", 3)
+        assert cache.contains("a")
+        assert not cache.contains("b")
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "users.json")
+            cache = TTLCache(persist_file=path)
+            cache.set("u1", {"name": "张三"})
+            cache.save()
+            assert TTLCache(persist_file=path).lookup("u1") == (True, {"name": "张三"})
+
+    def test_reset_stats(self):
+        cache = TTLCache()
+        cache.lookup("x")
+        cache.reset_stats()
+        assert cache.get_stats()["misses"] == 0
@@ -0,0 +1,167 @@
+"""pipeline.py 单元测试"""
+
+import asyncio
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pipeline import Pipeline, PipelineGroup
+
+
+class TestPipeline:
+    def test_items_flow_through_stages(self):
+        results = []
+        with Pipeline() \
+                .add_stage('double', lambda x: x * 2, workers=3) \
+                .add_stage('collect', results.append) as pipeline:
+            group = PipelineGroup()
+            for i in range(20):
+                pipeline.put(i, group)
+            group.wait()
+        assert sorted(results) == [i * 2 for i in range(20)]
+        stats = pipeline.get_stats()
+        assert list(stats) == ['double', 'collect']
+        assert stats['double']['processed'] == 20
+        assert stats['double']['workers'] == 3
+
+    def test_dropped_items_complete_group(self):
+        results = []
+        with Pipeline() \
+                .add_stage('filter', lambda x: x if x % 2 else None) \
+                .add_stage('collect', results.append) as pipeline:
+            group = PipelineGroup()
+            for i in range(10):
+                pipeline.put(i, group)
+            group.wait()
+        assert sorted(results) == [1, 3, 5, 7, 9]
+
+    def test_errors_counted_per_group(self):
+        errors = []
+
+        def parse(value):
+            return int(value)
+
+        with Pipeline().add_stage('parse', parse, on_error=lambda item, e: errors.append(item)) as pipeline:
+            group = PipelineGroup()
+            for value in ['1', 'x', '3', 'y']:
+                pipeline.put(value, group)
+            group.wait()
+        assert group.failed == 2
+        assert sorted(errors) == ['x', 'y']
+        assert pipeline.get_stats()['parse']['failed'] == 2
+
+    def test_batch_stage_receives_lists(self):
+        batches = []
+        release = threading.Event()
+
+        def slow(x):
+            release.wait()
+            return x
+
+        with Pipeline() \
+                .add_stage('slow', slow, queue_size=10) \
+                .add_stage('batch', lambda items: batches.append(list(items)), batch_size=4, queue_size=10) as pipeline:
+            group = PipelineGroup()
+            for i in range(8):
+                pipeline.put(i, group)
+            release.set()
+            group.wait()
+        assert sorted(x for batch in batches for x in batch) == list(range(8))
+        assert all(len(batch) <= 4 for batch in batches)
+
+    def test_bounded_queue_blocks_producer(self):
+        release = threading.Event()
+        pipeline = Pipeline().add_stage('blocked', lambda x: release.wait(), queue_size=2)
+        pipeline.start()
+        produced = []
+
+        def produce():
+            for i in range(5):
+                pipeline.put(i)
+                produced.append(i)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        time.sleep(0.2)
+        # 1条在处理中，2条在队列中，生产者阻塞在第4条
+        assert len(produced) == 3
+        assert pipeline.get_stats()['blocked']['queue_depth'] == 2
+        release.set()
+        producer.join(timeout=5)
+        pipeline.close()
+        assert len(produced) == 5
+        assert pipeline.get_stats()['blocked']['max_depth'] == 2
+
+    def test_record_source(self):
+        with Pipeline().add_stage('noop', lambda x: None) as pipeline:
+            pipeline.record_source('list', 0.5, 10)
+            pipeline.record_source('list', 0.25, 5)
+        assert pipeline.get_stats()['list'] == {'items': 15, 'busy_seconds': 0.75}
+
+
+class TestAsyncStage:
+    def test_many_coroutines_on_one_thread(self):
+        in_flight = peak = 0
+        threads = set()
+        results = []
+
+        async def fetch(x):
+            nonlocal in_flight, peak
+            threads.add(threading.get_ident())
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            if x == 13:
+                raise ValueError("bad item")
+            return x * 2
+
+        closed = []
+
+        async def on_stop():
+            closed.append(True)
+
+        with Pipeline() \
+                .add_async_stage('fetch', fetch, concurrency=50, on_stop=on_stop) \
+                .add_stage('collect', results.append) as pipeline:
+            group = PipelineGroup()
+            for i in range(100):
+                pipeline.put(i, group)
+            group.wait()
+        assert sorted(results) == [i * 2 for i in range(100) if i != 13]
+        assert group.failed == 1
+        assert len(threads) == 1 and peak == 50
+        assert closed == [True]
+        stats = pipeline.get_stats()['fetch']
+        assert (stats['processed'], stats['failed'], stats['workers']) == (99, 1, 50)
+
+    def test_concurrency_limit_keeps_backpressure(self):
+        release = threading.Event()
+
+        async def blocked(x):
+            await asyncio.get_running_loop().run_in_executor(None, release.wait)
+
+        pipeline = Pipeline().add_async_stage('blocked', blocked, concurrency=2, queue_size=2)
+        pipeline.start()
+        produced = []
+
+        def produce():
+            for i in range(6):
+                pipeline.put(i)
+                produced.append(i)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            time.sleep(0.3)
+            # 2条在处理中（并发已满时不再取数），队列中2条，生产者阻塞在第5条
+            assert len(produced) == 4
+            assert pipeline.get_stats()['blocked']['queue_depth'] == 2
+        finally:
+            release.set()
+        producer.join(timeout=5)
+        pipeline.close()
+        assert len(produced) == 6
@@ -0,0 +1,58 @@
+"""rate_limiter.py 单元测试"""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rate_limiter import RateLimiter, TokenBucket
+
+
+class TestTokenBucket:
+    def test_first_request_not_delayed(self):
+        bucket = TokenBucket(rate=10)
+        assert bucket.reserve() == 0.0
+
+    def test_requests_are_paced_evenly(self):
+        bucket = TokenBucket(rate=10)
+        delays = [bucket.reserve() for _ in range(4)]
+        assert delays[0] == 0.0
+        # 每个后续请求比前一个多等待约 1/rate 秒
+        for prev, cur in zip(delays, delays[1:]):
+            assert abs((cur - prev) - 0.1) < 0.01
+
+    def test_burst(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        delays = [bucket.reserve() for _ in range(4)]
+        assert delays[:3] == [0.0, 0.0, 0.0]
+        assert delays[3] > 0
+
+    def test_invalid_rate(self):
+        try:
+            TokenBucket(rate=0)
+            assert False, "rate=0 应该抛出异常"
+        except ValueError:
+            pass
+
+    def test_shared_state_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, "rate.json")
+            a = TokenBucket(rate=10, name="app:detail", state_file=state_file)
+            b = TokenBucket(rate=10, name="app:detail", state_file=state_file)
+            assert a.reserve() == 0.0
+            # 另一个实例（模拟另一个进程）共享同一个时间槽序列
+            assert b.reserve() > 0.05
+
+
+class TestRateLimiter:
+    def test_unconfigured_endpoint_not_limited(self):
+        limiter = RateLimiter({"detail": 10})
+        assert limiter.reserve("list") == 0.0
+        assert limiter.reserve("list") == 0.0
+
+    def test_endpoints_independent(self):
+        limiter = RateLimiter({"detail": 10, "list": 10})
+        limiter.reserve("detail")
+        assert limiter.reserve("list") == 0.0
+        assert limiter.reserve("detail") > 0
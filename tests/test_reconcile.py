@@ -0,0 +1,68 @@
+"""reconcile.py 单元测试"""
+
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from reconcile import DigestTree, compare_trees, list_field_hashes, save_report
+from state_store import content_hash
+
+
+def build_tree(buckets):
+    tree = DigestTree()
+    for (template, day), leaves in buckets.items():
+        tree.add_bucket(template, day)
+        for instance_id, leaf in leaves.items():
+            tree.add(template, day, instance_id, leaf)
+    return tree
+
+
+class TestListFieldHashes:
+    def test_status_mapped_and_missing_fields_skipped(self):
+        hashes = list_field_hashes({'status': 'FINISHED', 'result': 'agree'})
+        assert set(hashes) == {'status'}
+        assert hashes['status'] == content_hash('已同意')
+
+    def test_none_value(self):
+        assert list_field_hashes({'title': None}) == {'title': None}
+        assert list_field_hashes({'title': ''}) == {'title': content_hash('')}
+
+
+class TestCompareTrees:
+    def test_identical_trees(self):
+        buckets = {('PROC-1', '2025-01-01'): {'a': 'h1', 'b': 'h2'}, ('PROC-1', '2025-01-02'): {}}
+        report = compare_trees(build_tree(buckets), build_tree(buckets))
+        assert report['source_digest'] == report['target_digest']
+        assert report['buckets'] == 2
+        assert report['compared_buckets'] == 0
+        assert report['missing'] == report['changed'] == report['extra'] == []
+
+    def test_only_mismatched_buckets_expanded(self):
+        source = build_tree({
+            ('PROC-1', '2025-01-01'): {'a': 'h1', 'b': 'h2', 'c': 'h3'},
+            ('PROC-1', '2025-01-02'): {'d': 'h4'},
+            ('PROC-2', '2025-01-01'): {'e': 'h5'},
+        })
+        target = build_tree({
+            ('PROC-1', '2025-01-01'): {'a': 'h1', 'b': 'stale', 'c': None},
+            ('PROC-1', '2025-01-02'): {'d': 'h4'},
+            ('PROC-2', '2025-01-01'): {'e': 'h5', 'x': 'h9'},
+        })
+        report = compare_trees(source, target)
+        assert report['compared_buckets'] == 2
+        assert report['missing'] == ['c']
+        assert report['changed'] == ['b']
+        assert report['extra'] == ['x']
+        assert report['mismatched_buckets'] == [
+            {'template': 'PROC-1', 'day': '2025-01-01', 'instances': 2},
+            {'template': 'PROC-2', 'day': '2025-01-01', 'instances': 1},
+        ]
+
+
+def test_save_report(tmp_path):
+    report_file = str(tmp_path / 'state' / 'report.json')
+    save_report({'missing': ['a']}, report_file)
+    with open(report_file, encoding='utf-8') as f:
+        assert json.load(f) == {'missing': ['a']}
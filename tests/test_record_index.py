@@ -0,0 +1,83 @@
+"""record_index.py 单元测试"""
+
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from record_index import RecordIndex
+
+
+class FakeBitable:
+    def __init__(self, records, page_size=2):
+        self.records = records
+        self.page_size = page_size
+        self.list_calls = 0
+
+    def list_records(self, app_token, table_id, page_token=None, page_size=500):
+        self.list_calls += 1
+        start = int(page_token or 0)
+        items = [{'record_id': record_id, 'fields': {'instance_id': key}}
+                 for key, record_id in self.records[start:start + self.page_size]]
+        has_more = start + self.page_size < len(self.records)
+        return {'items': items, 'has_more': has_more, 'page_token': str(start + self.page_size) if has_more else None}
+
+
+class TestRecordIndex:
+    def test_bulk_load_pages_whole_table(self):
+        bitable = FakeBitable([('a', 'rec1'), ('b', 'rec2'), ('c', 'rec3')])
+        index = RecordIndex(bitable, 'app', 'tbl')
+        assert index.ensure_loaded()
+        assert bitable.list_calls == 2
+        assert index.resolve(['a', 'c', 'x']) == {'a': 'rec1', 'c': 'rec3'}
+        index.ensure_loaded()
+        assert bitable.list_calls == 2
+
+    def test_rich_text_key(self):
+        bitable = FakeBitable([])
+        bitable.list_records = lambda *args, **kwargs: {
+            'items': [{'record_id': 'rec1', 'fields': {'instance_id': [{'type': 'text', 'text': 'a'}]}}],
+            'has_more': False}
+        index = RecordIndex(bitable, 'app', 'tbl')
+        index.ensure_loaded()
+        assert index.get('a') == 'rec1'
+
+    def test_snapshot_reused_and_updated_on_create(self, tmp_path):
+        snapshot_file = str(tmp_path / 'index.json')
+        bitable = FakeBitable([('a', 'rec1')])
+        index = RecordIndex(bitable, 'app', 'tbl', snapshot_file=snapshot_file)
+        index.ensure_loaded()
+        index.set('b', 'rec2')
+        index.save()
+
+        reloaded = RecordIndex(bitable, 'app', 'tbl', snapshot_file=snapshot_file)
+        assert reloaded.ensure_loaded()
+        assert bitable.list_calls == 1
+        assert reloaded.resolve(['a', 'b']) == {'a': 'rec1', 'b': 'rec2'}
+
+    def test_expired_snapshot_reconciled(self, tmp_path):
+        snapshot_file = tmp_path / 'index.json'
+        snapshot_file.write_text(json.dumps({'table': 'app/tbl', 'reconciled_at': 0, 'records': {'gone': 'rec9'}}))
+        bitable = FakeBitable([('a', 'rec1')])
+        index = RecordIndex(bitable, 'app', 'tbl', snapshot_file=str(snapshot_file))
+        index.ensure_loaded()
+        assert bitable.list_calls == 1
+        assert index.get('gone') is None
+
+    def test_maybe_reconcile_only_after_interval(self):
+        bitable = FakeBitable([('a', 'rec1')])
+        index = RecordIndex(bitable, 'app', 'tbl', reconcile_interval=3600)
+        index.maybe_reconcile()
+        index.maybe_reconcile()
+        assert bitable.list_calls == 1
+        index.reconciled_at -= 3600
+        bitable.records.append(('b', 'rec2'))
+        index.maybe_reconcile()
+        assert index.get('b') == 'rec2'
+
+    def test_load_failure_reported(self):
+        class Broken:
+            def list_records(self, *args, **kwargs):
+                raise Exception("no permission")
+        assert not RecordIndex(Broken(), 'app', 'tbl').ensure_loaded()
@@ -0,0 +1,204 @@
+"""retry_policy.py 单元测试"""
+
+import asyncio
+import sys
+import os
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from retry_policy import (
+    RetryPolicy, CircuitBreaker, CircuitOpenError, DingTalkAPIError,
+    TOKEN_EXPIRED, RATE_LIMITED, TRANSIENT, FATAL,
+)
+
+
+def _no_sleep(monkeypatch):
+    monkeypatch.setattr('retry_policy.time.sleep', lambda seconds: None)
+
+
+class TestClassify:
+    def test_dingtalk_errcodes(self):
+        policy = RetryPolicy()
+        assert policy.classify(DingTalkAPIError("x", 40014)) == TOKEN_EXPIRED
+        assert policy.classify(DingTalkAPIError("x", 90018)) == RATE_LIMITED
+        assert policy.classify(DingTalkAPIError("x", -1)) == TRANSIENT
+        assert policy.classify(DingTalkAPIError("x", 88)) == FATAL
+
+    def test_http_status(self):
+        policy = RetryPolicy()
+        assert policy.classify(DingTalkAPIError("x", None, status_code=429)) == RATE_LIMITED
+        assert policy.classify(DingTalkAPIError("x", None, status_code=502)) == TRANSIENT
+
+    def test_network_errors(self):
+        policy = RetryPolicy()
+        assert policy.classify(requests.ConnectionError()) == TRANSIENT
+        assert policy.classify(requests.Timeout()) == TRANSIENT
+        assert policy.classify(ValueError()) == FATAL
+
+
+class TestCall:
+    def test_single_budget_across_error_kinds(self, monkeypatch):
+        _no_sleep(monkeypatch)
+        errors = [DingTalkAPIError("x", 40014, access_token="t"), DingTalkAPIError("x", 90018),
+                  DingTalkAPIError("x", -1), DingTalkAPIError("x", -1)]
+        calls = []
+
+        def func():
+            calls.append(1)
+            raise errors[len(calls) - 1]
+
+        with pytest.raises(DingTalkAPIError):
+            RetryPolicy(max_attempts=3).call(func)
+        assert len(calls) == 3
+
+    def test_token_expired_refreshes_once(self, monkeypatch):
+        _no_sleep(monkeypatch)
+        invalidated = []
+        calls = []
+
+        def func():
+            calls.append(1)
+            raise DingTalkAPIError("x", 40014, access_token="stale")
+
+        with pytest.raises(DingTalkAPIError):
+            RetryPolicy(max_attempts=5).call(func, on_token_expired=lambda e: invalidated.append(e.access_token))
+        assert len(calls) == 2
+        assert invalidated == ["stale"]
+
+    def test_fatal_not_retried(self):
+        calls = []
+
+        def func():
+            calls.append(1)
+            raise DingTalkAPIError("x", 88)
+
+        with pytest.raises(DingTalkAPIError):
+            RetryPolicy().call(func)
+        assert len(calls) == 1
+
+    def test_rate_limit_waits_at_least_rate_limit_delay(self):
+        policy = RetryPolicy(base_delay=0.01, rate_limit_delay=1.0)
+        assert policy.backoff(1, RATE_LIMITED) >= 1.0
+        assert policy.backoff(1, TRANSIENT) <= 0.01
+
+
+class TestAsyncCall:
+    def test_shares_budget_and_refresh_with_call(self, monkeypatch):
+        delays = []
+
+        async def no_sleep(seconds):
+            delays.append(seconds)
+
+        monkeypatch.setattr('retry_policy.asyncio.sleep', no_sleep)
+        errors = [DingTalkAPIError("x", 40014, access_token="stale"), DingTalkAPIError("x", -1)]
+        invalidated = []
+
+        async def func():
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+
+        async def on_token_expired(error):
+            invalidated.append(error.access_token)
+
+        result = asyncio.run(RetryPolicy(max_attempts=3).acall(func, on_token_expired=on_token_expired))
+        assert result == 'ok'
+        assert invalidated == ['stale'] and len(delays) == 1
+
+    def test_fatal_probe_releases_half_open_state(self, monkeypatch):
+        breaker = TestCircuitBreaker()._half_open(monkeypatch)
+        policy = RetryPolicy(circuit_breaker=breaker)
+
+        async def fatal():
+            raise DingTalkAPIError("x", 88)
+
+        async def ok():
+            return 'ok'
+
+        with pytest.raises(DingTalkAPIError):
+            asyncio.run(policy.acall(fatal))
+        assert asyncio.run(policy.acall(ok)) == 'ok'
+        assert not breaker.is_open
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold_and_fast_fails(self, monkeypatch):
+        _no_sleep(monkeypatch)
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        policy = RetryPolicy(max_attempts=1, circuit_breaker=breaker)
+
+        def failing():
+            raise DingTalkAPIError("x", -1)
+
+        for _ in range(2):
+            with pytest.raises(DingTalkAPIError):
+                policy.call(failing)
+        assert breaker.is_open
+        assert breaker.trips == 1
+        with pytest.raises(CircuitOpenError):
+            policy.call(lambda: 'ok')
+
+    def test_half_open_probe_closes_on_success(self, monkeypatch):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        assert breaker.is_open
+        now = time.time()
+        monkeypatch.setattr('retry_policy.time.time', lambda: now + 11)
+        assert RetryPolicy(circuit_breaker=breaker).call(lambda: 'ok') == 'ok'
+        assert not breaker.is_open
+
+    def test_fatal_errors_do_not_count(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        policy = RetryPolicy(circuit_breaker=breaker)
+        policy.decide(DingTalkAPIError("x", 88), 1, 0)
+        assert not breaker.is_open
+
+    def _half_open(self, monkeypatch):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        now = time.time()
+        monkeypatch.setattr('retry_policy.time.time', lambda: now + 11)
+        return breaker
+
+    def test_fatal_probe_releases_half_open_state(self, monkeypatch):
+        breaker = self._half_open(monkeypatch)
+        policy = RetryPolicy(circuit_breaker=breaker)
+
+        def fatal():
+            raise DingTalkAPIError("x", 88)
+
+        with pytest.raises(DingTalkAPIError):
+            policy.call(fatal)
+        # 试探以业务错误结束：熔断器仍打开，但下一次调用可以继续试探
+        assert breaker.is_open
+        assert policy.call(lambda: 'ok') == 'ok'
+        assert not breaker.is_open
+
+    def test_token_expired_probe_refreshes_without_regating(self, monkeypatch):
+        breaker = self._half_open(monkeypatch)
+        policy = RetryPolicy(circuit_breaker=breaker)
+        calls = []
+
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                raise DingTalkAPIError("x", 40014, access_token="stale")
+            return 'ok'
+
+        assert policy.call(func, on_token_expired=lambda e: None) == 'ok'
+        assert not breaker.is_open
+
+    def test_token_expired_probe_exhausting_refreshes_releases_probe(self, monkeypatch):
+        breaker = self._half_open(monkeypatch)
+        policy = RetryPolicy(circuit_breaker=breaker)
+
+        def expired():
+            raise DingTalkAPIError("x", 40014, access_token="stale")
+
+        with pytest.raises(DingTalkAPIError):
+            policy.call(expired, on_token_expired=lambda e: None)
+        assert policy.call(lambda: 'ok') == 'ok'
@@ -0,0 +1,83 @@
+"""scheduler.py 单元测试"""
+
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scheduler import SyncScheduler, fcntl
+
+
+class TestSyncScheduler:
+    def test_runs_until_max_cycles_and_counts_failures(self):
+        results = iter([True, False, None])
+        scheduler = SyncScheduler(lambda: next(results), interval=0.01)
+        scheduler.run_forever(max_cycles=3)
+        assert scheduler.cycles == 3
+        assert scheduler.failures == 1
+
+    def test_job_exception_does_not_stop_scheduler(self):
+        def job():
+            raise Exception("boom")
+        scheduler = SyncScheduler(job, interval=0.01)
+        scheduler.run_forever(max_cycles=2)
+        assert scheduler.failures == 2
+
+    def test_slow_cycles_never_overlap(self):
+        active = []
+        overlaps = []
+
+        def job():
+            active.append(1)
+            if len(active) > 1:
+                overlaps.append(1)
+            time.sleep(0.05)
+            active.pop()
+
+        scheduler = SyncScheduler(job, interval=0.01)
+        scheduler.run_forever(max_cycles=4)
+        assert scheduler.cycles == 4
+        assert overlaps == []
+
+    def test_stop_interrupts_wait(self):
+        scheduler = SyncScheduler(lambda: True, interval=60)
+        thread = threading.Thread(target=scheduler.run_forever)
+        thread.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        scheduler.stop()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert time.monotonic() - started < 5
+        assert scheduler.cycles == 1
+
+    def test_invalid_interval(self):
+        with pytest.raises(Exception):
+            SyncScheduler(lambda: True, interval=0)
+
+    @pytest.mark.skipif(fcntl is None, reason="需要 fcntl")
+    def test_lock_rejects_second_process(self, tmp_path):
+        lock_file = str(tmp_path / 'daemon.lock')
+        holder = SyncScheduler(lambda: True, interval=60, lock_file=lock_file)
+        second = SyncScheduler(lambda: True, interval=60, lock_file=lock_file)
+        errors = []
+
+        def job():
+            # 第一个调度器持有锁期间启动第二个
+            try:
+                second.run_forever(max_cycles=1)
+            except Exception as e:
+                errors.append(e)
+            return True
+
+        holder.job = job
+        holder.run_forever(max_cycles=1)
+        assert len(errors) == 1
+        assert second.cycles == 0
+        # 释放后可以再次获取
+        second.run_forever(max_cycles=1)
+        assert second.cycles == 1
@@ -0,0 +1,70 @@
+"""sharding.py 单元测试"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sharding import ShardProgress, resolve_shard_size, split_time_range
+
+
+class TestSplitTimeRange:
+    def test_no_split(self):
+        start = datetime(2024, 1, 1, 10)
+        end = datetime(2024, 1, 1, 12)
+        assert split_time_range(start, end, None) == [(start, end)]
+
+    def test_split_by_day_aligned(self):
+        start = datetime(2024, 1, 1, 10)
+        end = datetime(2024, 1, 3, 8)
+        shards = split_time_range(start, end, timedelta(days=1))
+        assert shards == [
+            (start, datetime(2024, 1, 2)),
+            (datetime(2024, 1, 2), datetime(2024, 1, 3)),
+            (datetime(2024, 1, 3), end),
+        ]
+
+    def test_shards_cover_range(self):
+        start = datetime(2024, 1, 1, 10, 30)
+        end = datetime(2024, 1, 1, 20, 15)
+        shards = split_time_range(start, end, timedelta(hours=1))
+        assert shards[0][0] == start
+        assert shards[-1][1] == end
+        for (_, prev_end), (next_start, _) in zip(shards, shards[1:]):
+            assert prev_end == next_start
+
+
+class TestResolveShardSize:
+    def test_auto(self):
+        start = datetime(2024, 1, 1)
+        assert resolve_shard_size('auto', start, start + timedelta(days=30)) == timedelta(days=1)
+        assert resolve_shard_size('auto', start, start + timedelta(hours=12)) == timedelta(hours=1)
+        assert resolve_shard_size('auto', start, start + timedelta(hours=2)) is None
+
+    def test_none(self):
+        start = datetime(2024, 1, 1)
+        assert resolve_shard_size('none', start, start + timedelta(days=30)) is None
+
+
+class TestShardProgress:
+    def test_failed_shard_retried_alone(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            progress = ShardProgress(os.path.join(tmp, "progress.json"))
+            shards = split_time_range(datetime(2024, 1, 1), datetime(2024, 1, 4), timedelta(days=1))
+            run_key = ShardProgress.run_key(datetime(2024, 1, 1), datetime(2024, 1, 4))
+
+            assert progress.start_run(run_key, shards) == shards
+            progress.mark(run_key, shards[0], 'done')
+            progress.mark(run_key, shards[1], 'failed', 'boom')
+            progress.mark(run_key, shards[2], 'done')
+            assert progress.finish_run(run_key) is False
+
+            assert progress.failed_runs() == [(run_key, None, [shards[1]])]
+            # 同一范围重跑时只返回未完成的分片
+            assert progress.start_run(run_key, shards) == [shards[1]]
+
+            progress.mark(run_key, shards[1], 'done')
+            assert progress.finish_run(run_key) is True
+            assert progress.failed_runs() == []
@@ -0,0 +1,169 @@
+"""state_store.py 单元测试"""
+
+import sys
+import os
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from state_store import HotSetStore, StateStore, TaskStateStore, content_hash
+
+
+class TestContentHash:
+    def test_hash_ignores_key_order(self):
+        assert content_hash({'a': 1, 'b': 2}) == content_hash({'b': 2, 'a': 1})
+        assert content_hash({'a': 1}) != content_hash({'a': 2})
+
+
+class TestStateStore:
+    def test_unknown_instance_returns_all_fields(self, tmp_path):
+        store = StateStore(str(tmp_path / 'state.json'))
+        assert store.diff('inst1', {'a': 1, 'b': None}) == {'a': 1}
+
+    def test_unchanged_returns_none(self, tmp_path):
+        store = StateStore(str(tmp_path / 'state.json'))
+        store.commit('inst1', {'a': 1, 'b': 'x'})
+        assert store.diff('inst1', {'b': 'x', 'a': 1}) is None
+
+    def test_changed_returns_only_changed_fields(self, tmp_path):
+        store = StateStore(str(tmp_path / 'state.json'))
+        store.commit('inst1', {'status': 'RUNNING', 'title': 't'})
+        assert store.diff('inst1', {'status': 'COMPLETED', 'title': 't', 'result': 'agree'}) == {
+            'status': 'COMPLETED', 'result': 'agree'}
+
+    def test_save_and_reload(self, tmp_path):
+        state_file = str(tmp_path / 'sub' / 'state.json')
+        store = StateStore(state_file)
+        store.commit('inst1', {'a': 1})
+        store.save()
+
+        reloaded = StateStore(state_file)
+        assert reloaded.diff('inst1', {'a': 1}) is None
+        reloaded.forget('inst1')
+        assert reloaded.diff('inst1', {'a': 1}) == {'a': 1}
+
+    def test_field_hashes(self, tmp_path):
+        store = StateStore(str(tmp_path / 'state.json'))
+        assert store.field_hashes('inst1') is None
+        store.commit('inst1', {'status': '已同意', 'title': 'x'})
+        assert store.field_hashes('inst1') == {'status': content_hash('已同意'), 'title': content_hash('x')}
+
+
+class TestTaskStateStore:
+    def test_lookup_new_changed_and_unchanged(self, tmp_path):
+        store = TaskStateStore(str(tmp_path / 'tasks.json'))
+        assert store.lookup('inst1', 'fp1', {'comment': ''}) == (True, None)
+
+        store.commit('inst1', 'fp1', 'rec1', {'comment': '', 'action_time': None})
+        assert store.lookup('inst1', 'fp1', {'comment': ''}) == (False, 'rec1')
+        assert store.lookup('inst1', 'fp1', {'comment': '同意'}) == (True, 'rec1')
+
+    def test_pending_task_reserved_until_commit_or_release(self, tmp_path):
+        store = TaskStateStore(str(tmp_path / 'tasks.json'))
+        assert store.lookup('inst1', 'fp1', {'comment': ''}) == (True, None)
+        # 写入完成前，其他线程（包括强制写入）跳过同一任务
+        assert store.lookup('inst1', 'fp1', {'comment': ''}) == (False, None)
+        assert store.lookup('inst1', 'fp1', {'comment': ''}, force=True) == (False, None)
+        store.release('inst1', 'fp1')
+        assert store.lookup('inst1', 'fp1', {'comment': ''}) == (True, None)
+        store.commit('inst1', 'fp1', 'rec1', {'comment': ''})
+        assert store.lookup('inst1', 'fp1', {'comment': ''}, force=True) == (True, 'rec1')
+
+    def test_concurrent_lookups_reserve_once(self, tmp_path):
+        store = TaskStateStore(str(tmp_path / 'tasks.json'))
+        barrier = threading.Barrier(8)
+        results = []
+
+        def lookup():
+            barrier.wait()
+            results.append(store.lookup('inst1', 'fp1', {'comment': ''})[0])
+
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == [False] * 7 + [True]
+
+    def test_save_and_reload(self, tmp_path):
+        state_file = str(tmp_path / 'tasks.json')
+        store = TaskStateStore(state_file)
+        store.commit('inst1', 'fp1', 'rec1', {'comment': ''})
+        store.save()
+        assert TaskStateStore(state_file).lookup('inst1', 'fp1', {'comment': ''}) == (False, 'rec1')
+
+    def test_seed_claims_existing_rows(self, tmp_path):
+        state_file = str(tmp_path / 'tasks.json')
+        store = TaskStateStore(state_file, match_fields=('node_name',))
+        assert store.needs_seed
+        store.ensure_seeded(lambda: [
+            ('inst1', 'rec1', {'instance_id': 'inst1', 'node_name': '节点0', 'approver': '张三'}),
+            ('inst1', 'rec2', {'instance_id': 'inst1', 'node_name': '节点1', 'approver': '李四'}),
+        ])
+        # 内容相同（空字段与缺失相同）的记录认领后跳过
+        fields = {'instance_id': 'inst1', 'node_name': '节点0', 'approver': '张三', 'comment': ''}
+        assert store.lookup('inst1', 'fp1', fields) == (False, 'rec1')
+        # 内容变化、节点相同的记录认领后原地更新
+        changed = {'instance_id': 'inst1', 'node_name': '节点1', 'approver': '李四', 'comment': '同意'}
+        assert store.lookup('inst1', 'fp2', changed) == (True, 'rec2')
+        store.commit('inst1', 'fp2', 'rec2', changed)
+        # 没有可认领的记录时新增
+        assert store.lookup('inst1', 'fp3', dict(fields, node_name='节点2')) == (True, None)
+
+        reloaded = TaskStateStore(state_file)
+        assert not reloaded.needs_seed
+        reloaded.ensure_seeded(lambda: pytest.fail("状态文件已存在时不再导入"))
+        assert reloaded.lookup('inst1', 'fp1', fields) == (False, 'rec1')
+
+    def test_seed_failure_not_retried(self, tmp_path):
+        store = TaskStateStore(str(tmp_path / 'tasks.json'))
+        calls = []
+
+        def loader():
+            calls.append(1)
+            raise Exception("list failed")
+
+        store.ensure_seeded(loader)
+        store.ensure_seeded(loader)
+        assert calls == [1]
+        assert store.lookup('inst1', 'fp1', {'comment': ''}) == (True, None)
+
+
+class TestHotSetStore:
+    TERMINAL = {'COMPLETED', 'TERMINATED'}
+
+    def test_terminal_instances_leave_set(self, tmp_path):
+        store = HotSetStore(str(tmp_path / 'hot.json'), self.TERMINAL)
+        assert store.track('inst1', 'RUNNING')
+        assert not store.track('inst2', 'COMPLETED')
+        assert store.size() == 1
+        assert store.contains('inst1') and not store.contains('inst2')
+        assert not store.track('inst1', 'TERMINATED')
+        assert store.size() == 0
+
+    def test_due_and_prune(self, tmp_path, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr('state_store.time.time', lambda: now[0])
+        store = HotSetStore(str(tmp_path / 'hot.json'), self.TERMINAL)
+        store.track('old', 'RUNNING')
+        now[0] = 1200.0
+        store.track('new', 'RUNNING')
+        assert store.due(300) == []
+        now[0] = 1400.0
+        assert store.due(300) == ['old']
+        now[0] = 1600.0
+        assert store.due(300) == ['old', 'new']
+        # 重新拉取后仍在进行中，加入时间不变
+        store.track('old', 'RUNNING')
+        assert store.due(300) == ['new']
+        assert store.prune(500) == 1
+        assert store.due(0) == ['new']
+
+    def test_save_and_reload(self, tmp_path):
+        state_file = str(tmp_path / 'hot.json')
+        store = HotSetStore(state_file, self.TERMINAL)
+        store.track('inst1', 'RUNNING')
+        store.save()
+        assert HotSetStore(state_file, self.TERMINAL).due(0) == ['inst1']
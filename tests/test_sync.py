@@ -0,0 +1,641 @@
+"""sync.py 单元测试（内存版钉钉/飞书客户端）"""
+
+import asyncio
+import itertools
+import json
+import re
+import signal
+import sys
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import sync
+from callback_server import Cipher, build_event_request, instance_event
+from sync import SyncManager
+
+START = datetime(2025, 1, 10)
+DAY = timedelta(days=1)
+
+
+class FakeBitable:
+    """内存版多维表格客户端"""
+
+    def __init__(self, auth=None):
+        self.tables = {}
+        self.calls = Counter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def rows(self, table_id):
+        with self._lock:
+            return dict(self.tables.get(table_id, {}))
+
+    def _new_id(self):
+        return f"rec{next(self._ids)}"
+
+    def find_record(self, app_token, table_id, field, value):
+        self.calls['find'] += 1
+        for record_id, fields in self.rows(table_id).items():
+            if fields.get(field) == value:
+                return {'record_id': record_id, 'fields': fields}
+        return None
+
+    def upsert_record(self, app_token, table_id, record_id, fields):
+        self.calls['upsert'] += 1
+        with self._lock:
+            table = self.tables.setdefault(table_id, {})
+            record_id = record_id or self._new_id()
+            table[record_id] = dict(table.get(record_id, {}), **fields)
+        return {'record_id': record_id}
+
+    def batch_create_records(self, app_token, table_id, records):
+        self.calls['batch_create'] += 1
+        created = []
+        with self._lock:
+            table = self.tables.setdefault(table_id, {})
+            for record in records:
+                record_id = self._new_id()
+                table[record_id] = dict(record['fields'])
+                created.append({'record_id': record_id, 'fields': record['fields']})
+        return created
+
+    def batch_update_records(self, app_token, table_id, records):
+        self.calls['batch_update'] += 1
+        self.updated_fields = [record['fields'] for record in records]
+        with self._lock:
+            table = self.tables.setdefault(table_id, {})
+            for record in records:
+                table[record['record_id']] = dict(table.get(record['record_id'], {}), **record['fields'])
+        return records
+
+    def list_records(self, app_token, table_id, filter=None, page_token=None, page_size=500):
+        self.calls['list'] += 1
+        ids = set(re.findall(r'"(.*?)"', filter)) if filter else None
+        items = [{'record_id': record_id, 'fields': fields} for record_id, fields in self.rows(table_id).items()
+                 if ids is None or fields.get('instance_id') in ids]
+        return {'items': items, 'has_more': False, 'page_token': None}
+
+    def delete(self, table_id, instance_id):
+        with self._lock:
+            table = self.tables[table_id]
+            for record_id in [key for key, fields in table.items() if fields.get('instance_id') == instance_id]:
+                del table[record_id]
+
+
+class FakeDingTalk:
+    """内存版钉钉审批接口（替换 DingTalkClient 的列表和详情请求）"""
+
+    def __init__(self, detail_delay=0.0):
+        self.instances = {}
+        self.detail_delay = detail_delay
+        self.calls = Counter()
+        self.detail_calls = Counter()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.peak_in_flight = 0
+
+    def add(self, instance_id, status='FINISHED', created=START, process_code='PROC-1', title=None, tasks=1):
+        create_ms = int(created.timestamp() * 1000)
+        self.instances[instance_id] = {
+            'process_instance_id': instance_id,
+            'process_code': process_code,
+            'title': title or f"审批 {instance_id}",
+            'status': status,
+            'create_time': create_ms,
+            'originator_userid': 'u0',
+            'originator_user_name': '发起人',
+            'tasks': [{'task_name': f"节点{k}", 'userid': f"u{k}", 'user_name': f"审批人{k}",
+                       'action_type': 'EXECUTE_TASK_NORMAL', 'create_time': create_ms + k,
+                       'finish_time': create_ms + k + 1000} for k in range(tasks)]
+        }
+        return self.instances[instance_id]
+
+    def install(self, client):
+        client.get_process_instances = self.get_process_instances
+        client.get_process_instance_detail = self.get_process_instance_detail
+
+    def install_async(self, async_client):
+        async def get_detail(instance_id):
+            with self._lock:
+                self._in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            try:
+                await asyncio.sleep(self.detail_delay)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+            return dict(self.instances[instance_id], tasks=[dict(task) for task in self.instances[instance_id]['tasks']])
+
+        async_client.get_process_instance_detail = get_detail
+
+    def get_process_instances(self, start_time, end_time, process_code=None, statuses=None, cursor=0, size=20):
+        self.calls['list'] += 1
+        selected = sorted(
+            (item for item in self.instances.values()
+             if int(start_time) <= item['create_time'] < int(end_time)
+             and (process_code is None or item['process_code'] == process_code)),
+            key=lambda item: item['create_time'])
+        page = [{key: item[key] for key in ('process_instance_id', 'status', 'title', 'create_time')}
+                for item in selected[cursor:cursor + size]]
+        return {'list': page, 'has_more': cursor + size < len(selected), 'next_cursor': cursor + size}
+
+    def get_process_instance_detail(self, instance_id):
+        with self._lock:
+            self.calls['detail'] += 1
+            self.detail_calls[instance_id] += 1
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+        try:
+            if self.detail_delay:
+                time.sleep(self.detail_delay)
+            if instance_id not in self.instances:
+                raise Exception(f"审批实例不存在: {instance_id}")
+            detail = dict(self.instances[instance_id])
+            detail['tasks'] = [dict(task) for task in detail['tasks']]
+            return detail
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+@pytest.fixture
+def make_manager(tmp_path, monkeypatch):
+    """创建使用内存版客户端的 SyncManager，状态文件全部写在临时目录"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sync, 'BitableClient', FakeBitable)
+    managers = []
+
+    def _make(dingtalk=None, callback=None, **sync_config):
+        config = {
+            'dingtalk': {'app_key': 'key', 'app_secret': 'secret'},
+            'feishu': {'app_id': 'app', 'app_secret': 'secret', 'app_token': 'app_token',
+                       'tables': {'main': 'main', 'action': 'action'}},
+            'sync': dict({'checkpoint_file': 'state/checkpoint.json', 'shard_unit': 'none',
+                          'write_behind': {'flush_interval': 0.05}}, **sync_config),
+            'notification': {'enabled': False}
+        }
+        if callback:
+            config['callback'] = callback
+        config_path = tmp_path / f"config{len(managers)}.yaml"
+        config_path.write_text(yaml.safe_dump(config, allow_unicode=True), encoding='utf-8')
+        manager = SyncManager(str(config_path))
+        (dingtalk or FakeDingTalk()).install(manager.dingtalk_client)
+        managers.append(manager)
+        return manager
+
+    yield _make
+    for manager in managers:
+        manager.close()
+
+
+def feishu_of(manager):
+    """SyncManager 使用的内存版多维表格（写入限流包装之下）"""
+    return getattr(manager.bitable, 'bitable', manager.bitable)
+
+
+class TestSyncInstances:
+    def test_details_fetched_concurrently(self, make_manager):
+        dingtalk = FakeDingTalk(detail_delay=0.05)
+        for k in range(12):
+            dingtalk.add(f"inst{k}", created=START + timedelta(minutes=k))
+        manager = make_manager(dingtalk, concurrency=4, batch_size=5)
+
+        stats = manager.sync_instances(START, START + DAY)
+        assert stats['total'] == 12 and stats['success'] == 12 and stats['failed'] == 0
+        assert 1 < dingtalk.peak_in_flight <= 4
+        assert dingtalk.calls['list'] == 3
+        bitable = feishu_of(manager)
+        assert sorted(fields['instance_id'] for fields in bitable.rows('main').values()) == \
+            sorted(f"inst{k}" for k in range(12))
+        assert len(bitable.rows('action')) == 12
+
+    def test_detail_failure_counted_without_stopping_others(self, make_manager):
+        dingtalk = FakeDingTalk()
+        for k in range(4):
+            dingtalk.add(f"inst{k}", created=START + timedelta(minutes=k))
+        manager = make_manager(dingtalk, concurrency=2)
+        original = dingtalk.get_process_instance_detail
+
+        def flaky(instance_id):
+            if instance_id == 'inst2':
+                raise Exception("detail failed")
+            return original(instance_id)
+
+        manager.dingtalk_client.get_process_instance_detail = flaky
+        stats = manager.sync_instances(START, START + DAY)
+        assert stats['total'] == 4 and stats['success'] == 3 and stats['failed'] == 1
+        assert len(feishu_of(manager).rows('main')) == 3
+
+
+class TestSyncInstanceIds:
+    def test_only_given_ids_synced_and_failures_collected(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('running', status='RUNNING')
+        dingtalk.add('done')
+        dingtalk.add('other')
+        manager = make_manager(dingtalk)
+
+        failed_ids = []
+        stats = manager.sync_instance_ids(['running', 'done', 'missing'], failed_ids)
+        assert stats['total'] == 3 and stats['success'] == 2 and stats['failed'] == 1
+        assert failed_ids == ['missing']
+        assert sorted(fields['instance_id'] for fields in feishu_of(manager).rows('main').values()) == \
+            ['done', 'running']
+        assert dingtalk.calls['list'] == 0 and 'other' not in dingtalk.detail_calls
+        assert manager.hot_set.contains('running') and not manager.hot_set.contains('done')
+
+
+@pytest.mark.skipif(Cipher is None, reason="需要 cryptography")
+class TestCallback:
+    CALLBACK = {'token': 'token', 'aes_key': 'abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG',
+                'host': '127.0.0.1', 'port': 0, 'debounce_seconds': 0.05}
+
+    def _post_events(self, manager, instance_ids):
+        server = manager.callback_server
+        url = f"http://127.0.0.1:{server.port}{server.path}"
+        for instance_id in instance_ids:
+            query, body = build_event_request(server.crypto, instance_event(instance_id))
+            assert requests.post(url, params=query, json=body, timeout=5).status_code == 200
+        deadline = time.monotonic() + 5
+        while manager.callback_queue.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_event_triggers_debounced_sync(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('inst0')
+        manager = make_manager(dingtalk, callback=self.CALLBACK)
+        manager.start_callback_server()
+        try:
+            self._post_events(manager, ['inst0', 'inst0'])
+        finally:
+            manager.stop_callback_server()
+        assert dingtalk.detail_calls == {'inst0': 1}
+        assert [fields['instance_id'] for fields in feishu_of(manager).rows('main').values()] == ['inst0']
+        assert manager.callback_server is None and manager.callback_queue is None
+
+    def test_failed_instance_retried_then_handed_to_hot_set(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('flaky')
+        manager = make_manager(dingtalk, callback=dict(self.CALLBACK, max_retries=2, retry_delay_seconds=0.01))
+        original = dingtalk.get_process_instance_detail
+
+        def flaky(instance_id):
+            if instance_id == 'lost' or dingtalk.detail_calls[instance_id] < 1:
+                dingtalk.detail_calls[instance_id] += 1
+                raise Exception("detail failed")
+            return original(instance_id)
+
+        manager.dingtalk_client.get_process_instance_detail = flaky
+        manager.start_callback_server()
+        try:
+            self._post_events(manager, ['flaky', 'lost'])
+            stats = manager.callback_queue.get_stats()
+        finally:
+            manager.stop_callback_server()
+        # 首次失败后重试成功；一直失败的实例重试用尽后交给活跃实例集合
+        assert dingtalk.detail_calls == {'flaky': 2, 'lost': 3}
+        assert [fields['instance_id'] for fields in feishu_of(manager).rows('main').values()] == ['flaky']
+        assert (stats['synced'], stats['retried'], stats['failed']) == (1, 3, 1)
+        assert manager.hot_set.contains('lost') and not manager.hot_set.contains('flaky')
+
+
+class TestAsyncDetail:
+    def test_details_fetched_by_coroutines_on_shared_write_path(self, make_manager):
+        dingtalk = FakeDingTalk(detail_delay=0.05)
+        for k in range(40):
+            dingtalk.add(f"inst{k}", created=START + timedelta(minutes=k))
+        manager = make_manager(dingtalk, pipeline={'async_detail': True, 'async_concurrency': 40})
+        dingtalk.install_async(manager.async_client)
+        with manager.build_pipeline() as pipeline:
+            stats = manager.sync_range(START, START + DAY, None, pipeline)
+        assert stats['total'] == 40 and stats['success'] == 40
+        assert len(feishu_of(manager).rows('main')) == 40
+        detail_stats = pipeline.get_stats()['detail']
+        assert detail_stats['workers'] == 40 and detail_stats['processed'] == 40
+        # 详情请求在同一个事件循环中并发等待，没有为每个请求占用一个线程
+        assert dingtalk.peak_in_flight > manager.concurrency
+
+    def test_falls_back_to_threads_without_aiohttp(self, make_manager, monkeypatch):
+        monkeypatch.setattr(sync, 'aiohttp', None)
+        manager = make_manager(pipeline={'async_detail': True})
+        assert manager.async_client is None
+        with manager.build_pipeline() as pipeline:
+            pass
+        assert pipeline.get_stats()['detail']['workers'] == manager.concurrency
+
+
+class TestSyncTemplates:
+    def test_templates_synced_with_separate_stats(self, make_manager):
+        dingtalk = FakeDingTalk()
+        for k in range(3):
+            dingtalk.add(f"a{k}", created=START + timedelta(minutes=k), process_code='PROC-A')
+        for k in range(2):
+            dingtalk.add(f"b{k}", created=START + timedelta(minutes=k), process_code='PROC-B')
+        dingtalk.add('other', created=START, process_code='PROC-OTHER')
+        manager = make_manager(dingtalk, templates=[{'process_code': 'PROC-B', 'priority': 2},
+                                                    {'process_code': 'PROC-A', 'priority': 1}])
+        assert [template['process_code'] for template in manager.templates] == ['PROC-A', 'PROC-B']
+
+        stats, template_stats = manager.sync_templates(START, START + DAY)
+        assert template_stats['PROC-A']['success'] == 3
+        assert template_stats['PROC-B']['success'] == 2
+        assert stats['total'] == 5 and stats['success'] == 5
+        assert 'other' not in {fields['instance_id'] for fields in feishu_of(manager).rows('main').values()}
+
+    def test_failed_template_does_not_stop_others(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('a0', process_code='PROC-A')
+        dingtalk.add('b0', process_code='PROC-B')
+        manager = make_manager(dingtalk, templates=['PROC-A', 'PROC-B'])
+        original = dingtalk.get_process_instances
+
+        def failing_list(start_time, end_time, process_code=None, **kwargs):
+            if process_code == 'PROC-A':
+                raise Exception("list failed")
+            return original(start_time, end_time, process_code, **kwargs)
+
+        manager.dingtalk_client.get_process_instances = failing_list
+        stats, template_stats = manager.sync_templates(START, START + DAY)
+        assert template_stats['PROC-A']['total'] == 0
+        assert template_stats['PROC-B']['success'] == 1
+        assert stats['success'] == 1
+
+
+class TestChangeDetection:
+    def test_unchanged_skipped_and_changed_written_partially(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('inst0', created=START)
+        dingtalk.add('inst1', created=START + timedelta(minutes=1))
+        manager = make_manager(dingtalk)
+        bitable = feishu_of(manager)
+
+        first = manager.sync_instances(START, START + DAY)
+        assert first['main_updated'] == 2 and first['action_inserted'] == 2
+
+        bitable.calls.clear()
+        second = manager.sync_instances(START, START + DAY)
+        assert second['main_skipped'] == 2 and second['main_updated'] == 0
+        assert second['action_skipped'] == 2 and second['action_inserted'] == 0
+        assert bitable.calls['batch_create'] == 0 and bitable.calls['batch_update'] == 0
+
+        dingtalk.instances['inst1']['title'] = '新标题'
+        third = manager.sync_instances(START, START + DAY)
+        assert third['main_updated'] == 1 and third['main_skipped'] == 1
+        assert bitable.updated_fields == [{'title': '新标题'}]
+        assert len(bitable.rows('main')) == 2
+
+    def test_diff_main_record(self, make_manager):
+        manager = make_manager()
+        main_data = {'instance_id': 'inst0', 'title': 'a', 'amount': None}
+        assert manager.diff_main_record(main_data) == {'instance_id': 'inst0', 'title': 'a'}
+        manager.state_store.commit('inst0', main_data)
+        assert manager.diff_main_record(main_data) == {}
+        assert manager.diff_main_record(dict(main_data, title='b')) == {'title': 'b'}
+        manager.force_write = True
+        assert manager.diff_main_record(main_data) == {'instance_id': 'inst0', 'title': 'a'}
+
+
+class TestTaskDeduplication:
+    def test_overlapping_syncs_of_same_instance_create_tasks_once(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('inst0', tasks=3)
+        manager = make_manager(dingtalk)
+        detail = dingtalk.get_process_instance_detail('inst0')
+        prepared = [('inst0',) + manager.prepare_instance_rows(detail)]
+
+        # 定时同步、回调和活跃实例复查在明细缓冲写出前各自写入了同一审批实例
+        barrier = threading.Barrier(3)
+        results = []
+
+        def write():
+            stats = manager.new_stats()
+            barrier.wait(timeout=5)
+            manager.write_instance_rows(prepared, stats)
+            results.append(stats)
+
+        threads = [threading.Thread(target=write) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        manager.flush_action_records()
+
+        assert sum(stats['action_inserted'] for stats in results) == 3
+        assert sum(stats['action_skipped'] for stats in results) == 6
+        actions = feishu_of(manager).rows('action').values()
+        assert sorted(fields['node_name'] for fields in actions) == ['节点0', '节点1', '节点2']
+
+        # 写入完成后再次同步，任务已提交，全部跳过
+        stats = manager.new_stats()
+        manager.write_instance_rows(prepared, stats)
+        manager.flush_action_records()
+        assert stats['action_skipped'] == 3 and len(feishu_of(manager).rows('action')) == 3
+
+    def test_failed_task_write_released_for_next_sync(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('inst0', tasks=2)
+        manager = make_manager(dingtalk)
+        bitable = feishu_of(manager)
+        create = bitable.batch_create_records
+
+        def failing_action_create(app_token, table_id, records):
+            if table_id == 'action':
+                raise ConnectionError("connection reset")
+            return create(app_token, table_id, records)
+
+        bitable.batch_create_records = failing_action_create
+        first = manager.sync_instance_ids(['inst0'])
+        assert first['action_failed'] == 2
+        bitable.batch_create_records = create
+        second = manager.sync_instance_ids(['inst0'])
+        assert second['action_inserted'] == 2
+        assert len(bitable.rows('action')) == 2
+
+    def test_existing_action_rows_claimed_when_task_state_enabled(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('inst0', tasks=2)
+        legacy = make_manager(dingtalk, task_state_file='')
+        legacy.sync_instance_ids(['inst0'])
+        assert len(feishu_of(legacy).rows('action')) == 2
+
+        dingtalk.instances['inst0']['tasks'][1]['comment'] = '同意'
+        manager = make_manager(dingtalk)
+        bitable = feishu_of(manager)
+        bitable.tables = {table_id: dict(rows) for table_id, rows in feishu_of(legacy).tables.items()}
+        stats = manager.sync_instance_ids(['inst0'])
+        # 首次启用任务写入状态：内容相同的已有记录跳过，内容变化的原地更新，不重复新增
+        assert (stats['action_inserted'], stats['action_updated'], stats['action_skipped']) == (0, 1, 1)
+        actions = bitable.rows('action').values()
+        assert sorted((fields['node_name'], fields['comment']) for fields in actions) == \
+            [('节点0', ''), ('节点1', '同意')]
+        assert bitable.calls['list'] == 1
+
+        manager.task_store.save()
+        restarted = make_manager(dingtalk)
+        assert not restarted.task_store.needs_seed
+
+    def test_failed_task_rows_journaled_and_replayed_after_restart(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('inst0', tasks=2)
+        manager = make_manager(dingtalk)
+        bitable = feishu_of(manager)
+        create = bitable.batch_create_records
+
+        def failing_action_create(app_token, table_id, records):
+            if table_id == 'action':
+                raise ConnectionError("connection reset")
+            return create(app_token, table_id, records)
+
+        bitable.batch_create_records = failing_action_create
+        stats = manager.sync_instances(START, START + DAY)
+        assert (stats['success'], stats['main_updated'], stats['action_failed']) == (1, 1, 2)
+        assert not bitable.rows('action')
+        # 主表写入状态已提交，失败的明细记录只能由写入日志补写
+        assert manager.writer.journal_size() == 1
+        manager.close()
+        assert os.path.exists('state/write_journal.json')
+
+        dingtalk.detail_calls.clear()
+        restarted = make_manager(dingtalk)
+        restarted_bitable = feishu_of(restarted)
+        replayed = restarted.replay_write_journal()
+        assert (replayed['total'], replayed['action_inserted'], replayed['main_updated']) == (1, 2, 0)
+        assert sorted(fields['node_name'] for fields in restarted_bitable.rows('action').values()) == \
+            ['节点0', '节点1']
+        assert not restarted_bitable.rows('main') and not dingtalk.detail_calls
+        assert restarted.writer.journal_size() == 0
+        restarted.save_write_state()
+        assert not os.path.exists('state/write_journal.json')
+
+
+class TestHotSet:
+    def test_running_instance_polled_until_terminal(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('running', status='RUNNING', tasks=1)
+        dingtalk.add('waiting', status='RUNNING', created=START + timedelta(minutes=1))
+        dingtalk.add('done', created=START + timedelta(minutes=2))
+        manager = make_manager(dingtalk, hot_set={'poll_interval_seconds': 60})
+        bitable = feishu_of(manager)
+
+        manager.sync_instances(START, START + DAY)
+        assert manager.hot_set.size() == 2 and not manager.hot_set.contains('done')
+        # 刚拉取过的实例未到复查时间
+        dingtalk.detail_calls.clear()
+        assert manager.poll_hot_set()['total'] == 0
+        assert not dingtalk.detail_calls
+
+        detail = dingtalk.instances['running']
+        detail['status'] = 'FINISHED'
+        detail['tasks'].append(dict(detail['tasks'][0], task_name='节点1', user_name='审批人1',
+                                    create_time=detail['create_time'] + 5000,
+                                    finish_time=detail['create_time'] + 6000))
+        manager.hot_poll_interval = 0
+        stats = manager.poll_hot_set()
+        assert stats['total'] == 2 and stats['success'] == 2
+        assert dingtalk.detail_calls == {'running': 1, 'waiting': 1}
+        assert not manager.hot_set.contains('running') and manager.hot_set.contains('waiting')
+        main = {fields['instance_id']: fields for fields in bitable.rows('main').values()}
+        assert main['running']['status'] == '已同意' and main['waiting']['status'] == '审批中'
+        assert len(bitable.rows('action')) == 4
+
+        # 到达终态后不再复查
+        dingtalk.detail_calls.clear()
+        manager.poll_hot_set()
+        assert dingtalk.detail_calls == {'waiting': 1}
+
+    def test_poll_skipped_while_another_in_progress(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('running', status='RUNNING')
+        manager = make_manager(dingtalk, hot_set={'poll_interval_seconds': 0})
+        manager.sync_instances(START, START + DAY)
+        dingtalk.detail_calls.clear()
+        with manager._hot_poll_lock:
+            assert manager.poll_hot_set()['total'] == 0
+        assert not dingtalk.detail_calls
+        assert manager.poll_hot_set()['total'] == 1
+
+
+class TestReconcile:
+    def test_clean_range_costs_only_list_requests_and_drift_repaired_per_bucket(self, make_manager):
+        dingtalk = FakeDingTalk()
+        for process_code in ('PROC-A', 'PROC-B'):
+            for day in range(3):
+                dingtalk.add(f"{process_code[-1].lower()}{day}", created=START + day * DAY + timedelta(hours=9),
+                             process_code=process_code)
+        manager = make_manager(dingtalk, templates=['PROC-A', 'PROC-B'])
+        bitable = feishu_of(manager)
+        manager.sync_templates(START, START + 3 * DAY)
+        assert len(bitable.rows('main')) == 6
+
+        dingtalk.detail_calls.clear()
+        bitable.calls.clear()
+        stats, report = manager.reconcile_range(START, START + 3 * DAY)
+        assert report['buckets'] == 6 and report['source_digest'] == report['target_digest']
+        assert report['mismatched_buckets'] == [] and report['repaired']['total'] == 0
+        assert stats['total'] == 0 and not dingtalk.detail_calls
+        assert not (bitable.calls['batch_create'] or bitable.calls['batch_update'] or bitable.calls['upsert'])
+
+        # 一个分桶中的实例状态变化，另一个分桶中的主表记录被手工删除
+        dingtalk.instances['a1']['status'] = 'TERMINATED'
+        bitable.delete('main', 'b2')
+        stats, report = manager.reconcile_range(START, START + 3 * DAY)
+        assert report['changed'] == ['a1'] and report['missing'] == ['b2']
+        assert sorted((bucket['template'], bucket['day'], bucket['instances'])
+                      for bucket in report['mismatched_buckets']) == \
+            [('PROC-A', '2025-01-11', 1), ('PROC-B', '2025-01-12', 1)]
+        assert dingtalk.detail_calls == {'a1': 1, 'b2': 1}
+        assert stats['total'] == 2 and stats['success'] == 2
+        main = {fields['instance_id']: fields for fields in bitable.rows('main').values()}
+        assert len(main) == 6 and main['a1']['status'] == '已拒绝' and 'b2' in main
+        with open('state/reconcile_report.json', encoding='utf-8') as f:
+            assert json.load(f)['missing'] == ['b2']
+
+        dingtalk.detail_calls.clear()
+        _, report = manager.reconcile_range(START, START + 3 * DAY)
+        assert report['mismatched_buckets'] == [] and not dingtalk.detail_calls
+
+
+class TestDaemon:
+    def test_repeats_until_sigterm_and_keeps_clients_warm(self, make_manager):
+        dingtalk = FakeDingTalk()
+        dingtalk.add('recent', status='RUNNING', created=datetime.now() - timedelta(hours=1))
+        manager = make_manager(dingtalk, daemon={'interval_seconds': 0.05, 'jitter_seconds': 0,
+                                                 'lock_file': 'state/daemon.lock'},
+                               hot_set={'poll_interval_seconds': 0.05})
+        client = manager.dingtalk_client
+        handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+        runs = []
+        run = manager.run
+
+        def counted_run(**kwargs):
+            runs.append(kwargs)
+            # 第一轮失败不应终止常驻进程
+            ok = run(**kwargs) and len(runs) > 1
+            if len(runs) == 3:
+                os.kill(os.getpid(), signal.SIGTERM)
+            return ok
+
+        manager.run = counted_run
+        try:
+            manager.run_daemon()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        assert runs == [{'exit_on_error': False}] * 3
+        assert manager.dingtalk_client is client
+        assert [fields['instance_id'] for fields in feishu_of(manager).rows('main').values()] == ['recent']
+        # 每轮一次列表请求；审批中的实例留在活跃实例集合中
+        assert dingtalk.calls['list'] == 3
+        assert manager.hot_set.contains('recent')
+        assert manager.writer._closed
+        assert os.path.exists('state/daemon.lock')
@@ -0,0 +1,40 @@
+"""token_cache.py 单元测试"""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from token_cache import TokenCache
+
+
+class TestTokenCache:
+    def test_load_missing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TokenCache(os.path.join(tmp, "token.json"), key="app")
+            assert cache.load() is None
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "token.json")
+            TokenCache(path, key="app").save("tok", 1234.5)
+            # 新实例（模拟下一次运行）可以读取
+            assert TokenCache(path, key="app").load() == ("tok", 1234.5)
+
+    def test_keys_isolated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "token.json")
+            TokenCache(path, key="a").save("tok-a", 1.0)
+            TokenCache(path, key="b").save("tok-b", 2.0)
+            assert TokenCache(path, key="a").load() == ("tok-a", 1.0)
+            assert TokenCache(path, key="b").load() == ("tok-b", 2.0)
+
+    def test_invalidate_only_matching_token(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TokenCache(os.path.join(tmp, "token.json"), key="app")
+            cache.save("new", 1.0)
+            cache.invalidate("old")
+            assert cache.load() == ("new", 1.0)
+            cache.invalidate("new")
+            assert cache.load() is None
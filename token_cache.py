@@ -0,0 +1,106 @@
+"""访问令牌缓存模块 - 持久化到本地文件，供连续运行和同机进程复用"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Tuple
+
+from logger import setup_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持 fcntl，退化为进程内单飞
+    fcntl = None
+
+logger = setup_logger(__name__)
+
+
+class TokenCache:
+    """令牌文件缓存，按应用Key区分"""
+
+    def __init__(self, cache_file: str, key: str):
+        """
+        初始化令牌缓存
+
+        Args:
+            cache_file: 缓存文件路径
+            key: 缓存键（通常为应用Key）
+        """
+        self.cache_file = cache_file
+        self.key = key
+        self._lock = threading.Lock()
+        Path(cache_file).parent.mkdir(parents=True, exist_ok=True)
+
+    def _read_all(self) -> dict:
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f"读取令牌缓存失败: {e}")
+            return {}
+
+    def _write_all(self, data: dict):
+        # 先写临时文件再替换，避免其他进程读到半截内容；令牌文件仅当前用户可读
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.cache_file)
+        except (IOError, OSError) as e:
+            logger.warning(f"保存令牌缓存失败: {e}")
+
+    def load(self) -> Optional[Tuple[str, float]]:
+        """
+        加载缓存的令牌
+
+        Returns:
+            (访问令牌, 过期时间戳)，不存在时返回None
+        """
+        entry = self._read_all().get(self.key)
+        if not entry or not entry.get('access_token'):
+            return None
+        return entry['access_token'], float(entry.get('expires_at', 0))
+
+    def save(self, access_token: str, expires_at: float):
+        """
+        保存令牌
+
+        Args:
+            access_token: 访问令牌
+            expires_at: 过期时间戳（秒）
+        """
+        with self._lock:
+            data = self._read_all()
+            data[self.key] = {'access_token': access_token, 'expires_at': expires_at}
+            self._write_all(data)
+
+    def invalidate(self, stale_token: str):
+        """
+        删除已失效的令牌（仅当缓存中仍是该令牌时）
+
+        Args:
+            stale_token: 已失效的令牌
+        """
+        with self._lock:
+            data = self._read_all()
+            entry = data.get(self.key)
+            if entry and entry.get('access_token') == stale_token:
+                del data[self.key]
+                self._write_all(data)
+
+    @contextmanager
+    def refresh_lock(self):
+        """跨进程刷新锁：同一时刻只有一个进程请求新令牌"""
+        if not fcntl:
+            yield
+            return
+        with open(f"{self.cache_file}.lock", 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)